@@ -0,0 +1,131 @@
+"""Benchmark context-image rendering: the legacy pdf2image pipeline vs in-process PyMuPDF.
+
+Usage:
+    python benchmarks/bench_image_render.py [--pages 800] [--highlights 60]
+
+Each mode runs in a fresh subprocess so wall time and peak RSS are measured
+independently. The legacy mode needs poppler's pdftoppm and is skipped without it.
+"""
+
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "scripts")))
+
+
+def make_pdf(path, pages):
+    import fitz
+
+    doc = fitz.open()
+    paragraph = "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 12
+    for page_num in range(pages):
+        page = doc.new_page(width=595, height=842)
+        page.insert_textbox(fitz.Rect(50, 50, 545, 792), f"Page {page_num + 1}\n\n" + paragraph * 4, fontsize=10)
+    doc.save(path)
+    doc.close()
+
+
+def highlight_pages(pages, highlights, seed=0):
+    """Clusters of highlights a few pages apart, like a densely read chapter"""
+    rng = random.Random(seed)
+    result = []
+    while len(result) < highlights:
+        start = rng.randint(1, pages)
+        result.extend(min(pages, start + offset) for offset in range(0, 8, 2))
+    return sorted(result[:highlights])
+
+
+def legacy_create_context_image(output_dir, pdf_path, page_number, pdf_id, zoom_factor=2):
+    """The pre-PyMuPDF implementation of PDFImageHandler.create_context_image"""
+    import hashlib
+    from PyPDF2 import PdfReader
+    from pdf2image import convert_from_path
+    from PIL import Image, ImageOps
+
+    image_id = hashlib.md5(f"{pdf_id}_{page_number}".encode()).hexdigest()[:8]
+    output_path = os.path.join(output_dir, f"context_{image_id}.jpg")
+    if os.path.exists(output_path):
+        return
+    total_pages = len(PdfReader(pdf_path).pages)
+    start_page = max(page_number - 3, 1)
+    end_page = min(page_number + 3, total_pages)
+    images = convert_from_path(pdf_path, first_page=start_page, last_page=end_page)
+    zoomed = [image.resize((image.width * zoom_factor, image.height * zoom_factor), Image.LANCZOS) for image in images]
+    concatenated = Image.new('RGB', (max(i.width for i in zoomed), sum(i.height for i in zoomed)))
+    y = 0
+    for image in zoomed:
+        concatenated.paste(image, (0, y))
+        y += image.height
+    ImageOps.exif_transpose(concatenated).save(output_path, "JPEG", quality=10, optimize=True)
+
+
+def run_mode(mode, pdf_path, pages):
+    output_dir = tempfile.mkdtemp()
+    start = time.perf_counter()
+    if mode == "legacy":
+        for page in pages:
+            legacy_create_context_image(output_dir, pdf_path, page, "bench")
+        renders = None
+    else:
+        from image_handler import PDFImageHandler
+
+        handler = PDFImageHandler(output_dir=output_dir)
+        for page in pages:
+            handler.create_context_image(pdf_path, page, "bench")
+        renders = handler.page_renders
+        handler.close()
+    elapsed = time.perf_counter() - start
+    output_bytes = sum(entry.stat().st_size for entry in os.scandir(output_dir))
+    shutil.rmtree(output_dir)
+    # ru_maxrss is in KiB on Linux
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    if mode == "legacy":
+        # pdftoppm does the rasterizing in child processes
+        peak_rss_mb = max(peak_rss_mb, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024)
+    print(json.dumps({
+        "mode": mode,
+        "seconds": round(elapsed, 3),
+        "peak_rss_mb": round(peak_rss_mb, 1),
+        "page_renders": renders,
+        "output_mb": round(output_bytes / 1e6, 2),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=800)
+    parser.add_argument("--highlights", type=int, default=60)
+    parser.add_argument("--mode", choices=["legacy", "pymupdf"], help=argparse.SUPPRESS)
+    parser.add_argument("--pdf", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    pages = highlight_pages(args.pages, args.highlights)
+    if args.mode:
+        run_mode(args.mode, args.pdf, pages)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pdf_path = os.path.join(tmp_dir, "bench.pdf")
+        make_pdf(pdf_path, args.pages)
+        modes = ["pymupdf"]
+        if shutil.which("pdftoppm"):
+            modes.insert(0, "legacy")
+        else:
+            print("pdftoppm not found; skipping the legacy pdf2image mode")
+        for mode in modes:
+            subprocess.run([
+                sys.executable, __file__, "--mode", mode, "--pdf", pdf_path,
+                "--pages", str(args.pages), "--highlights", str(args.highlights),
+            ], check=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Benchmark cold-start import time of the CLI entry points with `python -X importtime`.
+
+Usage:
+    python benchmarks/bench_import_time.py [--runs 5] [--budget-scale 1.0]
+
+Each entry point is imported in a fresh interpreter several times. The best run
+is compared against its budget, and the slowest dependencies are listed. Exits
+with status 1 when an entry point is over budget, so it can guard cold start in CI.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+SCRIPTS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "scripts"))
+
+# Entry point -> cold-start budget in milliseconds (cumulative import time of the module)
+BUDGETS_MS = {
+    "highlight_manager": 60,  # --delete-last / --delete-history
+    "main": 120,
+    "monitor_files": 120,
+    "library": 120,
+}
+
+
+def import_times(module):
+    """{module: cumulative microseconds} from one `-X importtime` run"""
+    statement = f"import {module}" if module else "pass"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=SCRIPTS_DIR, capture_output=True, text=True, check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-scale", type=float, default=1.0, help="Multiply every budget, e.g. for slow CI machines")
+    parser.add_argument("--top", type=int, default=5, help="Slowest dependencies listed per entry point")
+    args = parser.parse_args()
+
+    # Modules the interpreter loads at startup (site, .pth hooks) are not the entry point's
+    startup = set(import_times(None))
+    over_budget = []
+    print(f"{'entry point':<20} {'best ms':>8} {'budget':>8}")
+    for module, budget in BUDGETS_MS.items():
+        runs = [import_times(module) for _ in range(args.runs)]
+        best = min(runs, key=lambda times: times[module])
+        best_ms = best[module] / 1000
+        budget *= args.budget_scale
+        status = "" if best_ms <= budget else "  OVER BUDGET"
+        print(f"{module:<20} {best_ms:>8.1f} {budget:>8.0f}{status}")
+        dependencies = sorted(
+            ((name, us) for name, us in best.items() if name != module and "." not in name and name not in startup),
+            key=lambda item: -item[1],
+        )
+        for name, us in dependencies[:args.top]:
+            print(f"    {name:<24} {us / 1000:>8.1f}")
+        if status:
+            over_budget.append(module)
+
+    if over_budget:
+        sys.exit(f"Over the cold-start budget: {', '.join(over_budget)}")
+
+
+if __name__ == "__main__":
+    main()
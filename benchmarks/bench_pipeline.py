@@ -0,0 +1,289 @@
+"""Benchmark the whole pipeline offline, against a stored baseline.
+
+Usage:
+    python benchmarks/bench_pipeline.py [--scenarios small medium large] [--save-baseline]
+    python benchmarks/bench_pipeline.py --pages 500 --highlights-per-page 2 --failure-rate 0.1
+
+Each scenario generates a synthetic highlighted book (see synthetic_pdf.py) and,
+in a fresh process, runs:
+
+- the main Pipeline end to end against FakeLLMProvider, with profiling on: wall
+  time, per-stage time (p50/p95) and the peak RSS of the process and its workers
+- the scan, context, LLM and packaging stages again one by one under
+  tracemalloc, for the peak Python memory of each
+
+Results are compared with the baseline file and every metric that got worse by
+more than --threshold is reported; the exit status is 1 when there is one.
+--save-baseline stores the results instead. Nothing needs a network: images are
+rendered and decks written inside a temporary directory.
+"""
+
+import argparse
+import contextlib
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.abspath(os.path.join(BENCH_DIR, "..", "scripts")))
+sys.path.append(BENCH_DIR)
+
+from synthetic_pdf import make_book
+
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+
+SCENARIOS = {
+    "small": {"pages": 10, "highlights_per_page": 3, "multiline_ratio": 0.3},
+    "medium": {"pages": 200, "highlights_per_page": 0.5, "multiline_ratio": 0.3},
+    "large": {"pages": 2000, "highlights_per_page": 0.05, "multiline_ratio": 0.3},
+}
+
+# Differences below these are noise, whatever the relative change
+MIN_REGRESSION = {"seconds": 0.05, "mb": 2.0}
+
+
+def _peak_rss_mb(who):
+    return resource.getrusage(who).ru_maxrss / 1024  # KiB on Linux
+
+
+def _end_to_end(pdf_path, work_dir, options, provider):
+    from main import Pipeline
+
+    pipeline = Pipeline(
+        "English",
+        batch_size=options["batch_size"],
+        concurrency=options["concurrency"],
+        requests_per_minute=0,
+        prompt_token_budget=options["prompt_token_budget"],
+        use_cache=False,
+        image_workers=options["image_workers"],
+        scan_workers=options["scan_workers"],
+        profile=True,
+        llm_provider=provider,
+        db_path=os.path.join(work_dir, "end_to_end.db"),
+    )
+    start = time.perf_counter()
+    try:
+        summary = pipeline.process_pdf(pdf_path)
+    finally:
+        pipeline.close()
+    seconds = time.perf_counter() - start
+    return summary, seconds, pipeline.profiler.summary()
+
+
+def _stage_memory(pdf_path, work_dir, options, provider):
+    """{stage: peak MB of Python allocations} with each stage run on its own"""
+    from main import DEFAULT_CONTEXT_TOKEN_BUDGET
+    from pdf_handler import PDFHandler
+    from highlight_context_extractor import HighlightContextExtractor
+    from flashcard_generator import FlashcardGenerator
+    from flashcard_output_to_anki_handler import FlashcardOutputHandler
+    from storage import Storage
+
+    peaks = {}
+
+    @contextlib.contextmanager
+    def measure(stage):
+        tracemalloc.reset_peak()
+        yield
+        peaks[stage] = tracemalloc.get_traced_memory()[1] / 1e6
+
+    tracemalloc.start()
+    try:
+        with measure("annotation_scan"):
+            pdf_handler = PDFHandler(pdf_path, scan_workers=1)
+            highlights = list(pdf_handler.iter_highlights())
+        with measure("context_build"):
+            extractor = HighlightContextExtractor(pdf_handler, token_budget=DEFAULT_CONTEXT_TOKEN_BUDGET)
+            contexts = extractor.get_contexts(highlights)
+            for context in contexts:
+                context.context
+        with measure("llm_call"):
+            storage = Storage(os.path.join(work_dir, "stages.db"))
+            generator = FlashcardGenerator(provider, max_concurrency=options["concurrency"], storage=storage)
+            results = generator.generate_flashcards(
+                contexts, "English", max_prompt_tokens=options["prompt_token_budget"],
+                page_text=pdf_handler.get_page_text,
+            )
+        with measure("packaging"):
+            output_handler = FlashcardOutputHandler()
+            for flashcards in results:
+                output_handler.add_flashcards(flashcards, pdf_path)
+            output_handler.write_deck("stages")
+            output_handler.close()
+        storage.close()
+        pdf_handler.close()
+    finally:
+        tracemalloc.stop()
+    return peaks
+
+
+def run_scenario(config, options):
+    """Run one scenario in this (fresh) process and return its results"""
+    from fake_provider import FakeLLMProvider
+
+    def provider():
+        return FakeLLMProvider(
+            latency=options["latency"], failure_rate=options["failure_rate"], seed=options["seed"]
+        )
+
+    # The injected failures would log a retry warning each
+    logging.disable(logging.WARNING)
+    with tempfile.TemporaryDirectory() as work_dir:
+        # Context images and decks are written to the working directory
+        os.chdir(work_dir)
+        pdf_path = os.path.join(work_dir, "book.pdf")
+        highlights = make_book(pdf_path, seed=options["seed"], **config)
+
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            # End to end first, so the peak RSS is not inflated by tracemalloc
+            end_to_end_provider = provider()
+            summary, seconds, stages = _end_to_end(pdf_path, work_dir, options, end_to_end_provider)
+            rss_mb = _peak_rss_mb(resource.RUSAGE_SELF)
+            workers_rss_mb = _peak_rss_mb(resource.RUSAGE_CHILDREN)
+            peaks = _stage_memory(pdf_path, work_dir, options, provider())
+
+    if summary["cards"] != highlights:
+        raise RuntimeError(f"Expected one card per highlight ({highlights}), got {summary['cards']}")
+    return {
+        "highlights": highlights,
+        "llm_calls": end_to_end_provider.calls,
+        "injected_failures": end_to_end_provider.failures,
+        "end_to_end": {"seconds": seconds, "peak_rss_mb": rss_mb, "workers_peak_rss_mb": workers_rss_mb},
+        "stages": {
+            stage: {
+                "seconds": stages.get(stage, {}).get("total", 0.0),
+                "p50_ms": stages.get(stage, {}).get("p50", 0.0) * 1000,
+                "p95_ms": stages.get(stage, {}).get("p95", 0.0) * 1000,
+                **({"peak_mb": peaks[stage]} if stage in peaks else {}),
+            }
+            for stage in list(stages) + [stage for stage in peaks if stage not in stages]
+        },
+    }
+
+
+def metrics(result):
+    """Flat {name: value} of the numbers compared against the baseline"""
+    flat = {f"end_to_end.{key}": value for key, value in result["end_to_end"].items()}
+    for stage, values in result["stages"].items():
+        for key in ("seconds", "peak_mb"):
+            if key in values:
+                flat[f"{stage}.{key}"] = values[key]
+    return flat
+
+
+def regressions(current, baseline, threshold):
+    """[(metric, baseline, current)] for every metric worse by more than `threshold` (a ratio)"""
+    worse = []
+    for name, value in current.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        floor = MIN_REGRESSION["seconds" if name.endswith("seconds") else "mb"]
+        if value > base * (1 + threshold) and value - base > floor:
+            worse.append((name, base, value))
+    return worse
+
+
+def print_result(name, config, result):
+    print(f"\n== {name}: {config['pages']} pages, {result['highlights']} highlights, "
+          f"{result['llm_calls']} LLM calls ({result['injected_failures']} failed and retried)")
+    end_to_end = result["end_to_end"]
+    print(f"end to end {end_to_end['seconds']:.2f}s, peak RSS {end_to_end['peak_rss_mb']:.0f} MB "
+          f"(workers {end_to_end['workers_peak_rss_mb']:.0f} MB)")
+    print(f"{'Stage':<16} {'Total s':>8} {'p50 ms':>8} {'p95 ms':>8} {'Peak MB':>8}")
+    for stage, values in result["stages"].items():
+        peak = f"{values['peak_mb']:>8.1f}" if "peak_mb" in values else f"{'-':>8}"
+        print(f"{stage:<16} {values['seconds']:>8.2f} {values['p50_ms']:>8.1f} {values['p95_ms']:>8.1f} {peak}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=["small", "medium"])
+    parser.add_argument("--pages", type=int, help="Run one custom scenario with this many pages instead")
+    parser.add_argument("--highlights-per-page", type=float, default=1.0)
+    parser.add_argument("--multiline-ratio", type=float, default=0.3)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds per fake LLM call")
+    parser.add_argument("--failure-rate", type=float, default=0.05, help="Share of prompts that fail once with a rate limit")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--prompt-token-budget", type=int)
+    parser.add_argument("--image-workers", type=int)
+    parser.add_argument("--scan-workers", type=int)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the baseline")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Relative slowdown or memory growth reported as a regression")
+    args = parser.parse_args()
+
+    if args.pages:
+        scenarios = {"custom": {
+            "pages": args.pages, "highlights_per_page": args.highlights_per_page,
+            "multiline_ratio": args.multiline_ratio,
+        }}
+    else:
+        scenarios = {name: SCENARIOS[name] for name in args.scenarios}
+    options = {
+        key: getattr(args, key) for key in (
+            "latency", "failure_rate", "seed", "concurrency", "batch_size",
+            "prompt_token_budget", "image_workers", "scan_workers",
+        )
+    }
+
+    results = {}
+    for name, config in scenarios.items():
+        # A fresh process per scenario, so imports, caches and peak RSS start from zero
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            result = executor.submit(run_scenario, config, options).result()
+        print_result(name, config, result)
+        results[name] = {"config": {**config, **options}, "result": result}
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.setdefault("scenarios", {}).update(results)
+        baseline["machine"] = {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()}
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"\nBaseline saved to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}; run with --save-baseline to create one")
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+
+    found = []
+    for name, entry in results.items():
+        stored = baseline.get("scenarios", {}).get(name)
+        if stored is None:
+            print(f"\n{name}: not in the baseline")
+            continue
+        if stored["config"] != entry["config"]:
+            print(f"\n{name}: run with different settings than the baseline, not compared")
+            continue
+        for metric, base, value in regressions(metrics(entry["result"]), metrics(stored["result"]), args.threshold):
+            found.append((name, metric, base, value))
+
+    if not found:
+        print(f"\nNo regressions over {args.threshold:.0%} against {args.baseline}")
+        return
+    print(f"\nRegressions over {args.threshold:.0%}:")
+    for name, metric, base, value in found:
+        print(f"  {name} {metric}: {base:.2f} -> {value:.2f} ({value / base - 1:+.0%})")
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
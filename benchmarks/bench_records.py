@@ -0,0 +1,104 @@
+"""Benchmark per-highlight memory: the legacy dict records vs the slotted records.
+
+Usage:
+    python benchmarks/bench_records.py [--pages 400] [--highlights-per-page 12]
+
+Builds the contexts and flashcards of an annotation-heavy book both ways, holding
+all of them at once, and reports the traced allocations per highlight. Page text
+is synthetic, so no PDF is needed.
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "scripts")))
+
+import fitz  # PyMuPDF
+from records import Context, Flashcard, Highlight
+
+CARDS_PER_HIGHLIGHT = 2
+
+
+class SyntheticPages:
+    """Page text store standing in for PDFHandler"""
+
+    def __init__(self, pages):
+        self.pages = [f"Page {n}\n" + "Lorem ipsum dolor sit amet. " * 110 for n in range(pages)]
+
+    def get_text_by_pages(self, start_page, end_page):
+        return "".join(self.pages[start_page:end_page + 1])
+
+
+def highlight_specs(pages, per_page):
+    for page in range(1, pages + 1):
+        for n in range(per_page):
+            y = 50 + 60 * n
+            yield f"{page:05d}{n:03d}" + "0" * 24, f"highlighted sentence {n} on page {page}", page, (50.0, y, 545.0, y + 12)
+
+
+def build_legacy(store, pages, per_page):
+    """Dicts with a live fitz.Rect, a context string per window and copied flashcard fields"""
+    contexts, flashcards = [], []
+    window, context_text = None, None
+    for highlight_id, text, page, rect in highlight_specs(pages, per_page):
+        highlight = {"highlight_id": highlight_id, "text": text, "page": page, "pdf_id": "pdf", "rect": fitz.Rect(*rect)}
+        start, end = max(page - 2, 0), min(page, pages - 1)
+        if window != (start, end):
+            window = (start, end)
+            context_text = store.get_text_by_pages(start, end)
+        context = {
+            "highlight": highlight["text"], "highlight_id": highlight_id, "context": context_text,
+            "page": page, "start_page": start, "end_page": end, "pdf_id": "pdf",
+            "rect": highlight["rect"], "pdf_path": "/books/book.pdf",
+        }
+        contexts.append(context)
+        for n in range(CARDS_PER_HIGHLIGHT):
+            flashcards.append({
+                "question": f"Question {n}", "answer": f"Answer {n}", "highlight_id": highlight_id,
+                "page": page, "pdf_id": "pdf", "rect": context["rect"], "pdf_path": context["pdf_path"],
+            })
+    return contexts, flashcards
+
+
+def build_records(store, pages, per_page):
+    contexts, flashcards = [], []
+    for highlight_id, text, page, rect in highlight_specs(pages, per_page):
+        highlight = Highlight(highlight_id, text, page, "pdf", rect)
+        context = Context(highlight, max(page - 2, 0), min(page, pages - 1), store, "/books/book.pdf")
+        contexts.append(context)
+        for n in range(CARDS_PER_HIGHLIGHT):
+            flashcards.append(Flashcard(f"Question {n}", f"Answer {n}", highlight, context.pdf_path))
+    return contexts, flashcards
+
+
+def measure(build, store, pages, per_page):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build(store, pages, per_page)
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current, peak, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=400)
+    parser.add_argument("--highlights-per-page", type=int, default=12)
+    args = parser.parse_args()
+
+    store = SyntheticPages(args.pages)
+    highlights = args.pages * args.highlights_per_page
+    print(f"{highlights} highlights on {args.pages} pages, {CARDS_PER_HIGHLIGHT} flashcards each")
+    print(f"{'records':<10} {'bytes/highlight':>16} {'peak MB':>9} {'build s':>8}")
+    for name, build in [("legacy", build_legacy), ("slotted", build_records)]:
+        current, peak, elapsed = measure(build, store, args.pages, args.highlights_per_page)
+        print(f"{name:<10} {current / highlights:>16.0f} {peak / 1e6:>9.1f} {elapsed:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
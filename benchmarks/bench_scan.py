@@ -0,0 +1,70 @@
+"""Benchmark highlight scanning: serial vs page shards in worker processes.
+
+Usage:
+    python benchmarks/bench_scan.py [--pages 1500] [--highlights-per-page 4] [--workers 1 2 4 8]
+
+Scans the same synthetic book with each worker count, checks that every mode
+returns the serial scan's highlight IDs, and reports the speedup.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "scripts")))
+
+import fitz  # PyMuPDF
+from pdf_handler import PDFHandler
+
+
+def make_pdf(path, pages, highlights_per_page):
+    doc = fitz.open()
+    sentence = "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor."
+    for page_num in range(pages):
+        page = doc.new_page(width=595, height=842)
+        for line in range(50):
+            page.insert_text(fitz.Point(50, 60 + 15 * line), f"{page_num}.{line} {sentence}", fontsize=9)
+        for n in range(highlights_per_page):
+            page.add_highlight_annot(page.search_for(f"{page_num}.{n * 10} {sentence}"))
+    doc.save(path)
+    doc.close()
+
+
+def scan(pdf_path, workers):
+    pdf_handler = PDFHandler(pdf_path, scan_workers=workers)
+    pdf_handler.parallel_scan_min_pages = 0
+    start = time.perf_counter()
+    highlight_ids = [highlight.highlight_id for highlight in pdf_handler.iter_highlights()]
+    elapsed = time.perf_counter() - start
+    pdf_handler.close()
+    return highlight_ids, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=1500)
+    parser.add_argument("--highlights-per-page", type=int, default=4)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pdf_path = os.path.join(tmp_dir, "bench.pdf")
+        make_pdf(pdf_path, args.pages, args.highlights_per_page)
+        print(f"{args.pages} pages, {args.pages * args.highlights_per_page} highlights, {os.cpu_count()} CPUs")
+        print(f"{'workers':>7} {'seconds':>8} {'speedup':>8}")
+
+        serial_ids, serial_seconds = scan(pdf_path, 1)
+        print(f"{1:>7} {serial_seconds:>8.2f} {1.0:>7.2f}x")
+        for workers in args.workers:
+            if workers <= 1:
+                continue
+            highlight_ids, seconds = scan(pdf_path, workers)
+            if highlight_ids != serial_ids:
+                raise SystemExit(f"{workers} workers returned different highlight IDs than the serial scan")
+            print(f"{workers:>7} {seconds:>8.2f} {serial_seconds / seconds:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
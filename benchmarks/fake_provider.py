@@ -0,0 +1,78 @@
+"""Offline LLMProvider for the benchmarks: fixed latency, deterministic failures.
+
+Answers single-highlight prompts with one Q/A pair and batched prompts with a
+tagged section per highlight, so the whole pipeline runs without a network.
+"""
+
+import hashlib
+import os
+import sys
+import threading
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "scripts")))
+
+from flashcard_generator import LLMProvider
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers):
+        self.status_code = status_code
+        self.headers = headers
+
+
+class FakeRateLimitError(Exception):
+    """A 429 shaped like the provider SDKs' errors, asking for a short fixed wait"""
+
+    def __init__(self, retry_after):
+        super().__init__("rate limited (fake)")
+        self.status_code = 429
+        self.response = FakeResponse(429, {"retry-after-ms": str(int(retry_after * 1000))})
+
+
+class FakeLLMProvider(LLMProvider):
+    """Sleeps `latency` seconds per call and fails a `failure_rate` share of prompts once.
+
+    Which prompts fail depends only on the prompt text and `seed`, not on thread
+    timing, so runs are repeatable. Failures are rate-limit errors with a fixed
+    retry-after, which the retry policy waits out exactly instead of backing off
+    by a random amount.
+    """
+    requests_per_minute = 0  # unlimited
+    model_name = "fake"
+
+    def __init__(self, api_key: str = "", latency: float = 0.05, failure_rate: float = 0.0,
+                 retry_after: float = 0.05, seed: int = 0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.retry_after = retry_after
+        self.seed = seed
+        self.calls = 0
+        self.failures = 0
+        self._failed = set()
+        self._lock = threading.Lock()
+
+    def _fails(self, prompt):
+        digest = hashlib.md5(f"{self.seed}:{prompt}".encode('utf-8')).digest()
+        return int.from_bytes(digest[:4], "big") / 2 ** 32 < self.failure_rate
+
+    def generate_text(self, prompt: str) -> str:
+        with self._lock:
+            self.calls += 1
+            fail = self._fails(prompt) and prompt not in self._failed
+            if fail:
+                self._failed.add(prompt)
+                self.failures += 1
+        time.sleep(self.latency)
+        if fail:
+            raise FakeRateLimitError(self.retry_after)
+
+        sections = []
+        for line in prompt.split("\n"):
+            if line.startswith("[H") and "] " in line:
+                tag, highlight = line[1:].split("] ", 1)
+                sections.append(f"### {tag}\nQ: What is meant by: {highlight}?\nA: {highlight}")
+        if sections:
+            return "\n\n".join(sections)
+        highlight = prompt.split("the highlight I made: ", 1)[-1].split("\n", 1)[0]
+        return f"Q: What is meant by: {highlight}?\nA: {highlight}"
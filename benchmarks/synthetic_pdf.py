@@ -0,0 +1,56 @@
+"""Deterministic highlighted PDFs for the benchmarks.
+
+    make_book("book.pdf", pages=2000, highlights_per_page=0.5, multiline_ratio=0.3)
+
+Every page holds LINES_PER_PAGE lines of text. `highlights_per_page` may be
+fractional: highlights are spread evenly, so 0.1 puts one on every tenth page.
+A `multiline_ratio` share of the highlights runs from the middle of a line to
+the middle of the next one, with one quad per line, like a highlight dragged
+across a line break in a PDF reader.
+"""
+
+import random
+
+import fitz  # PyMuPDF
+
+LINES_PER_PAGE = 45
+SENTENCE = "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt."
+
+
+def line_text(page_num, line):
+    return f"p{page_num}l{line} {SENTENCE}"
+
+
+def highlights_on_page(page_num, highlights_per_page):
+    """Highlights on this page so that page 0..n-1 total about n * highlights_per_page"""
+    return int((page_num + 1) * highlights_per_page) - int(page_num * highlights_per_page)
+
+
+def make_book(path, pages, highlights_per_page=1.0, multiline_ratio=0.0, seed=0):
+    """Write the book to `path` and return the number of highlights in it"""
+    rng = random.Random(seed)
+    doc = fitz.open()
+    total = 0
+    for page_num in range(pages):
+        page = doc.new_page(width=595, height=842)
+        for line in range(LINES_PER_PAGE):
+            page.insert_text(fitz.Point(50, 60 + 16 * line), line_text(page_num, line), fontsize=9)
+
+        count = min(highlights_on_page(page_num, highlights_per_page), LINES_PER_PAGE // 2)
+        # Every other line at most, so a multi-line highlight never overlaps the next one
+        for line in rng.sample(range(0, LINES_PER_PAGE - 1, 2), count):
+            rect = page.search_for(line_text(page_num, line))[0]
+            if rng.random() < multiline_ratio:
+                next_rect = page.search_for(line_text(page_num, line + 1))[0]
+                middle = (rect.x0 + rect.x1) / 2
+                quads = [
+                    fitz.Rect(middle, rect.y0, rect.x1, rect.y1).quad,
+                    fitz.Rect(next_rect.x0, next_rect.y0, middle, next_rect.y1).quad,
+                ]
+            else:
+                quads = [rect.quad]
+            page.add_highlight_annot(quads=quads)
+            total += 1
+    doc.save(path)
+    doc.close()
+    return total
@@ -0,0 +1,135 @@
+import logging
+
+ANKI_CONNECT_URL = "http://localhost:8765"
+ANKI_CONNECT_VERSION = 6
+
+# Actions sent per "multi" request, and highlight ids OR'ed into one findNotes search
+MULTI_CHUNK_SIZE = 2500
+SEARCH_CHUNK_SIZE = 100
+
+
+HIGHLIGHT_TAG_PREFIX = "highlight::"
+
+
+def highlight_tag(highlight_id):
+    """Tag that marks the notes generated from a highlight"""
+    return f"{HIGHLIGHT_TAG_PREFIX}{highlight_id}"
+
+
+def highlight_id_from_tags(tags):
+    for tag in tags:
+        if tag.startswith(HIGHLIGHT_TAG_PREFIX):
+            return tag[len(HIGHLIGHT_TAG_PREFIX):]
+    return None
+
+
+class AnkiConnectError(Exception):
+    pass
+
+
+class AnkiConnectClient:
+    """Client for the AnkiConnect add-on.
+
+    Requests go over one keep-alive HTTP session, and bulk operations are sent as
+    "multi" actions so that thousands of notes cost a few round trips.
+    """
+
+    def __init__(self, url=ANKI_CONNECT_URL, api_key=None, timeout=30, chunk_size=MULTI_CHUNK_SIZE):
+        self.url = url
+        self.api_key = api_key
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        import requests  # loaded only when talking to Anki, so the CLI starts fast
+        self.session = requests.Session()
+        self.requests_sent = 0
+
+    def invoke(self, action, **params):
+        """Run one action and return its result, raising AnkiConnectError on failure"""
+        payload = {"action": action, "version": ANKI_CONNECT_VERSION, "params": params}
+        if self.api_key:
+            payload["key"] = self.api_key
+        response = self.session.post(self.url, json=payload, timeout=self.timeout)
+        self.requests_sent += 1
+        response.raise_for_status()
+        return self._unwrap(response.json(), action)
+
+    def multi(self, actions, raise_errors=True):
+        """Run (action, params) pairs in chunks of `chunk_size` and return their results in order.
+
+        With raise_errors=False a failed action yields its AnkiConnectError in the
+        results instead of aborting the rest.
+        """
+        actions = list(actions)
+        results = []
+        for i in range(0, len(actions), self.chunk_size):
+            chunk = [
+                {"action": action, "version": ANKI_CONNECT_VERSION, "params": params}
+                for action, params in actions[i:i + self.chunk_size]
+            ]
+            for (action, _), result in zip(actions[i:i + self.chunk_size], self.invoke("multi", actions=chunk)):
+                try:
+                    results.append(self._unwrap(result, action))
+                except AnkiConnectError as e:
+                    if raise_errors:
+                        raise
+                    results.append(e)
+        return results
+
+    @staticmethod
+    def _unwrap(response, action):
+        if not isinstance(response, dict) or set(response) != {"result", "error"}:
+            raise AnkiConnectError(f"Unexpected AnkiConnect response to {action}: {response!r}")
+        if response["error"] is not None:
+            raise AnkiConnectError(f"{action} failed: {response['error']}")
+        return response["result"]
+
+    def notes_info(self, note_ids):
+        note_ids = list(note_ids)
+        if not note_ids:
+            return []
+        return self.invoke("notesInfo", notes=note_ids)
+
+    def find_notes_by_highlight(self, highlight_ids):
+        """Return {highlight_id: [note info, ...]} for the notes tagged with each highlight id"""
+        highlight_ids = list(dict.fromkeys(highlight_ids))
+        searches = [
+            " OR ".join(f'"tag:{highlight_tag(highlight_id)}"' for highlight_id in highlight_ids[i:i + SEARCH_CHUNK_SIZE])
+            for i in range(0, len(highlight_ids), SEARCH_CHUNK_SIZE)
+        ]
+        note_ids = set()
+        for found in self.multi(("findNotes", {"query": query}) for query in searches):
+            note_ids.update(found)
+
+        # Tag searches are case-insensitive and hierarchical, so match tags exactly here
+        wanted = {highlight_tag(highlight_id).lower(): highlight_id for highlight_id in highlight_ids}
+        notes = {}
+        for note in self.notes_info(sorted(note_ids)):
+            for tag in note.get("tags", []):
+                highlight_id = wanted.get(tag.lower())
+                if highlight_id is not None:
+                    notes.setdefault(highlight_id, []).append(note)
+        return notes
+
+    def update_note_fields(self, updates):
+        """Apply (note_id, {field: value}) updates through multi and return how many succeeded"""
+        updates = list(updates)
+        results = self.multi(
+            (("updateNoteFields", {"note": {"id": note_id, "fields": fields}}) for note_id, fields in updates),
+            raise_errors=False,
+        )
+        updated = 0
+        for (note_id, _), result in zip(updates, results):
+            if isinstance(result, AnkiConnectError):
+                logging.warning(f"Failed to update note {note_id}: {result}")
+            else:
+                updated += 1
+        return updated
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,142 @@
+import base64
+import logging
+from flashcard_output_to_anki_handler import FlashcardOutputHandler
+from anki_connect import AnkiConnectClient, AnkiConnectError, highlight_id_from_tags
+from pdf_handler import PDFHandler
+
+# Base64 media sent per request
+MAX_UPLOAD_BYTES = 32 * 1024 * 1024
+
+
+class AnkiConnectOutputHandler(FlashcardOutputHandler):
+    """Pushes new notes straight into a running Anki through AnkiConnect.
+
+    A drop-in alternative to writing an .apkg: notes are queued by add_flashcards
+    exactly as for the genanki writer, and write_deck sends only the notes whose
+    highlight is not in the collection yet, plus the media they need, with
+    addNotes and storeMediaFile in batches.
+    """
+
+    def __init__(self, client=None):
+        super().__init__()
+        self._owns_client = client is None
+        self.client = client or AnkiConnectClient()
+        # media name -> path of the source PDFs referenced by queued notes
+        self._source_pdfs = {}
+
+    def _prepare_pdf_for_anki(self, pdf_path, pdf_id=None):
+        # Compressing is deferred to write_deck, and skipped if Anki already has the file
+        if pdf_id is None:
+            pdf_id = PDFHandler(pdf_path).pdf_id
+        name = self._source_pdf_name(pdf_id)
+        self._source_pdfs[name] = pdf_path
+        return name
+
+    def write_deck(self, deck_name):
+        """Add the queued notes that Anki doesn't have yet and return how many were added"""
+        if not self.notes:
+            logging.warning("No valid flashcards to add to Anki")
+            return 0
+
+        highlight_ids = [highlight_id_from_tags(note.tags) for note in self.notes]
+        existing = self.client.find_notes_by_highlight(h for h in highlight_ids if h)
+        new_notes = [
+            note for note, highlight_id in zip(self.notes, highlight_ids)
+            if highlight_id is None or highlight_id not in existing
+        ]
+        if not new_notes:
+            logging.info(f"All {len(self.notes)} flashcards are already in Anki")
+            return 0
+
+        self._ensure_model_and_deck(deck_name)
+        stored = self._store_media(new_notes)
+
+        chunks = [new_notes[i:i + self.client.chunk_size] for i in range(0, len(new_notes), self.client.chunk_size)]
+        results = self.client.multi((
+            ("addNotes", {"notes": [self._note_params(note, deck_name) for note in chunk]})
+            for chunk in chunks
+        ), raise_errors=False)
+        added = 0
+        for chunk, note_ids in zip(chunks, results):
+            if isinstance(note_ids, AnkiConnectError):
+                logging.error(f"Error adding notes to Anki: {note_ids}")
+                note_ids = [None] * len(chunk)
+            for note, note_id in zip(chunk, note_ids):
+                if note_id is not None:
+                    added += 1
+                else:
+                    # Rejected by Anki, e.g. an empty first field
+                    self.unwritten_highlight_ids.add(highlight_id_from_tags(note.tags))
+        logging.info(
+            f"Added {added} of {len(self.notes)} flashcards to Anki deck '{deck_name}' "
+            f"({len(self.notes) - len(new_notes)} already present, {stored} media file(s) uploaded)"
+        )
+        return added
+
+    def _note_params(self, note, deck_name):
+        return {
+            "deckName": deck_name,
+            "modelName": self.model.name,
+            "fields": {field["name"]: value for field, value in zip(self.model.fields, note.fields)},
+            "tags": list(note.tags),
+            "options": {"allowDuplicate": True},
+        }
+
+    def _ensure_model_and_deck(self, deck_name):
+        model_names, _ = self.client.multi([
+            ("modelNames", {}),
+            ("createDeck", {"deck": deck_name}),
+        ])
+        if self.model.name not in model_names:
+            self.client.invoke(
+                "createModel",
+                modelName=self.model.name,
+                inOrderFields=[field["name"] for field in self.model.fields],
+                css=self.model.css,
+                cardTemplates=[
+                    {"Name": template["name"], "Front": template["qfmt"], "Back": template["afmt"]}
+                    for template in self.model.templates
+                ],
+            )
+
+    def _store_media(self, new_notes):
+        """Upload the context images and source PDFs of `new_notes` that Anki doesn't have"""
+        image_field = [field["name"] for field in self.model.fields].index("Image")
+        wanted = {note.fields[image_field] for note in new_notes if note.fields[image_field]}
+        wanted.update(self._source_pdfs)
+        wanted = sorted(wanted)
+
+        present = self.client.multi(("getMediaFilesNames", {"pattern": name}) for name in wanted)
+        missing = [name for name, found in zip(wanted, present) if name not in found]
+        if not missing:
+            return 0
+
+        paths = dict(self.media.items())
+        actions = []
+        batch_bytes = 0
+        uploaded = 0
+        for name in missing:
+            if name in self._source_pdfs:
+                path = self._compress_pdf(self._source_pdfs[name], self.media.staging_path(name))
+            else:
+                path = paths.get(name)
+            if path is None:
+                logging.warning(f"Media file {name} is missing and was not uploaded")
+                continue
+            with open(path, 'rb') as f:
+                data = base64.b64encode(f.read()).decode('ascii')
+            # Keep each request a manageable size when whole PDFs are uploaded
+            if actions and batch_bytes + len(data) > MAX_UPLOAD_BYTES:
+                self.client.multi(actions)
+                actions, batch_bytes = [], 0
+            actions.append(("storeMediaFile", {"filename": name, "data": data}))
+            batch_bytes += len(data)
+            uploaded += 1
+        if actions:
+            self.client.multi(actions)
+        return uploaded
+
+    def close(self):
+        super().close()
+        if self._owns_client:
+            self.client.close()
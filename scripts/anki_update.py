@@ -1,34 +1,32 @@
-import requests
+import os
+from anki_connect import AnkiConnectClient
 
-def update_anki_source_links(highlights, new_pdf_path):
-    anki_connect_url = "http://localhost:8765"
-    pdf_name = new_pdf_path.split('/')[-1]
-    for highlight in highlights:
-        note_id = get_note_id_from_highlight(highlight)  # Assuming you have a way to get the note ID
-        page = highlight[2]
-        source_link = f'<a href="documentviewer://open?file={new_pdf_path}&page={page}">{pdf_name} (Page {page})</a>'
-        update_note_source_link(anki_connect_url, note_id, source_link)
+SOURCE_LINK_FIELD = "SourceLink"
 
-def get_note_id_from_highlight(highlight):
-    # Implement logic to get note ID from highlight
-    pass
+def source_link(pdf_path, page):
+    pdf_name = os.path.basename(pdf_path)
+    return f'<a href="documentviewer://open?file={pdf_path}&page={page}">{pdf_name} (Page {page})</a>'
 
-def update_note_source_link(anki_connect_url, note_id, source_link):
-    update_note = {
-        "action": "updateNoteFields",
-        "version": 6,
-        "params": {
-            "note": {
-                "id": note_id,
-                "fields": {
-                    "SourceLink": source_link
-                }
-            }
-        }
-    }
-    response = requests.post(anki_connect_url, json=update_note)
-    if response.status_code == 200:
-        print(f"Updated note {note_id} with new source link.")
-    else:
-        print(f"Failed to update note {note_id}. Response: {response.text}")
+def relink_notes(client, links, field=SOURCE_LINK_FIELD):
+    """Set `field` to links[highlight_id] on every note tagged with that highlight id.
 
+    Notes are looked up and updated in bulk, so this costs a few AnkiConnect round
+    trips however many notes there are. Returns the number of notes updated.
+    """
+    notes = client.find_notes_by_highlight(links)
+    updates = [
+        (note["noteId"], {field: links[highlight_id]})
+        for highlight_id, highlight_notes in notes.items()
+        for note in highlight_notes
+        # Notes of models without the field are left alone
+        if field in note.get("fields", {})
+    ]
+    return client.update_note_fields(updates)
+
+def update_anki_source_links(highlights, new_pdf_path, client=None, field=SOURCE_LINK_FIELD):
+    """Point the notes of `highlights` (highlights table rows) at the PDF's new path"""
+    links = {highlight[0]: source_link(new_pdf_path, highlight[2]) for highlight in highlights}
+    if client is not None:
+        return relink_notes(client, links, field)
+    with AnkiConnectClient() as client:
+        return relink_notes(client, links, field)
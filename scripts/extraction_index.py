@@ -0,0 +1,94 @@
+import hashlib
+import json
+import os
+from records import parse_rect
+
+FILE_INDEX_TABLE = "file_index"
+PAGE_ANNOTATIONS_TABLE = "page_annotations"
+
+
+def file_signature(pdf_path):
+    """(inode, size, mtime_ns) of a file; any change to the file changes the signature"""
+    stat = os.stat(pdf_path)
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def annotation_digest(annot_keys):
+    """Digest of the annotation set on a page, used to detect pages that need a re-scan"""
+    return hashlib.md5("|".join(sorted(annot_keys)).encode('utf-8')).hexdigest()
+
+
+class ExtractionIndex:
+    """Persistent record of what was extracted from each PDF.
+
+    Maps a file's (inode, size, mtime) to its pdf_id, and stores the highlights of
+    every annotated page together with a digest of that page's annotations. A
+    file version counts as extracted once its row in file_index is marked
+    scanned; PDFIdentity records the pdf_id of versions before that.
+    """
+
+    def __init__(self, storage):
+        # Tables are created by the storage migrations
+        self.storage = storage
+
+    def lookup_pdf_id(self, pdf_path):
+        """Return the pdf_id of this exact file version if its highlights were extracted, or None"""
+        rows = self.storage.query(
+            f"SELECT pdf_id FROM {FILE_INDEX_TABLE} WHERE inode = ? AND size = ? AND mtime_ns = ? AND scanned = 1",
+            file_signature(pdf_path),
+        )
+        return rows[0][0] if rows else None
+
+    def get_pages(self, pdf_id):
+        """Return {page_num: (digest, highlights)} for every annotated page of a PDF"""
+        rows = self.storage.query(
+            f"SELECT page, digest, highlights FROM {PAGE_ANNOTATIONS_TABLE} WHERE pdf_id = ?",
+            (pdf_id,),
+        )
+        return {page: (digest, json.loads(highlights)) for page, digest, highlights in rows}
+
+    def get_legacy_pages(self, pdf_id, exclude=()):
+        """Return {page_num: (None, highlights)} from the highlights table, for pages not in `exclude`.
+
+        Highlights recorded before a page was in this index keep their IDs when the
+        page is scanned: highlight IDs hash the highlighted text, which used to be
+        read from the whole annotation rect rather than from its quads.
+        """
+        rows = self.storage.query(
+            "SELECT highlight_id, page, rect, text FROM highlights WHERE pdf_id = ? ORDER BY page",
+            (pdf_id,),
+        )
+        pages = {}
+        for highlight_id, page, rect, text in rows:
+            if page - 1 in exclude:
+                continue
+            pages.setdefault(page - 1, (None, []))[1].append(
+                {"highlight_id": highlight_id, "text": text, "page": page, "rect": list(parse_rect(rect))}
+            )
+        return pages
+
+    def update(self, pdf_path, pdf_id, changed_pages, removed_pages=()):
+        """Store re-scanned pages and record the current file version, in one transaction.
+
+        `changed_pages` maps page_num to (digest, highlights) where highlights are
+        JSON-serializable dicts.
+        """
+        inode, size, mtime_ns = file_signature(pdf_path)
+        with self.storage.transaction() as conn:
+            conn.executemany(
+                f"INSERT OR REPLACE INTO {PAGE_ANNOTATIONS_TABLE} (pdf_id, page, digest, highlights) VALUES (?, ?, ?, ?)",
+                [
+                    (pdf_id, page, digest, json.dumps(highlights))
+                    for page, (digest, highlights) in changed_pages.items()
+                ],
+            )
+            conn.executemany(
+                f"DELETE FROM {PAGE_ANNOTATIONS_TABLE} WHERE pdf_id = ? AND page = ?",
+                [(pdf_id, page) for page in removed_pages],
+            )
+            # Older versions of the same file are no longer reachable
+            conn.execute(f"DELETE FROM {FILE_INDEX_TABLE} WHERE inode = ?", (inode,))
+            conn.execute(
+                f"INSERT INTO {FILE_INDEX_TABLE} (inode, size, mtime_ns, file_path, pdf_id, scanned) VALUES (?, ?, ?, ?, ?, 1)",
+                (inode, size, mtime_ns, os.path.abspath(pdf_path), pdf_id),
+            )
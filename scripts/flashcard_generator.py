@@ -1,18 +1,42 @@
-import os
-import sqlite3
-import time
+import re
+import threading
 import logging
+from collections import deque
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
 from abc import ABC, abstractmethod
-from typing import List, Dict
-import anthropic
-from tenacity import retry, stop_after_attempt, wait_exponential
-from PyPDF2 import PdfReader
-from pdf2image import convert_from_path
-from PIL import Image, ImageOps
-import hashlib
-from image_handler import PDFImageHandler
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+from rate_limiter import TokenBucket
+from retry_policy import ProviderUnavailableError, RetryPolicy
+from prompt_batcher import PromptBatch, build_prompt_batches, estimate_tokens
+from profiler import get_profiler
+from storage import Storage, get_storage
+from response_cache import ResponseCache
+from records import Context, Flashcard, rect_str
+
+FLASHCARD_PRINCIPLES = """        And finally, follow these principles in doing flashcards:
+
+        1. They should be atomic, that means, if you have more than two sentences for an answer, you probably should split it out into other flashcards.
+        2. They shouldn't "hardcode" knowledge, they have to aim to grasp the fundamentals of the topic, so you can think from first principles.
+        3. When you are studying a particular concept, mechanism, or topic, there should be cards that approach the topic from different perspectives, for example, you may study the prove of a theorem, but you may have another flashcard with a concrete application of that theorem.
+        4. ALWAYS get sure that the answer is being asked. For example, this is what you shouldn't do: Q: "can we always solve Ax=b for every b?" A: "No. It depends on whether the columns of A are independent and span the space.". Because "on which depends" **was never asked**. For having that answer, you should rather put in the question: "On what _depends_ if we can solve Ax=b for every b?".
+        5. When its needed, you can give one to three sentences of context to introduce the question. The answer should always remain atomic, but sometimes its better to situate the question in context.
+
+"""
+
+# Section headers that route flashcards of a batched response back to their highlight,
+# e.g. "### H2", "**[H2]**" or "H2:"
+HIGHLIGHT_TAG_PATTERN = re.compile(r"^[#*\s\[]*(H\d+)[\]*:\s]*$")
+
+# Highlights with flashcards are recorded in the database in groups of this size
+STORE_BATCH_SIZE = 50
 
 class LLMProvider(ABC):
+    # Default pacing applied by FlashcardGenerator's token bucket
+    requests_per_minute = 60
+    # Part of the response cache key, so changing models never reuses old answers
+    model_name = ""
+
     @abstractmethod
     def __init__(self, api_key: str):
         pass
@@ -25,19 +49,22 @@ class OpenAIProvider(LLMProvider):
     def __init__(self, api_key: str):
         from langchain_openai import OpenAI
         self.llm = OpenAI(api_key=api_key)
+        self.model_name = self.llm.model_name
 
     def generate_text(self, prompt: str) -> str:
         return self.llm(prompt)
 
 class AnthropicProvider(LLMProvider):
+    model_name = "claude-3-sonnet-20240229"
+
     def __init__(self, api_key: str):
         import anthropic
         self.client = anthropic.Anthropic(api_key=api_key)
 
     def generate_text(self, prompt: str) -> str:
         message = self.client.messages.create(
-            model="claude-3-sonnet-20240229",
-            max_tokens=1000,
+            model=self.model_name,
+            max_tokens=4096,  # batched prompts answer for several highlights at once
             temperature=0,
             system="You are an AI assistant designed to generate flashcards based on given contexts.",
             messages=[
@@ -55,129 +82,333 @@ class AnthropicProvider(LLMProvider):
         return message.content[0].text
 
 class GeminiProvider(LLMProvider):
+    model_name = "gemini-2.0-flash-thinking-exp"
+
     def __init__(self, api_key: str):
         import google.generativeai as genai
         genai.configure(api_key=api_key)
-        self.model = genai.GenerativeModel("gemini-2.0-flash-thinking-exp")
+        self.model = genai.GenerativeModel(self.model_name)
 
     def generate_text(self, prompt: str) -> str:
         response = self.model.generate_content(prompt)
         return response.text
 
 class FlashcardGenerator:
-    def __init__(self, llm_provider: LLMProvider):
+    def __init__(
+        self,
+        llm_provider: LLMProvider,
+        max_concurrency: int = 1,
+        requests_per_minute: float = None,
+        storage: Storage = None,
+        response_cache: ResponseCache = None,
+        retry_policy: RetryPolicy = None,
+        record_highlights: bool = True,
+    ):
         self.llm_provider = llm_provider
-        self.db_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "tracked_files.db")
+        self.storage = storage or get_storage()
+        self.response_cache = response_cache
+        self.max_concurrency = max(1, max_concurrency)
+
+        # Bounds the number of provider requests in flight across every caller of this generator
+        self._in_flight = threading.BoundedSemaphore(self.max_concurrency)
+
+        if requests_per_minute is None:
+            requests_per_minute = llm_provider.requests_per_minute
+        self.rate_limiter = TokenBucket.per_minute(requests_per_minute)
+        # Shared by every request, so its circuit breaker sees the provider's health as a whole
+        self.retry_policy = retry_policy or RetryPolicy()
+        # False when the caller records results itself, e.g. through a JobQueue
+        self.record_highlights = record_highlights
+        self._stats_lock = threading.Lock()
+
+    def _count(self, stats: Dict[str, int], key: str, n: int = 1) -> None:
+        if stats is not None:
+            with self._stats_lock:
+                stats[key] = stats.get(key, 0) + n
+
+    def _generate_with_retry(
+        self, prompt: str, parse, language: str = "", stats: Dict[str, int] = None, highlight_ids: List[str] = ()
+    ):
+        """Return parse(response) of the (possibly cached) response to `prompt`.
+
+        A response is cached only once it parsed into at least one flashcard, so an
+        empty or malformed answer is asked for again instead of being replayed.
+        """
+        if self.response_cache is None:
+            return self._parse(self._call_provider_with_retry(prompt, stats, highlight_ids), parse, highlight_ids)
+
+        key = ResponseCache.make_key(
+            type(self.llm_provider).__name__,
+            self.llm_provider.model_name,
+            language,
+            prompt,
+        )
+        response = self.response_cache.get(key)
+        cached = response is not None
+        if cached:
+            self._count(stats, "cache_hits")
+        else:
+            response = self._call_provider_with_retry(prompt, stats, highlight_ids)
 
-    @retry(
-        stop=stop_after_attempt(20), wait=wait_exponential(multiplier=1, min=4, max=20)
-    )
-    def _generate_text_with_retry(self, prompt: str) -> str:
         try:
-            return self.llm_provider.generate_text(prompt)
-        except Exception as e:
-            logging.error(f"Error generating text: {e}")
+            flashcards = self._parse(response, parse, highlight_ids)
+        except Exception:
+            flashcards = None
             raise
+        finally:
+            if flashcards and not cached:
+                self.response_cache.put(key, response)
+            elif not flashcards and cached:
+                # An unusable entry, e.g. stored before responses were checked
+                self.response_cache.discard(key)
+        return flashcards
+
+    def _parse(self, response, parse, highlight_ids):
+        print(response)
+        with get_profiler().span("parse", highlight_ids=list(highlight_ids)):
+            return parse(response)
+
+    def _call_provider_with_retry(
+        self, prompt: str, stats: Dict[str, int] = None, highlight_ids: List[str] = ()
+    ) -> str:
+        def call():
+            self.rate_limiter.acquire()
+            self._count(stats, "api_calls")
+            with self._in_flight:
+                return self.llm_provider.generate_text(prompt)
+
+        profiler = get_profiler()
+        if not profiler.enabled:
+            return self.retry_policy.call(call, lambda key, n: self._count(stats, key, n))
+
+        # Latency includes rate limiting and backoff; the retries of this call are kept with it
+        with profiler.span(
+            "llm_call", highlight_ids=list(highlight_ids), prompt_tokens=estimate_tokens(prompt), retries=0,
+        ) as span:
+            def count(key, n):
+                self._count(stats, key, n)
+                if key == "retries":
+                    span["retries"] += n
+
+            response = self.retry_policy.call(call, count)
+            span["response_tokens"] = estimate_tokens(response)
+        return response
 
     def generate_flashcards(
-        self, contexts: List[Dict[str, str]],
-        language: str
-    ) -> List[List[Dict[str, str]]]:
-        # Add image handler
-        image_handler = PDFImageHandler()
-        
-        all_flashcards = []
-        for i, context in enumerate(contexts):
-            try:
-                logging.info(f"Processing context {i+1}/{len(contexts)}")
-                
-                # Generate context image
-                context_image = image_handler.create_context_image(
-                    context['pdf_path'],  # Make sure this is passed in the context
-                    context['page'],
-                    context['pdf_id']
-                )
-                
-                prompt = self._create_prompt(context, language)
-                response = self._generate_text_with_retry(prompt)
-                print(response)
-                flashcards = self._parse_response(response, context)
-                
-                # Add image to each flashcard
-                for flashcard in flashcards:
-                    flashcard['context_image'] = context_image
-                    
-                all_flashcards.append(flashcards)
-                self._store_highlight_id(context['highlight_id'], context)
-                time.sleep(1)
-            except Exception as e:
-                logging.error(f"Error processing context {i+1}: {e}")
-                continue
-        return all_flashcards
-
-    def _create_prompt(self, context: Dict[str, str],language: str) -> str:
+        self, contexts: List[Context],
+        language: str,
+        max_prompt_tokens: int = None,
+        page_text: Callable[[int], str] = None,
+        stats: Dict[str, int] = None,
+    ) -> List[List[Flashcard]]:
+        """Generate flashcards for every context, returning one list per context in input order.
+
+        See iter_flashcards; the whole list is in flight at once, so highlights are
+        packed into prompts across all of `contexts`.
+        """
+        if not contexts:
+            return []
+        return [
+            flashcards for _, flashcards in self.iter_flashcards(
+                contexts, language, max_prompt_tokens, page_text, stats, window=len(contexts)
+            )
+        ]
+
+    def iter_flashcards(
+        self, contexts: Iterable[Context],
+        language: str,
+        max_prompt_tokens: int = None,
+        page_text: Callable[[int], str] = None,
+        stats: Dict[str, int] = None,
+        window: int = None,
+    ) -> Iterator[Tuple[Context, List[Flashcard]]]:
+        """Yield (context, flashcards) for each context, in input order, as they complete.
+
+        `contexts` is consumed lazily: at most `window` contexts (default twice
+        `max_concurrency`) are pulled ahead of the consumer, so memory stays bounded
+        however long the input is. Up to `max_concurrency` requests run at once. A
+        context that fails yields an empty list, and unless `record_highlights` is off,
+        the highlights that produced flashcards are recorded in the database as
+        they are yielded. When
+        `max_prompt_tokens` and a `page_text(page_num)` lookup are given, highlights with
+        overlapping page windows within the window are packed into shared prompts of at
+        most that size. Provider calls, cache hits, retries and the seconds spent backing
+        off are added to the optional `stats` dict. ProviderUnavailableError is raised
+        once the retry policy's circuit breaker opens.
+        """
+        window = max(1, window or 2 * self.max_concurrency)
+        if max_prompt_tokens and page_text is not None:
+            items = self._iter_prompt_batches(contexts, page_text, max_prompt_tokens, window)
+        else:
+            items = (([context], self._process_context, context) for context in contexts)
+
+        to_store = []
+        pending = deque()  # (contexts, future) in submission order
+        in_flight = 0
+        executor = ThreadPoolExecutor(max_workers=self.max_concurrency)
+        try:
+            for i, (item_contexts, process, item) in enumerate(items):
+                pending.append((item_contexts, executor.submit(process, i, item, None, language, stats)))
+                in_flight += len(item_contexts)
+                while in_flight >= window:
+                    item_contexts, future = pending.popleft()
+                    in_flight -= len(item_contexts)
+                    yield from self._finish(item_contexts, future.result(), to_store)
+            while pending:
+                item_contexts, future = pending.popleft()
+                yield from self._finish(item_contexts, future.result(), to_store)
+        finally:
+            # Requests not started yet are dropped if the consumer stops early
+            executor.shutdown(wait=True, cancel_futures=True)
+            self._store_highlight_ids(to_store)
+
+    def _iter_prompt_batches(self, contexts, page_text, max_prompt_tokens, window):
+        """Pack each window of contexts into prompt batches"""
+        contexts = iter(contexts)
+        while True:
+            chunk = list(islice(contexts, window))
+            if not chunk:
+                return
+            batches = build_prompt_batches(chunk, page_text, max_prompt_tokens)
+            logging.info(f"Packed {len(chunk)} highlights into {len(batches)} prompts")
+            for batch in batches:
+                yield batch.contexts, self._process_batch, batch
+
+    def _finish(self, contexts, result, to_store):
+        if isinstance(result, list):
+            result = {contexts[0].highlight_id: result}
+        for context in contexts:
+            flashcards = result.get(context.highlight_id, [])
+            # Highlights without flashcards (failed, or skipped by the model) are left
+            # unrecorded so the next run retries them
+            if flashcards and self.record_highlights:
+                to_store.append(context)
+                if len(to_store) >= STORE_BATCH_SIZE:
+                    self._store_highlight_ids(to_store)
+                    to_store.clear()
+            yield context, flashcards
+
+    def _process_context(
+        self, i: int, context: Context, total: int, language: str, stats: Dict[str, int]
+    ) -> List[Flashcard]:
+        try:
+            logging.info(f"Processing context {i+1}/{total or '?'}")
+
+            prompt = self._create_prompt(context, language)
+            return self._generate_with_retry(
+                prompt, lambda response: self._parse_response(response, context),
+                language, stats, [context.highlight_id],
+            )
+        except ProviderUnavailableError:
+            raise  # stops the run instead of failing every remaining highlight
+        except Exception as e:
+            logging.error(f"Error processing context {i+1}: {e}")
+            return []
+
+    def _process_batch(
+        self, i: int, batch: PromptBatch, total: int, language: str, stats: Dict[str, int]
+    ) -> Dict[str, List[Flashcard]]:
+        try:
+            logging.info(f"Processing prompt batch {i+1}/{total or '?'} ({len(batch.contexts)} highlights)")
+
+            highlight_ids = [context.highlight_id for context in batch.contexts]
+            prompt = self._create_batch_prompt(batch, language)
+            flashcards = self._generate_with_retry(
+                prompt, lambda response: self._parse_response(response, batch.contexts[0], batch.tags()),
+                language, stats, highlight_ids,
+            )
+
+            by_highlight = {}
+            for flashcard in flashcards:
+                by_highlight.setdefault(flashcard.highlight_id, []).append(flashcard)
+
+            return by_highlight
+        except ProviderUnavailableError:
+            raise
+        except Exception as e:
+            logging.error(f"Error processing prompt batch {i+1}: {e}")
+            return {}
+
+    def _create_batch_prompt(self, batch: PromptBatch, language: str) -> str:
+        highlights = "\n".join(
+            f"[{tag}] {context.text}" for tag, context in batch.tags().items()
+        )
+        return f"""Generate flashcards in {language} from the following context:
+
+        Context: {batch.context}
+
+        I made several highlights in this context, each one tagged with an identifier:
+
+{highlights}
+
+        For each highlight, write a line with its identifier alone (for example "### H1")
+        followed by the flashcards for that highlight, making special emphasis around it.
+        Please format every flashcard **exactly** as follows
+
+        ### H1
+        Q: questionhere
+        A: answerhere
+
+{FLASHCARD_PRINCIPLES}"""
+
+    def _create_prompt(self, context: Context,language: str) -> str:
         return f"""Generate a flashcard in {language} from the following context:
 
-        Context: {context['context']}
+        Context: {context.context}
 
-        Making special emphasis around the highlight I made: {context['highlight']}
+        Making special emphasis around the highlight I made: {context.text}
 
         Please format the flashcard **exactly** as follows
 
         Q: questionhere
         A: answerhere
 
-        And finally, follow these principles in doing flashcards:
-
-        1. They should be atomic, that means, if you have more than two sentences for an answer, you probably should split it out into other flashcards.
-        2. They shouldn't "hardcode" knowledge, they have to aim to grasp the fundamentals of the topic, so you can think from first principles.
-        3. When you are studying a particular concept, mechanism, or topic, there should be cards that approach the topic from different perspectives, for example, you may study the prove of a theorem, but you may have another flashcard with a concrete application of that theorem.
-        4. ALWAYS get sure that the answer is being asked. For example, this is what you shouldn't do: Q: "can we always solve Ax=b for every b?" A: "No. It depends on whether the columns of A are independent and span the space.". Because "on which depends" **was never asked**. For having that answer, you should rather put in the question: "On what _depends_ if we can solve Ax=b for every b?".
-        5. When its needed, you can give one to three sentences of context to introduce the question. The answer should always remain atomic, but sometimes its better to situate the question in context.
+{FLASHCARD_PRINCIPLES}"""
 
-"""
+    def _parse_response(
+        self, response: str, context: Context,
+        tagged_contexts: Dict[str, Context] = None
+    ) -> List[Flashcard]:
+        """Parse Q/A pairs from a response.
 
-    def _parse_response(self, response: str, context: Dict[str, str]) -> List[Dict[str, str]]:
+        With `tagged_contexts`, section headers such as "### H2" switch the context
+        that the following flashcards belong to. A question without an answer is dropped.
+        """
         flashcards = []
         lines = response.split('\n')
-        current_flashcard = {}
+        question, answer, source = None, None, None
 
         for line in lines:
             line = line.strip()
 
-            if line.startswith('Q:') or line.startswith('**Q:**'):
-                if current_flashcard:
-                    flashcards.append(current_flashcard)
-                current_flashcard = {
-                    "question": line[6:].strip() if line.startswith('**Q:**') else line[2:].strip(),
-                    "page": context["page"],
-                    "pdf_id": context["pdf_id"],
-                    "rect": context["rect"],
-                    "pdf_path": context.get("pdf_path", "")  # Add pdf_path to the flashcard
-                }
-            elif line.startswith('A:') or line.startswith('**A:**'):
-                current_flashcard["answer"] = line[6:].strip() if line.startswith('**A:**') else line[2:].strip()
+            tag_match = HIGHLIGHT_TAG_PATTERN.match(line) if tagged_contexts else None
+            if tag_match and tag_match.group(1) in tagged_contexts:
+                if question is not None and answer is not None:
+                    flashcards.append(Flashcard(question, answer, source.highlight, source.pdf_path))
+                question, answer = None, None
+                context = tagged_contexts[tag_match.group(1)]
+            elif line.startswith('Q:') or line.startswith('**Q:**'):
+                if question is not None and answer is not None:
+                    flashcards.append(Flashcard(question, answer, source.highlight, source.pdf_path))
+                question = line[6:].strip() if line.startswith('**Q:**') else line[2:].strip()
+                answer = None
+                # Flashcards share the highlight record rather than copying its fields
+                source = context
+            elif (line.startswith('A:') or line.startswith('**A:**')) and question is not None:
+                answer = line[6:].strip() if line.startswith('**A:**') else line[2:].strip()
 
         # Add the last flashcard if it exists
-        if current_flashcard and "answer" in current_flashcard:
-            flashcards.append(current_flashcard)
+        if question is not None and answer is not None:
+            flashcards.append(Flashcard(question, answer, source.highlight, source.pdf_path))
 
         return flashcards
 
     def highlight_exists(self, highlight_id: str) -> bool:
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(1) FROM highlights WHERE highlight_id = ?", (highlight_id,))
-        result = cursor.fetchone()
-        conn.close()
-        return result[0] > 0
-
-    def _store_highlight_id(self, highlight_id: str, context: Dict[str, str]) -> None:
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT OR IGNORE INTO highlights (highlight_id, pdf_id, page, rect, text) VALUES (?, ?, ?, ?, ?)",
-            (highlight_id, context["pdf_id"], context["page"], str(context["rect"]), context["highlight"])
-        )
-        conn.commit()
-        conn.close()
+        return self.storage.highlight_exists(highlight_id)
+
+    def _store_highlight_ids(self, contexts: List[Context]) -> None:
+        with get_profiler().span("db", operation="store_highlights", rows=len(contexts)):
+            self.storage.insert_highlights([
+                (context.highlight_id, context.pdf_id, context.page, rect_str(context.rect), context.text)
+                for context in contexts
+            ])
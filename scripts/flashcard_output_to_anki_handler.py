@@ -4,23 +4,37 @@ import os
 import urllib.parse
 import shutil
 import fitz  # PyMuPDF
-import tempfile
 from pdf_handler import PDFHandler
+from media_registry import MediaRegistry
+from anki_connect import highlight_tag
+from anki_update import SOURCE_LINK_FIELD, source_link
 import json
 import sqlite3
 from pathlib import Path
 
+# A new id and name whenever the fields change, so decks made with an older model keep working
+MODEL_ID = 1607392320
+MODEL_NAME = "Simple Image Card v2"
+
 class FlashcardOutputHandler:
     def __init__(self):
-        self.media_files = []
+        self.media = MediaRegistry()
+        self.model = self._build_model()
+        self.notes = []
+        # Highlights with a note that write_deck could not write
+        self.unwritten_highlight_ids = set()
+        self._cards_per_highlight = {}
+        # pdf_id -> media name of the compressed source PDF
+        self._prepared_pdfs = {}
 
-    def _compress_pdf(self, input_pdf_path):
-        """Compress PDF and return the path to the compressed file"""
-        doc = fitz.open(input_pdf_path)
+    @property
+    def media_files(self):
+        """(path, media name) pairs packaged with the deck"""
+        return [(path, name) for name, path in self.media.items()]
 
-        # Create a temporary file for the compressed PDF
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-            compressed_path = tmp_file.name
+    def _compress_pdf(self, input_pdf_path, compressed_path):
+        """Compress PDF into compressed_path and return it"""
+        doc = fitz.open(input_pdf_path)
 
         # Save with compression
         doc.save(compressed_path,
@@ -32,33 +46,39 @@ class FlashcardOutputHandler:
         doc.close()
         return compressed_path
 
-    def _prepare_pdf_for_anki(self, pdf_path):
+    def _prepare_pdf_for_anki(self, pdf_path, pdf_id=None):
         """Prepare PDF for Anki by compressing and generating a unique filename"""
+        if pdf_id is None:
+            pdf_id = PDFHandler(pdf_path).pdf_id
+        if pdf_id in self._prepared_pdfs:
+            return self._prepared_pdfs[pdf_id]
+
         # Generate a unique filename based on the PDF content
-        pdf_handler = PDFHandler(pdf_path)
-        unique_name = f"_source_{pdf_handler.pdf_id[:8]}.pdf"  # Prefix with _source_ to ensure Anki treats it as media
+        unique_name = self._source_pdf_name(pdf_id)
 
-        # Compress the PDF
-        compressed_path = self._compress_pdf(pdf_path)
+        # Compress the PDF into a temp file owned by the media registry
+        compressed_path = self._compress_pdf(pdf_path, self.media.staging_path(unique_name))
 
-        # Add to media files list with the correct name mapping
-        self.media_files.append((compressed_path, unique_name))
+        # Register under the name the deck refers to
+        unique_name = self.media.add(compressed_path, unique_name)
+        self._prepared_pdfs[pdf_id] = unique_name
 
         return unique_name
 
-    def create_anki_deck(self, flashcards, deck_name, pdf_path):
-        # Prepare PDF for Anki
-        anki_pdf_name = self._prepare_pdf_for_anki(pdf_path)
-        original_pdf_name = os.path.basename(pdf_path)
+    @staticmethod
+    def _source_pdf_name(pdf_id):
+        return f"_source_{pdf_id[:8]}.pdf"  # Prefix with _source_ to ensure Anki treats it as media
 
-        deck = genanki.Deck(2059400110, deck_name)
-        model = genanki.Model(
-            1607392319,
-            "Simple Image Card",
+    def _build_model(self):
+        return genanki.Model(
+            MODEL_ID,
+            MODEL_NAME,
             fields=[
                 {"name": "Front"},
                 {"name": "Back"},
-                {"name": "Image"}
+                {"name": "Image"},
+                # Link to the highlight's page; anki_update points it at a moved PDF
+                {"name": SOURCE_LINK_FIELD}
             ],
             templates=[
                 {
@@ -84,6 +104,7 @@ class FlashcardOutputHandler:
          "
          onload="centerImage()">
 </div>
+{{#SourceLink}}<div class="source">{{SourceLink}}</div>{{/SourceLink}}
 <script>
 function centerImage() {
     const container = document.getElementById('imageContainer');
@@ -153,6 +174,11 @@ function toggleImage() {
     background-color: rgba(0, 122, 255, 0.2);
 }
 
+.source {
+    font-size: 13px;
+    margin-top: 12px;
+}
+
 .image-container {
     max-height: 300px;
     overflow-y: auto;
@@ -167,38 +193,90 @@ function toggleImage() {
 """
         )
 
+    def add_flashcards(self, flashcards, pdf_path):
+        """Queue notes for the next write_deck call.
+
+        Note GUIDs are derived from each flashcard's highlight_id and its position
+        among that highlight's cards, so re-importing a rebuilt deck updates the
+        existing notes instead of duplicating them.
+        """
         valid_flashcards = [fc for fc in flashcards if self._validate_flashcard(fc)]
+        if not valid_flashcards:
+            return 0
+
+        # Prepare PDF for Anki, once per source PDF
+        self._prepare_pdf_for_anki(pdf_path, valid_flashcards[0].pdf_id)
 
         for flashcard in valid_flashcards:
-            # Simply add the image to media_files list
-            if "context_image" in flashcard:
-                self.media_files.append((
-                    os.path.join("pdf_images", flashcard["context_image"]),
-                    flashcard["context_image"]
-                ))
+            # Register the image; repeated images are packaged once, under the
+            # name of their first copy, which is the name the note must refer to
+            image = flashcard.context_image
+            if image:
+                image = self.media.add(os.path.join("pdf_images", image), image)
+
+            highlight_id = flashcard.highlight_id
+            card_index = self._cards_per_highlight.get(highlight_id, 0)
+            self._cards_per_highlight[highlight_id] = card_index + 1
 
             note = genanki.Note(
-                model=model,
+                model=self.model,
                 fields=[
-                    flashcard["question"],
-                    flashcard["answer"],
-                    flashcard["context_image"]
-                ]
+                    flashcard.question,
+                    flashcard.answer,
+                    image,
+                    source_link(flashcard.pdf_path or pdf_path, flashcard.page)
+                ],
+                guid=genanki.guid_for(highlight_id, card_index) if highlight_id else None,
+                # Lets AnkiConnect find the notes of a highlight later, e.g. to relink them
+                tags=[highlight_tag(highlight_id)] if highlight_id else [],
             )
-            deck.add_note(note)
+            self.notes.append(note)
+        return len(valid_flashcards)
 
-        if valid_flashcards:
-            package = genanki.Package(deck)
-            package.media_files = [path for path, _ in self.media_files]
-            output_file = f"{deck_name}.apkg"
-            package.write_to_file(output_file)
-            logging.info(f"Created Anki deck with {len(valid_flashcards)} flashcards")
-        else:
+    def write_deck(self, deck_name):
+        """Write every queued note to {deck_name}.apkg and return the file name"""
+        if not self.notes:
             logging.warning("No valid flashcards to create Anki deck")
+            return None
+
+        deck = genanki.Deck(2059400110, deck_name)
+        for note in self.notes:
+            deck.add_note(note)
+
+        package = genanki.Package(deck)
+        package.media_files = self.media.paths()
+        output_file = f"{deck_name}.apkg"
+        # Readers, e.g. a sync folder, never see a half-written deck
+        partial_file = f"{output_file}.{os.getpid()}.partial"
+        try:
+            package.write_to_file(partial_file)
+            os.replace(partial_file, output_file)
+        finally:
+            if os.path.exists(partial_file):
+                os.remove(partial_file)
+        logging.info(
+            f"Created Anki deck with {len(self.notes)} flashcards and "
+            f"{len(package.media_files)} media file(s) ({self.media.total_bytes / 1e6:.1f} MB)"
+        )
+        return output_file
+
+    def close(self):
+        """Delete the temporary files created for the deck"""
+        self.media.cleanup()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def create_anki_deck(self, flashcards, deck_name, pdf_path):
+        """Add flashcards and write the deck in one step"""
+        self.add_flashcards(flashcards, pdf_path)
+        return self.write_deck(deck_name)
 
     def _validate_flashcard(self, flashcard):
-        required_keys = ["question", "answer", "page", "pdf_id", "rect"]
-        if all(key in flashcard for key in required_keys):
+        if flashcard.question and flashcard.answer:
             return True
         else:
             logging.warning(f"Invalid flashcard: {flashcard}")
@@ -206,7 +284,7 @@ function toggleImage() {
 
     def _create_source_link(self, flashcard, original_pdf_name):
         """Create a source link that shows the PDF source information"""
-        page = flashcard["page"]
+        page = flashcard.page
         return f"{original_pdf_name} (Page {page+1})"
 
     def update_source_links(self, old_pdf_path, new_pdf_path):
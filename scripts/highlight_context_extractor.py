@@ -1,26 +1,108 @@
+from records import Context
+from prompt_batcher import estimate_tokens
+from profiler import get_profiler
+
 class HighlightContextExtractor:
-    def __init__(self, pdf_handler):
+    def __init__(self, pdf_handler, token_budget=None):
         self.pdf_handler = pdf_handler
+        # When set, contexts keep only the text blocks nearest the highlight that
+        # fit in this many tokens instead of every page of the window
+        self.token_budget = token_budget
 
     def get_contexts(self, highlights, context_range=1):
-        contexts = []
+        # Visit highlights page by page so nearby highlights hit the page text cache
+        order = sorted(range(len(highlights)), key=lambda i: highlights[i].page)
+        contexts = [None] * len(highlights)
+        for i, context in zip(order, self.iter_contexts((highlights[i] for i in order), context_range)):
+            contexts[i] = context
+        return contexts
+
+    def iter_contexts(self, highlights, context_range=1):
+        """Yield a context for each highlight as it arrives.
+
+        Contexts reference their page window in the PDFHandler's page text cache
+        instead of copying the text, so feeding highlights in page order keeps
+        each page's text extracted once and shared.
+        """
+        # Read on the first highlight: counting pages opens the PDF, which an
+        # unchanged book with nothing new must not do
+        page_count = None
+        profiler = get_profiler()
         for highlight in highlights:
-            start_page = max(
-                highlight["page"] - context_range - 1, 0
-            )  # Adjust for 0-based index
-            end_page = min(
-                highlight["page"] + context_range - 1, len(self.pdf_handler.doc) - 1
-            )
-            context_text = self.pdf_handler.get_text_by_pages(start_page, end_page)
-            contexts.append(
-                {
-                    "highlight": highlight["text"],
-                    "highlight_id": highlight["highlight_id"],
-                    "context": context_text,
-                    "page": highlight["page"],
-                    "pdf_id": highlight["pdf_id"],
-                    "rect": highlight["rect"],
-                    "pdf_path": self.pdf_handler.pdf_path
-                }
+            if page_count is None:
+                page_count = len(self.pdf_handler.doc)
+            with profiler.span("context_build", highlight_id=highlight.highlight_id) as span:
+                context = self._build_context(highlight, context_range, page_count)
+                span["tokens_saved"] = context.tokens_saved
+            yield context
+
+    def _build_context(self, highlight, context_range, page_count):
+        start_page = max(
+            highlight.page - context_range - 1, 0
+        )  # Adjust for 0-based index
+        end_page = min(
+            highlight.page + context_range - 1, page_count - 1
+        )
+        context = Context(
+            highlight=highlight,
+            start_page=start_page,
+            end_page=end_page,
+            pages=self.pdf_handler,
+            pdf_path=self.pdf_handler.pdf_path,
+        )
+        if self.token_budget:
+            self._trim_to_budget(context)
+        return context
+
+    def _trim_to_budget(self, context):
+        """Keep the blocks around the highlight, expanding outward until the budget is met"""
+        window = [
+            (page_num, index, block)
+            for page_num in range(context.start_page, context.end_page + 1)
+            for index, block in enumerate(self.pdf_handler.get_page_blocks(page_num))
+        ]
+        anchor = self._anchor_block(window, context.page - 1, context.rect)
+        if anchor is None:
+            return  # no text on the highlight's page; keep the whole window
+
+        tokens = [estimate_tokens(block[4]) for _, _, block in window]
+        used = tokens[anchor]
+        before, after = anchor - 1, anchor + 1
+        # Alternate between the blocks after and before the selection, stopping in a
+        # direction as soon as its next block does not fit
+        while True:
+            grew = False
+            if after < len(window) and used + tokens[after] <= self.token_budget:
+                used += tokens[after]
+                after += 1
+                grew = True
+            if before >= 0 and used + tokens[before] <= self.token_budget:
+                used += tokens[before]
+                before -= 1
+                grew = True
+            if not grew:
+                break
+
+        selected = window[before + 1:after]
+        context.blocks = tuple((page_num, index) for page_num, index, _ in selected)
+        context.start_page = selected[0][0]
+        context.end_page = selected[-1][0]
+        context.tokens_saved = sum(tokens) - used
+
+    @staticmethod
+    def _anchor_block(window, page_num, rect):
+        """Index in `window` of the block on `page_num` that overlaps `rect` most, or the nearest one"""
+        x0, y0, x1, y1 = rect
+        best, best_key = None, None
+        for i, (block_page, _, block) in enumerate(window):
+            if block_page != page_num:
+                continue
+            overlap = (
+                max(0.0, min(x1, block[2]) - max(x0, block[0]))
+                * max(0.0, min(y1, block[3]) - max(y0, block[1]))
             )
-        return contexts
+            distance = max(block[1] - y1, y0 - block[3], 0.0)
+            key = (-overlap, distance)
+            if best_key is None or key < best_key:
+                best, best_key = i, key
+        return best
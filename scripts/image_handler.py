@@ -1,16 +1,38 @@
-from PyPDF2 import PdfReader
-from pdf2image import convert_from_path
-from PIL import Image, ImageOps
+import fitz  # PyMuPDF
+from PIL import Image
+from collections import OrderedDict
 import os
 import hashlib
+import logging
+import threading
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from profiler import get_profiler
 
 class PDFImageHandler:
-    def __init__(self, output_dir="pdf_images"):
+    def __init__(self, output_dir="pdf_images", page_cache_size=8, max_open_docs=2):
         self.output_dir = output_dir
         os.makedirs(output_dir, exist_ok=True)
 
-    def create_context_image(self, pdf_path, page_number, pdf_id, zoom_factor=2, grayscale=False):
-        """Creates a context image for a highlight and returns the image filename"""
+        # Rendered pages shared by the overlapping 7-page windows of nearby highlights
+        self.page_cache_size = page_cache_size
+        self._page_cache = OrderedDict()
+        self.page_renders = 0
+
+        # Documents opened by this handler, reused across calls; only the most
+        # recently used ones stay open, as a pool worker renders many books
+        self.max_open_docs = max_open_docs
+        self._docs = OrderedDict()
+        # PyMuPDF documents must not be used from several threads at once
+        self._lock = threading.Lock()
+
+    def create_context_image(self, pdf_path, page_number, pdf_id, zoom_factor=2, grayscale=False, doc=None, quality=10):
+        """Creates a context image for a highlight and returns the image filename
+
+        Pages are rendered in-process at `zoom_factor` x 72 dpi. Pass an already open
+        PyMuPDF `doc` to avoid reopening the file.
+        """
         # Generate unique filename based on PDF ID and page
         image_id = hashlib.md5(f"{pdf_id}_{page_number}".encode()).hexdigest()[:8]
         output_file = f"context_{image_id}.jpg"
@@ -20,41 +42,136 @@ class PDFImageHandler:
         if os.path.exists(output_path):
             return output_file
 
-        reader = PdfReader(pdf_path)
-        total_pages = len(reader.pages)
-
-        # Calculate the range of pages to extract
-        start_page = max(page_number - 3, 1)
-        end_page = min(page_number + 3, total_pages)
+        with self._lock:
+            if doc is None:
+                doc = self._open(pdf_path)
+            total_pages = len(doc)
 
-        # Convert specified pages to images
-        images = convert_from_path(pdf_path, first_page=start_page, last_page=end_page)
+            # Calculate the range of pages to extract (1-based, inclusive)
+            start_page = max(page_number - 3, 1)
+            end_page = min(page_number + 3, total_pages)
 
-        # Process and concatenate images
-        zoomed_images = []
-        total_width = 0
-        total_height = 0
-
-        for image in images:
-            zoomed_width = int(image.width * zoom_factor)
-            zoomed_height = int(image.height * zoom_factor)
-            zoomed_image = image.resize((zoomed_width, zoomed_height), Image.LANCZOS)
-            if grayscale:
-                zoomed_image = zoomed_image.convert("L")
-            zoomed_images.append(zoomed_image)
-            total_width = max(total_width, zoomed_width)
-            total_height += zoomed_height
+            images = [
+                self._render_page(doc, pdf_id, page_num - 1, zoom_factor, grayscale)
+                for page_num in range(start_page, end_page + 1)
+            ]
 
         # Create concatenated image
+        total_width = max(image.width for image in images)
+        total_height = sum(image.height for image in images)
         concatenated_image = Image.new('RGB' if not grayscale else 'L', (total_width, total_height))
 
         current_y = 0
-        for zoomed_image in zoomed_images:
-            concatenated_image.paste(zoomed_image, (0, current_y))
-            current_y += zoomed_image.height
+        for image in images:
+            concatenated_image.paste(image, (0, current_y))
+            current_y += image.height
 
         # Save optimized image
-        concatenated_image = ImageOps.exif_transpose(concatenated_image)
-        concatenated_image.save(output_path, "JPEG", quality=10, optimize=True)
+        concatenated_image.save(output_path, "JPEG", quality=quality, optimize=True)
+
+        return output_file
+
+    def _open(self, pdf_path):
+        doc = self._docs.get(pdf_path)
+        if doc is not None:
+            self._docs.move_to_end(pdf_path)
+            return doc
+        doc = self._docs[pdf_path] = fitz.open(pdf_path)
+        while len(self._docs) > max(1, self.max_open_docs):
+            self._docs.popitem(last=False)[1].close()
+        return doc
+
+    def _render_page(self, doc, pdf_id, page_index, zoom_factor, grayscale):
+        key = (pdf_id, page_index, zoom_factor, grayscale)
+        image = self._page_cache.get(key)
+        if image is not None:
+            self._page_cache.move_to_end(key)
+            return image
+
+        colorspace = fitz.csGRAY if grayscale else fitz.csRGB
+        pix = doc.load_page(page_index).get_pixmap(
+            matrix=fitz.Matrix(zoom_factor, zoom_factor), colorspace=colorspace, alpha=False
+        )
+        image = Image.frombytes('L' if grayscale else 'RGB', (pix.width, pix.height), pix.samples)
+        self.page_renders += 1
+
+        if self.page_cache_size > 0:
+            self._page_cache[key] = image
+            if len(self._page_cache) > self.page_cache_size:
+                self._page_cache.popitem(last=False)
+        return image
+
+    def close(self):
+        for doc in self._docs.values():
+            doc.close()
+        self._docs.clear()
+        self._page_cache.clear()
+
+
+# Handler owned by each ContextImagePipeline worker process
+_worker_handler = None
+
+def _init_worker(output_dir):
+    global _worker_handler
+    _worker_handler = PDFImageHandler(output_dir)
+
+def _render_context_image(pdf_path, page_number, pdf_id):
+    return _worker_handler.create_context_image(pdf_path, page_number, pdf_id)
+
+class ContextImagePipeline:
+    """Renders context images on a process pool, independently of flashcard generation.
+
+    Submit contexts as early as possible, let the LLM calls run, then attach the
+    rendered images to the finished flashcards. Each (pdf_id, page) image is
+    rendered once no matter how many highlights share it.
+    """
+
+    def __init__(self, output_dir="pdf_images", max_workers=None):
+        os.makedirs(output_dir, exist_ok=True)
+        # spawn rather than fork: the parent runs LLM threads while workers start
+        self.executor = ProcessPoolExecutor(
+            max_workers=max_workers or os.cpu_count(),
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(output_dir,),
+        )
+        self._futures = {}
+
+    def submit(self, contexts):
+        profiler = get_profiler()
+        for context in contexts:
+            key = (context.pdf_id, context.page)
+            if key not in self._futures:
+                future = self.executor.submit(
+                    _render_context_image, context.pdf_path, context.page, context.pdf_id
+                )
+                if profiler.enabled:
+                    # Time from submission to the rendered file, queueing included
+                    submitted = time.perf_counter()
+                    future.add_done_callback(
+                        lambda f, submitted=submitted, page=context.page: profiler.record(
+                            "image_render", submitted, time.perf_counter() - submitted, page=page,
+                        )
+                    )
+                self._futures[key] = future
+
+    def attach(self, flashcards):
+        """Set context_image on each flashcard, waiting for its render if needed"""
+        for flashcard in flashcards:
+            future = self._futures.get((flashcard.pdf_id, flashcard.page))
+            if future is None:
+                continue
+            try:
+                flashcard.context_image = future.result()
+            except Exception as e:
+                logging.error(f"Error rendering context image for page {flashcard.page}: {e}")
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self._futures.clear()
+
+    def __enter__(self):
+        return self
 
-        return output_file 
\ No newline at end of file
+    def __exit__(self, *exc_info):
+        self.close()
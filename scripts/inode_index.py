@@ -0,0 +1,100 @@
+import os
+import logging
+
+INODE_PATHS_TABLE = "inode_paths"
+
+
+def scan_tree(root, suffixes=(".pdf",)):
+    """Return {inode: path} for the files under `root` whose name ends in one of `suffixes`.
+
+    Uses os.scandir, whose directory entries carry the inode, so files are not
+    stat'ed one by one. Symlinks are not followed.
+    """
+    found = {}
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.name.lower().endswith(suffixes) and entry.is_file(follow_symlinks=False):
+                            found[entry.inode()] = entry.path
+                    except OSError:
+                        continue
+        except OSError as e:
+            logging.debug(f"Skipping {directory}: {e}")
+    return found
+
+
+class InodeIndex:
+    """Persistent inode -> path index of the PDFs under a root directory.
+
+    Lookups are dict lookups checked against the file system; the tree is only
+    re-scanned when an inode can't be found at its indexed path, and then once
+    for a whole group of inodes.
+    """
+
+    def __init__(self, storage, root, suffixes=(".pdf",)):
+        # Table is created by the storage migrations
+        self.storage = storage
+        self.root = root
+        self.suffixes = suffixes
+        self.scans = 0
+        self.paths = dict(self.storage.query(f"SELECT inode, file_path FROM {INODE_PATHS_TABLE}"))
+
+    def lookup(self, inode):
+        """Return the indexed path of `inode` if the file is still there, else None"""
+        path = self.paths.get(inode)
+        if path is None:
+            return None
+        try:
+            if os.lstat(path).st_ino == inode:
+                return path
+        except OSError:
+            pass
+        return None
+
+    def resolve(self, inodes):
+        """Return {inode: path} for each of `inodes` that still exists under the root.
+
+        Inodes missing from the index trigger a single re-scan of the tree.
+        """
+        resolved = {}
+        missing = []
+        for inode in inodes:
+            path = self.lookup(inode)
+            if path is None:
+                missing.append(inode)
+            else:
+                resolved[inode] = path
+
+        if missing:
+            self.rebuild()
+            for inode in missing:
+                if inode in self.paths:
+                    resolved[inode] = self.paths[inode]
+        return resolved
+
+    def record(self, moves):
+        """Keep the index current with (inode, path) moves observed some other way"""
+        moves = list(moves)
+        self.paths.update(moves)
+        with self.storage.transaction() as conn:
+            conn.executemany(
+                f"INSERT OR REPLACE INTO {INODE_PATHS_TABLE} (inode, file_path) VALUES (?, ?)",
+                moves,
+            )
+
+    def rebuild(self):
+        """Re-scan the root and replace the stored index"""
+        self.paths = scan_tree(self.root, self.suffixes)
+        self.scans += 1
+        with self.storage.transaction() as conn:
+            conn.execute(f"DELETE FROM {INODE_PATHS_TABLE}")
+            conn.executemany(
+                f"INSERT INTO {INODE_PATHS_TABLE} (inode, file_path) VALUES (?, ?)",
+                self.paths.items(),
+            )
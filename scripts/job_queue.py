@@ -0,0 +1,241 @@
+import os
+import socket
+import time
+from records import Flashcard, Highlight, parse_rect, rect_str
+from storage import MAX_QUERY_PARAMS
+
+# Job states
+PENDING = "pending"  # waiting for a worker
+CLAIMED = "claimed"  # leased by a worker until lease_expires
+DONE = "done"  # cards stored and the highlight recorded
+FAILED = "failed"  # no cards; retried by later runs
+
+JOBS_TABLE = "highlight_jobs"
+CARDS_TABLE = "flashcards"
+
+# A worker that makes no progress for this long loses its claims to other workers
+DEFAULT_LEASE_SECONDS = 600
+
+
+def default_owner():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _is_dead_local_owner(owner):
+    """Whether `owner` was a process on this host that is no longer running"""
+    host, _, pid = owner.rpartition(":")
+    if host != socket.gethostname() or not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass  # running as another user
+    return False
+
+
+def _chunks(items):
+    for i in range(0, len(items), MAX_QUERY_PARAMS):
+        yield items[i:i + MAX_QUERY_PARAMS]
+
+
+class JobQueue:
+    """Durable queue of the highlights to turn into flashcards, in tracked_files.db.
+
+    Workers claim highlights with a lease, so several processes on one host can
+    work through the same books without doing a highlight twice. The database is
+    in WAL mode, which needs memory shared between its users and does not work
+    on network filesystems, so workers on other hosts are refused (see claim). A
+    highlight's cards are stored, and the highlight recorded as done, in the
+    same transaction, so an interrupted run loses at most the requests that were
+    in flight. Claims of a worker that crashed are taken over once their lease
+    runs out, or at once by a worker on the same host. Cards stay in the
+    database, so decks can be written again without calling the LLM.
+    """
+
+    def __init__(self, storage, owner=None, lease_seconds=DEFAULT_LEASE_SECONDS):
+        # Tables are created by the storage migrations
+        self.storage = storage
+        self.owner = owner or default_owner()
+        self.lease_seconds = lease_seconds
+        # Jobs that failed since this queue was created are not retried by it
+        self.started_at = time.time()
+        self._released_dead_owners = False
+
+    def claim(self, highlights):
+        """Enqueue `highlights` and return the ones this worker claimed, in input order.
+
+        Jobs that are done, or leased by another worker, are left out. Raises
+        RuntimeError when a worker on another host holds live claims, i.e. the
+        database is shared over a network filesystem.
+        """
+        highlights = list(highlights)
+        if not highlights:
+            return []
+        if not self._released_dead_owners:
+            self.check_single_host()
+            self.release_dead_owners()
+            self._released_dead_owners = True
+
+        now = time.time()
+        claimed = set()
+        with self.storage.transaction() as conn:
+            conn.executemany(
+                f"INSERT OR IGNORE INTO {JOBS_TABLE} (highlight_id, pdf_id, page, rect, text, state, updated_at) "
+                f"VALUES (?, ?, ?, ?, ?, '{PENDING}', ?)",
+                [
+                    (h.highlight_id, h.pdf_id, h.page, rect_str(h.rect), h.text, now)
+                    for h in highlights
+                ],
+            )
+            for chunk in _chunks([h.highlight_id for h in highlights]):
+                placeholders = ",".join("?" * len(chunk))
+                ids = [row[0] for row in conn.execute(
+                    f"""
+                    SELECT highlight_id FROM {JOBS_TABLE}
+                    WHERE highlight_id IN ({placeholders})
+                    AND (state = '{PENDING}'
+                         OR (state = '{CLAIMED}' AND lease_expires < ?)
+                         OR (state = '{FAILED}' AND updated_at < ?))
+                    """,
+                    (*chunk, now, self.started_at),
+                )]
+                conn.executemany(
+                    f"UPDATE {JOBS_TABLE} SET state = '{CLAIMED}', owner = ?, lease_expires = ?, updated_at = ? "
+                    "WHERE highlight_id = ?",
+                    [(self.owner, now + self.lease_seconds, now, highlight_id) for highlight_id in ids],
+                )
+                claimed.update(ids)
+        return [h for h in highlights if h.highlight_id in claimed]
+
+    def complete(self, highlight, flashcards):
+        """Store the cards of a claimed highlight and mark it done; no cards marks it failed.
+
+        Returns False, storing nothing, when the claim was lost to another worker
+        after its lease ran out; that worker's result stands.
+        """
+        if not flashcards:
+            return self.fail(highlight, "no flashcards generated")
+        now = time.time()
+        with self.storage.transaction() as conn:
+            if not self._owns(conn, highlight):
+                return False
+            conn.execute(f"DELETE FROM {CARDS_TABLE} WHERE highlight_id = ?", (highlight.highlight_id,))
+            conn.executemany(
+                f"INSERT INTO {CARDS_TABLE} (highlight_id, card_index, question, answer, context_image, pdf_path) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (highlight.highlight_id, i, card.question, card.answer, card.context_image or "", card.pdf_path)
+                    for i, card in enumerate(flashcards)
+                ],
+            )
+            conn.execute(
+                "INSERT OR IGNORE INTO highlights (highlight_id, pdf_id, page, rect, text) VALUES (?, ?, ?, ?, ?)",
+                (highlight.highlight_id, highlight.pdf_id, highlight.page, rect_str(highlight.rect), highlight.text),
+            )
+            self._finish(conn, highlight, DONE, None, now)
+        return True
+
+    def fail(self, highlight, error):
+        """Mark a claimed highlight failed; False when the claim was lost to another worker"""
+        with self.storage.transaction() as conn:
+            if not self._owns(conn, highlight):
+                return False
+            self._finish(conn, highlight, FAILED, str(error), time.time())
+        return True
+
+    def _owns(self, conn, highlight):
+        row = conn.execute(
+            f"SELECT 1 FROM {JOBS_TABLE} WHERE highlight_id = ? AND owner = ? AND state = '{CLAIMED}'",
+            (highlight.highlight_id, self.owner),
+        ).fetchone()
+        return row is not None
+
+    def _finish(self, conn, highlight, state, error, now):
+        conn.execute(
+            f"UPDATE {JOBS_TABLE} SET state = ?, owner = NULL, lease_expires = NULL, "
+            "attempts = attempts + 1, error = ?, updated_at = ? WHERE highlight_id = ?",
+            (state, error, now, highlight.highlight_id),
+        )
+        # Progress renews the lease on the rest of this worker's claims
+        conn.execute(
+            f"UPDATE {JOBS_TABLE} SET lease_expires = ? WHERE owner = ? AND state = '{CLAIMED}'",
+            (now + self.lease_seconds, self.owner),
+        )
+
+    def release(self, highlight_ids):
+        """Hand back the claims on `highlight_ids` that are still unfinished, e.g. when a run stops early.
+
+        Only the given ids are released: other books processed by the same worker
+        keep their claims.
+        """
+        with self.storage.transaction() as conn:
+            return sum(
+                conn.execute(
+                    f"UPDATE {JOBS_TABLE} SET state = '{PENDING}', owner = NULL, lease_expires = NULL "
+                    f"WHERE highlight_id = ? AND owner = ? AND state = '{CLAIMED}'",
+                    (highlight_id, self.owner),
+                ).rowcount
+                for highlight_id in highlight_ids
+            )
+
+    def check_single_host(self):
+        """Raise RuntimeError if workers on other hosts hold claims that have not expired"""
+        owners = self.storage.query(
+            f"SELECT DISTINCT owner FROM {JOBS_TABLE} WHERE state = '{CLAIMED}' AND lease_expires >= ?",
+            (time.time(),),
+        )
+        host = socket.gethostname()
+        foreign = sorted(owner for owner, in owners if ":" in owner and owner.rpartition(":")[0] != host)
+        if foreign:
+            raise RuntimeError(
+                f"{self.storage.db_path} is being used by workers on other hosts ({', '.join(foreign)}). "
+                "The job queue only supports workers on one host; keep the database on a local disk."
+            )
+
+    def release_dead_owners(self):
+        """Release the claims of crashed workers on this host without waiting for their leases"""
+        owners = self.storage.query(f"SELECT DISTINCT owner FROM {JOBS_TABLE} WHERE state = '{CLAIMED}'")
+        dead = [owner for owner, in owners if owner != self.owner and _is_dead_local_owner(owner)]
+        if not dead:
+            return 0
+        with self.storage.transaction() as conn:
+            return sum(
+                conn.execute(
+                    f"UPDATE {JOBS_TABLE} SET state = '{PENDING}', owner = NULL, lease_expires = NULL "
+                    f"WHERE owner = ? AND state = '{CLAIMED}'",
+                    (owner,),
+                ).rowcount
+                for owner in dead
+            )
+
+    def counts(self, pdf_id):
+        """{state: number of jobs} of a PDF"""
+        return dict(self.storage.query(
+            f"SELECT state, COUNT(*) FROM {JOBS_TABLE} WHERE pdf_id = ? GROUP BY state", (pdf_id,)
+        ))
+
+    def cards(self, pdf_id, unexported_only=False):
+        """Stored flashcards of a PDF, in page order"""
+        rows = self.storage.query(
+            f"""
+            SELECT c.question, c.answer, c.context_image, c.pdf_path, h.highlight_id, h.text, h.page, h.rect
+            FROM {CARDS_TABLE} c JOIN highlights h ON h.highlight_id = c.highlight_id
+            WHERE h.pdf_id = ? {"AND c.exported = 0" if unexported_only else ""}
+            ORDER BY h.page, c.highlight_id, c.card_index
+            """,
+            (pdf_id,),
+        )
+        return [
+            Flashcard(question, answer, Highlight(highlight_id, text, page, pdf_id, parse_rect(rect)), pdf_path, image)
+            for question, answer, image, pdf_path, highlight_id, text, page, rect in rows
+        ]
+
+    def mark_exported(self, flashcards):
+        """Record that these cards were written to a deck, so later runs leave them out"""
+        with self.storage.transaction() as conn:
+            conn.executemany(
+                f"UPDATE {CARDS_TABLE} SET exported = 1 WHERE highlight_id = ?",
+                {(card.highlight_id,) for card in flashcards},
+            )
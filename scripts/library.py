@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+import os
+import glob
+import argparse
+import logging
+import traceback
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from main import Pipeline, add_pipeline_arguments, pipeline_from_args, load_env
+
+def discover_pdfs(paths):
+    """Expand files, directories (searched recursively) and glob patterns into PDF paths.
+
+    Each PDF is returned once, in the order it was first found.
+    """
+    found = {}
+    for path in paths:
+        matches = glob.glob(os.path.expanduser(path), recursive=True) or [path]
+        for match in sorted(matches):
+            if os.path.isdir(match):
+                for root, dirs, files in os.walk(match):
+                    dirs.sort()
+                    for name in sorted(files):
+                        if name.lower().endswith(".pdf"):
+                            found.setdefault(os.path.realpath(os.path.join(root, name)), None)
+            elif match.lower().endswith(".pdf") and os.path.isfile(match):
+                found.setdefault(os.path.realpath(match), None)
+            else:
+                logging.warning(f"Skipping {match}: not a PDF file or directory")
+    return list(found)
+
+def process_library(pipeline: Pipeline, pdf_paths, books_in_parallel: int = 2):
+    """Process every PDF with the shared pipeline and return one summary per book.
+
+    Several books are extracted and packaged at once; their LLM requests all go
+    through the pipeline's generator, so `--concurrency` stays a global limit.
+    A book that fails is reported in its summary instead of stopping the run.
+    Books that share a file name are refused, since each book's deck and lock
+    file are named after its file name.
+    """
+    name_counts = Counter(os.path.basename(pdf_path) for pdf_path in pdf_paths)
+
+    def process(pdf_path):
+        name = os.path.basename(pdf_path)
+        if name_counts[name] > 1:
+            logging.error(f"Skipping {pdf_path}: {name_counts[name]} books are named {name}")
+            return {"pdf_path": pdf_path, "error": f"another book is also named {name}; rename one of them"}
+        try:
+            return pipeline.process_pdf(pdf_path)
+        except Exception as e:
+            logging.error(f"Error processing {pdf_path}: {e}")
+            traceback.print_exc()
+            return {"pdf_path": pdf_path, "error": str(e)}
+
+    with ThreadPoolExecutor(max_workers=max(1, books_in_parallel)) as executor:
+        return list(executor.map(process, pdf_paths))
+
+def print_summary(summaries):
+    header = f"{'Book':<40} {'New':>6} {'Cards':>6} {'API':>6} {'Cached':>7} {'Backoff':>8} {'Time':>8}"
+    print()
+    print(header)
+    print("-" * len(header))
+    totals = {"new_highlights": 0, "cards": 0, "api_calls": 0, "cache_hits": 0, "retry_seconds": 0.0, "seconds": 0.0}
+    for summary in summaries:
+        name = os.path.basename(summary["pdf_path"])
+        if len(name) > 40:
+            name = name[:37] + "..."
+        if summary.get("error"):
+            print(f"{name:<40} FAILED: {summary['error']}")
+            continue
+        for key in totals:
+            totals[key] += summary.get(key, 0)
+        print(f"{name:<40} {summary['new_highlights']:>6} {summary['cards']:>6} "
+              f"{summary['api_calls']:>6} {summary['cache_hits']:>7} {summary.get('retry_seconds', 0):>7.1f}s "
+              f"{summary['seconds']:>7.1f}s")
+    print("-" * len(header))
+    print(f"{'Total (' + str(len(summaries)) + ' books)':<40} {totals['new_highlights']:>6} {totals['cards']:>6} "
+          f"{totals['api_calls']:>6} {totals['cache_hits']:>7} {totals['retry_seconds']:>7.1f}s "
+          f"{totals['seconds']:>7.1f}s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Generate flashcards for every highlighted PDF in a library, in one invocation."
+    )
+    parser.add_argument("language", help="Set language of flashcards")
+    parser.add_argument("paths", nargs="+", help="PDF files, directories or glob patterns")
+    parser.add_argument("--books-in-parallel", type=int, default=2, help="Number of books extracted and packaged at once")
+    add_pipeline_arguments(parser)
+
+    args = parser.parse_args()
+
+    pdf_paths = discover_pdfs(args.paths)
+    if not pdf_paths:
+        print("No PDF files found.")
+    else:
+        print(f"Found {len(pdf_paths)} PDF file(s).")
+        load_env()
+        pipeline = pipeline_from_args(args)
+        try:
+            summaries = process_library(pipeline, pdf_paths, args.books_in_parallel)
+        finally:
+            pipeline.close()
+        print_summary(summaries)
@@ -1,119 +1,449 @@
 #!/usr/bin/env python3
 
 import os
+import time
 import argparse
-from pdf_handler import PDFHandler
-from highlight_context_extractor import HighlightContextExtractor
-from flashcard_generator import (
-    FlashcardGenerator,
-    OpenAIProvider,
-    AnthropicProvider,
-    GeminiProvider,
-)
+import importlib
+import threading
+from itertools import chain, islice
 from highlight_manager import HighlightManager
-from flashcard_output_to_anki_handler import FlashcardOutputHandler
+from extraction_index import ExtractionIndex
+from pdf_identity import PDFIdentity
+from job_queue import DEFAULT_LEASE_SECONDS, JobQueue
+from storage import get_storage
+from response_cache import ResponseCache
+from anki_connect import ANKI_CONNECT_URL
+from profiler import enable_profiling, get_profiler
 from dotenv import load_dotenv
+# PDF parsing, the LLM SDKs, imaging and genanki are imported where a stage first
+# needs them, so maintenance commands like --delete-last start in milliseconds
+
+SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
+DB_PATH = os.path.join(SCRIPT_DIR, "tracked_files.db")
+OUTPUT_BACKENDS = ["apkg", "anki-connect"]
+# Tokens of surrounding text sent with each highlight; 0 sends the full pages around it
+DEFAULT_CONTEXT_TOKEN_BUDGET = 1000
+
+# LLM_PROVIDER name -> (module, class); only the selected provider's module is imported
+LLM_PROVIDERS = {
+    "openai": ("flashcard_generator", "OpenAIProvider"),
+    "anthropic": ("flashcard_generator", "AnthropicProvider"),
+    "gemini": ("flashcard_generator", "GeminiProvider"),
+}
 
 def get_llm_provider(provider_name: str, api_key: str):
-    providers = {
-        "openai": OpenAIProvider,
-        "anthropic": AnthropicProvider,
-        "gemini": GeminiProvider,
-    }
-    if provider_name not in providers:
+    if provider_name not in LLM_PROVIDERS:
         raise ValueError(
-            f"Unsupported provider: {provider_name}\n\nThe options are: \n{providers}"
+            f"Unsupported provider: {provider_name}\n\nThe options are: \n{list(LLM_PROVIDERS)}"
         )
-    return providers[provider_name](api_key)
+    module_name, class_name = LLM_PROVIDERS[provider_name]
+    provider_class = getattr(importlib.import_module(module_name), class_name)
+    return provider_class(api_key)
+
+def load_llm_provider_from_env():
+    # Safely get API key and provider name from .env variables
+    api_key = os.getenv("API_KEY_2")
+    provider_name = os.getenv("LLM_PROVIDER")
+
+    # Check if the environment variables are loaded
+    if provider_name is None:
+        raise ValueError("LLM_PROVIDER environment variable is not set.")
+    if api_key is None:
+        raise ValueError("API_KEY environment variable is not set.")
+
+    # Create the appropriate LLMProvider instance
+    return get_llm_provider(provider_name, api_key)
+
+def get_new_highlights(storage, highlights):
+    """Return the highlights that have no flashcards recorded in the database yet"""
+    with get_profiler().span("db", operation="existing_ids", rows=len(highlights)):
+        existing = storage.existing_ids(highlight.highlight_id for highlight in highlights)
+    return [highlight for highlight in highlights if highlight.highlight_id not in existing]
+
+def iter_claimed_highlights(storage, job_queue, highlights, chunk_size=10, claimed_ids=None):
+    """Lazily claim the new highlights in the job queue, skipping those other workers hold.
+
+    Claims are made a few highlights at a time, just ahead of the LLM calls, so
+    concurrent workers split a book between them. The ids claimed are added to
+    the optional `claimed_ids` set.
+    """
+    highlights = iter(highlights)
+    while True:
+        chunk = list(islice(highlights, chunk_size))
+        if not chunk:
+            return
+        new = get_new_highlights(storage, chunk)
+        with get_profiler().span("db", operation="claim", rows=len(new)):
+            claimed = job_queue.claim(new)
+        if claimed_ids is not None:
+            claimed_ids.update(highlight.highlight_id for highlight in claimed)
+        yield from claimed
 
-def delete_highlight_history(pdf_path: str, batch: int = None):
-    script_dir = os.path.dirname(os.path.realpath(__file__))
-    db_path = os.path.join(script_dir, "tracked_files.db")
-    highlight_manager = HighlightManager(db_path)
+def delete_highlight_history(pdf_path: str):
+    highlight_manager = HighlightManager(DB_PATH)
 
     # Get the current highlight count
-    initial_count = highlight_manager.get_highlight_count(pdf_path, batch)
+    initial_count = highlight_manager.get_highlight_count(pdf_path)
 
     # Delete the highlights
-    highlight_manager.delete_highlight_history(pdf_path, batch)
+    highlight_manager.delete_highlight_history(pdf_path)
 
     # Get the new highlight count
-    final_count = highlight_manager.get_highlight_count(pdf_path, batch)
+    final_count = highlight_manager.get_highlight_count(pdf_path)
 
-    if batch:
-        print(f"Deleted {initial_count - final_count} highlights from batch {batch} for {pdf_path}")
-    else:
-        print(f"Deleted {initial_count - final_count} highlights for {pdf_path}")
+    print(f"Deleted {initial_count - final_count} highlights for {pdf_path}")
 
-def main(pdf_path: str, language, batch_size: int, delete_history=False):
+class Pipeline:
+    """Everything shared by the PDFs processed in one invocation.
 
-    # Load .env file from the root directory of the project
-    script_dir = os.path.dirname(os.path.realpath(__file__))
-    env_path = os.path.abspath(os.path.join(script_dir, "..", ".env"))
-    load_dotenv(dotenv_path=env_path)
+    The database connection, LLM provider client, response cache and image worker
+    pool are created once, and the provider and image workers only when a PDF
+    actually has new highlights. Highlights are claimed from the persistent job
+    queue, so concurrent runs on this host and restarted runs pick up where
+    others stopped, and their cards are stored there as they complete. With
+    `profile` (or a `trace_out` path), the time spent in each stage is printed as
+    a table on close and optionally written as a Chrome trace.
+    """
 
-    if delete_history:
-        delete_highlight_history(pdf_path)
-        return
+    def __init__(self, language, batch_size: int = 10, concurrency: int = 4,
+                 requests_per_minute: float = None, prompt_token_budget: int = None,
+                 use_cache: bool = True, cache_max_mb: float = 200,
+                 cache_ttl_days: float = None, image_workers: int = None,
+                 output: str = "apkg", anki_connect_url: str = ANKI_CONNECT_URL,
+                 context_token_budget: int = DEFAULT_CONTEXT_TOKEN_BUDGET,
+                 scan_workers: int = None, profile: bool = False, trace_out: str = None,
+                 llm_provider=None, db_path: str = None,
+                 lease_seconds: float = DEFAULT_LEASE_SECONDS):
+        self.language = language
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.requests_per_minute = requests_per_minute
+        self.prompt_token_budget = prompt_token_budget
+        self.context_token_budget = context_token_budget
+        self.image_workers = image_workers
+        self.scan_workers = scan_workers or os.cpu_count() or 1
+        if output not in OUTPUT_BACKENDS:
+            raise ValueError(f"Unsupported output: {output}\n\nThe options are: \n{OUTPUT_BACKENDS}")
+        self.output = output
+        self.anki_connect_url = anki_connect_url
+        self.trace_out = trace_out
+        # Enabled before anything is opened, so PDF open and ID hashing are timed too
+        self.profiler = enable_profiling() if profile or trace_out else get_profiler()
+        self.storage = get_storage(db_path or DB_PATH)
+        self.index = ExtractionIndex(self.storage)
+        self.identity = PDFIdentity(self.storage)
+        self.job_queue = JobQueue(self.storage, lease_seconds=lease_seconds)
 
-    pdf_path = os.path.abspath(pdf_path)
+        self.response_cache = None
+        if use_cache:
+            self.response_cache = ResponseCache(
+                os.path.join(SCRIPT_DIR, "llm_cache"),
+                max_bytes=int(cache_max_mb * 1024 * 1024),
+                ttl=cache_ttl_days * 86400 if cache_ttl_days else None,
+            )
 
-    # Step 1: Extract highlights from the PDF
-    print("Step 1: Extracting PDF highlights...")
-    pdf_handler = PDFHandler(pdf_path)
-    highlights = pdf_handler.extract_highlights()
+        # An LLMProvider instance to use instead of the one configured in the environment
+        self.llm_provider = llm_provider
+        self._flashcard_generator = None
+        self._image_pipeline = None
+        self._anki_client = None
+        self._lock = threading.Lock()
 
-    # Step 2: Extract contexts from the highlights
-    print("Step 2: Extracting contexts from the highlights...")
-    context_extractor = HighlightContextExtractor(pdf_handler)
-    contexts = context_extractor.get_contexts(highlights)
+    @property
+    def flashcard_generator(self):
+        with self._lock:
+            if self._flashcard_generator is None:
+                from flashcard_generator import FlashcardGenerator
+                print("Loading LLM...")
+                self._flashcard_generator = FlashcardGenerator(
+                    self.llm_provider or load_llm_provider_from_env(),
+                    max_concurrency=self.concurrency,
+                    requests_per_minute=self.requests_per_minute,
+                    storage=self.storage,
+                    response_cache=self.response_cache,
+                    # Results are recorded through the job queue, together with their cards
+                    record_highlights=False,
+                )
+            return self._flashcard_generator
 
-    # Safely get API key and provider name from .env variables
-    api_key = os.getenv("API_KEY_2")
-    provider_name = os.getenv("LLM_PROVIDER")
+    @property
+    def image_pipeline(self):
+        with self._lock:
+            if self._image_pipeline is None:
+                from image_handler import ContextImagePipeline
+                self._image_pipeline = ContextImagePipeline(max_workers=self.image_workers)
+            return self._image_pipeline
 
-    # Check if the environment variables are loaded
-    if provider_name is None:
-        raise ValueError("LLM_PROVIDER environment variable is not set.")
-    if api_key is None:
-        raise ValueError("API_KEY environment variable is not set.")
+    def make_output_handler(self):
+        """Output backend for one book: an .apkg writer, or a push into a running Anki"""
+        if self.output == "anki-connect":
+            from anki_connect import AnkiConnectClient
+            from anki_connect_output import AnkiConnectOutputHandler
+            with self._lock:
+                if self._anki_client is None:
+                    self._anki_client = AnkiConnectClient(self.anki_connect_url)
+            return AnkiConnectOutputHandler(self._anki_client)
+        from flashcard_output_to_anki_handler import FlashcardOutputHandler
+        return FlashcardOutputHandler()
 
-    # Create the appropriate LLMProvider instance
-    print("Step 3: Loading LLM...")
-    llm_provider = get_llm_provider(provider_name, api_key)
-
-    # Step 4: Generate flashcards in batches
-    print("Step 4: Generating flashcards in batches...")
-    flashcard_generator = FlashcardGenerator(llm_provider)
-    output_handler = FlashcardOutputHandler()
-
-    all_flashcards = []
-
-    for i in range(0, len(contexts), batch_size):
-        batch = contexts[i:i+batch_size]
-
-        for context in batch:
-            highlight_id = context['highlight_id']
-            exists = flashcard_generator.highlight_exists(highlight_id)
-            if not exists:
-                print(f"Generating flashcards for context on page {context['page']}...")
-                flashcards = flashcard_generator.generate_flashcards([context], language)
-                all_flashcards.extend(flashcards[0])
-                flashcard_generator._store_highlight_id(highlight_id, context)
+    def process_pdf(self, pdf_path: str):
+        """Generate flashcards for the new highlights of one PDF and write its deck.
+
+        The deck holds the cards generated by this run and any that an interrupted
+        run stored but never wrote out. Returns a summary dict with the number of
+        new highlights, cards, API calls and the seconds spent.
+        """
+        from pdf_handler import PDFHandler
+        from highlight_context_extractor import HighlightContextExtractor
+
+        start = time.monotonic()
+        pdf_path = os.path.abspath(pdf_path)
+        name = os.path.basename(pdf_path)
+        summary = {"pdf_path": pdf_path, "new_highlights": 0, "cards": 0, "api_calls": 0, "cache_hits": 0,
+                   "retries": 0, "retry_seconds": 0.0, "context_tokens_saved": 0}
+
+        # The stages below are chained generators: highlights are extracted, turned
+        # into contexts and sent to the LLM while later pages are still being
+        # scanned, and only `batch_size` highlights are held ahead of the output
+        print(f"[{name}] Step 1: Extracting PDF highlights...")
+        pdf_handler = PDFHandler(pdf_path, index=self.index, scan_workers=self.scan_workers, identity=self.identity)
+        claimed_ids = set()
+        highlights = iter_claimed_highlights(
+            self.storage, self.job_queue, pdf_handler.iter_highlights(),
+            chunk_size=self.batch_size, claimed_ids=claimed_ids,
+        )
+
+        print(f"[{name}] Step 2: Extracting contexts from the highlights...")
+        context_extractor = HighlightContextExtractor(pdf_handler, token_budget=self.context_token_budget)
+        contexts = context_extractor.iter_contexts(highlights)
+
+        # Don't load the LLM provider or image workers for a book with nothing new
+        try:
+            first = next(contexts, None)
+            if first is not None:
+                self._generate(name, pdf_handler, chain([first], contexts), summary)
+        finally:
+            # Claims of this book that were not completed, e.g. after the provider
+            # went down, go back to the queue for the next run or another worker
+            self.job_queue.release(claimed_ids)
+
+        # Step 5: Write the Anki deck once, when this run or an interrupted one
+        # stored cards that are not in a deck yet
+        written = self._write_deck(name, pdf_path, pdf_handler.pdf_id)
+        if written is None and first is None:
+            print(f"[{name}] No new highlights found. Nothing to do.")
+            summary["seconds"] = time.monotonic() - start
+            return summary
+        if written is None:
+            print(f"[{name}] No flashcards generated. No Anki deck written.")
+
+        if summary["retries"]:
+            print(f"[{name}] {summary['retries']} retried LLM request(s), {summary['retry_seconds']:.1f}s spent backing off")
+        if summary["context_tokens_saved"]:
+            print(f"[{name}] Trimmed contexts saved ~{summary['context_tokens_saved']} token(s) of page text")
+
+        summary["seconds"] = time.monotonic() - start
+        return summary
+
+    def _generate(self, name, pdf_handler, contexts, summary):
+        """Steps 3 and 4: render context images and generate the cards of the claimed highlights"""
+        from retry_policy import ProviderUnavailableError
+
+        # Step 3: Context images are submitted as contexts are pulled; the renders run
+        # in worker processes while the LLM calls below are waiting on the network
+        flashcard_generator = self.flashcard_generator
+        print(f"[{name}] Step 3: Rendering context images...")
+        image_pipeline = self.image_pipeline
+
+        def submitted(contexts):
+            for context in contexts:
+                summary["new_highlights"] += 1
+                summary["context_tokens_saved"] += context.tokens_saved
+                image_pipeline.submit([context])
+                yield context
+
+        # Step 4: Generate flashcards, storing each highlight's cards as they complete
+        print(f"[{name}] Step 4: Generating flashcards...")
+        try:
+            for context, flashcards in flashcard_generator.iter_flashcards(
+                submitted(contexts),
+                self.language,
+                max_prompt_tokens=self.prompt_token_budget,
+                page_text=pdf_handler.get_page_text,
+                stats=summary,
+                window=self.batch_size,
+            ):
+                image_pipeline.attach(flashcards)
+                with self.profiler.span("db", operation="complete", rows=len(flashcards)):
+                    stored = self.job_queue.complete(context.highlight, flashcards)
+                if stored:
+                    summary["cards"] += len(flashcards)
                 print(flashcards)
+        except ProviderUnavailableError as e:
+            # The cards generated so far are still written
+            print(f"[{name}] Stopping flashcard generation: {e}")
+            summary["error"] = str(e)
+
+    def _write_deck(self, name, pdf_path, pdf_id, rebuild=False):
+        """Write every stored card of a PDF to the output backend and mark them exported.
+
+        Nothing is written when all the cards are already in a deck, unless
+        `rebuild`. Workers take turns through a lock file next to the deck, and each
+        writes the whole book, so the deck written last holds every card marked
+        exported. Missing context images are rendered again. Returns the number of
+        cards written, or None when there was nothing to write.
+        """
+        import fcntl
+
+        with open(f"{name}.deck.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            new = len(self.job_queue.cards(pdf_id, unexported_only=True))
+            if not new and not rebuild:
+                return None
+            flashcards = self.job_queue.cards(pdf_id)
+            if not flashcards:
+                return None
+            self._render_missing_images(pdf_path, flashcards)
+
+            output_handler = self.make_output_handler()
+            try:
+                count = output_handler.add_flashcards(flashcards, pdf_path)
+                if not count:
+                    return None
+                if self.output == "anki-connect":
+                    print(f"[{name}] Step 5: Adding {new} new flashcard(s) to Anki...")
+                    with self.profiler.span("packaging", cards=count):
+                        added = output_handler.write_deck(deck_name=name)
+                    print(f"[{name}] Added {added} note(s) to Anki successfully!")
+                else:
+                    print(f"[{name}] Step 5: Writing Anki deck with {count} flashcard(s) ({new} new)...")
+                    with self.profiler.span("packaging", cards=count):
+                        output_handler.write_deck(deck_name=name)
+                    print(f"[{name}] Anki deck written successfully! ({output_handler.media.total_bytes / 1e6:.1f} MB of media)")
+                # Cards whose notes were not written stay unexported, so the next run writes them again
+                unwritten = output_handler.unwritten_highlight_ids
+                if unwritten:
+                    print(f"[{name}] The notes of {len(unwritten)} highlight(s) were not written; they are retried by the next run")
+                self.job_queue.mark_exported([card for card in flashcards if card.highlight_id not in unwritten])
+            finally:
+                output_handler.close()
+            return count
+
+    def _render_missing_images(self, pdf_path, flashcards):
+        """Render the context images that were deleted since the cards were stored"""
+        from image_handler import PDFImageHandler
 
-            # Step 5: Create or update Anki deck for this batch
-            if all_flashcards:
-                print(f"Step 5: Creating/updating Anki deck for batch {i//batch_size + 1}...")
-                output_handler.create_anki_deck(
-                    flashcards=all_flashcards,
-                    deck_name=pdf_path.split("/")[-1],
-                    pdf_path=pdf_path,
+        missing = [
+            card for card in flashcards
+            if card.context_image and not os.path.exists(os.path.join("pdf_images", card.context_image))
+        ]
+        if not missing:
+            return
+        image_handler = PDFImageHandler()
+        try:
+            for flashcard in missing:
+                flashcard.context_image = image_handler.create_context_image(
+                    pdf_path, flashcard.page, flashcard.pdf_id
                 )
-                print(f"Anki deck updated successfully for batch {i//batch_size + 1}!")
-            else:
-                print(f"No new highlights found in batch {i//batch_size + 1}. No new flashcards created.")
+        finally:
+            image_handler.close()
 
+    def rebuild_deck(self, pdf_path: str):
+        """Write the deck of every card stored for a PDF, without calling the LLM.
+
+        Context images that are missing are rendered again. Returns the number of cards.
+        """
+        from pdf_handler import PDFHandler
+
+        pdf_path = os.path.abspath(pdf_path)
+        name = os.path.basename(pdf_path)
+        pdf_handler = PDFHandler(pdf_path, index=self.index, identity=self.identity)
+        try:
+            pdf_id = pdf_handler.pdf_id
+        finally:
+            pdf_handler.close()
+        written = self._write_deck(name, pdf_path, pdf_id, rebuild=True)
+        if not written:
+            print(f"[{name}] No stored flashcards. No Anki deck written.")
+            return 0
+        return written
+
+    def close(self):
+        if self._image_pipeline is not None:
+            self._image_pipeline.close()
+        if self._anki_client is not None:
+            self._anki_client.close()
+        if self.response_cache is not None:
+            stats = self.response_cache.stats()
+            print(f"LLM response cache: {stats['hits']} hit(s), {stats['misses']} miss(es), {stats['evictions']} eviction(s)")
+        if self.profiler.enabled:
+            self.profiler.print_table()
+            if self.trace_out:
+                self.profiler.write_trace(self.trace_out)
+                print(f"Trace written to {self.trace_out}")
+
+def add_pipeline_arguments(parser):
+    """Options shared by main.py and library.py"""
+    parser.add_argument("--batch-size", type=int, default=10, help="Number of highlights generated ahead of the output")
+    parser.add_argument("--concurrency", type=int, default=4, help="Maximum number of LLM requests in flight at once")
+    parser.add_argument("--requests-per-minute", type=float, help="Rate limit for LLM requests (defaults to the provider's limit)")
+    parser.add_argument("--image-workers", type=int, help="Processes used to render context images (defaults to the CPU count)")
+    parser.add_argument("--scan-workers", type=int, help="Processes used to scan large PDFs for highlights (defaults to the CPU count)")
+    parser.add_argument("--no-cache", action="store_true", help="Always call the LLM instead of reusing cached responses")
+    parser.add_argument("--cache-max-mb", type=float, default=200, help="Maximum size of the LLM response cache")
+    parser.add_argument("--cache-ttl-days", type=float, help="Discard cached LLM responses older than this")
+    parser.add_argument("--prompt-token-budget", type=int, help="Pack highlights with overlapping pages into shared prompts of at most this many tokens")
+    parser.add_argument("--context-token-budget", type=int, default=DEFAULT_CONTEXT_TOKEN_BUDGET, help="Keep only the text blocks nearest each highlight that fit in this many tokens (0 sends the full pages around it)")
+    parser.add_argument("--output", choices=OUTPUT_BACKENDS, default="apkg", help="Write an .apkg deck, or add new notes to a running Anki through AnkiConnect")
+    parser.add_argument("--anki-connect-url", default=ANKI_CONNECT_URL, help="AnkiConnect address used by --output anki-connect")
+    parser.add_argument("--lease-seconds", type=float, default=DEFAULT_LEASE_SECONDS, help="Seconds without progress after which a worker's claimed highlights are taken over by other workers")
+    parser.add_argument("--profile", action="store_true", help="Print the time spent in each stage (p50/p95 per call) at the end")
+    parser.add_argument("--trace-out", help="Write a Chrome trace (chrome://tracing, Perfetto) of every stage, with the highlights of each event, to this path")
+
+def pipeline_options(args):
+    """Pipeline keyword arguments, other than batch_size, from the add_pipeline_arguments options"""
+    return dict(
+        concurrency=args.concurrency,
+        requests_per_minute=args.requests_per_minute,
+        prompt_token_budget=args.prompt_token_budget,
+        use_cache=not args.no_cache,
+        cache_max_mb=args.cache_max_mb,
+        cache_ttl_days=args.cache_ttl_days,
+        image_workers=args.image_workers,
+        scan_workers=args.scan_workers,
+        output=args.output,
+        anki_connect_url=args.anki_connect_url,
+        context_token_budget=args.context_token_budget,
+        profile=args.profile,
+        trace_out=args.trace_out,
+        lease_seconds=args.lease_seconds,
+    )
+
+def pipeline_from_args(args):
+    return Pipeline(args.language, batch_size=args.batch_size, **pipeline_options(args))
+
+def load_env():
+    # Load .env file from the root directory of the project
+    env_path = os.path.abspath(os.path.join(SCRIPT_DIR, "..", ".env"))
+    load_dotenv(dotenv_path=env_path)
+
+def main(pdf_path: str, language, batch_size: int, delete_history=False, rebuild_deck=False, **pipeline_options):
+    load_env()
+
+    if delete_history:
+        delete_highlight_history(pdf_path)
+        return
+
+    pipeline = Pipeline(language, batch_size=batch_size, **pipeline_options)
+    try:
+        if rebuild_deck:
+            pipeline.rebuild_deck(pdf_path)
+            return
+        summary = pipeline.process_pdf(pdf_path)
+    finally:
+        pipeline.close()
+    if summary.get("error"):
+        raise SystemExit(f"Stopped early: {summary['error']}")
     print("All batches processed successfully!")
 
 if __name__ == "__main__":
@@ -123,15 +453,17 @@ if __name__ == "__main__":
     parser.add_argument("pdf_path", type=str, help="Path to the PDF file")
     parser.add_argument("--delete-last", type=int, help="Delete the last N highlights")
     parser.add_argument("--delete-history", action="store_true", help="Delete all highlight history for the given PDF")
+    parser.add_argument("--rebuild-deck", action="store_true", help="Write the deck again from the stored flashcards, without calling the LLM")
     parser.add_argument("language", help="Set language of flashcards")
-    parser.add_argument("--batch-size", type=int, default=10, help="Number of highlights to process in each batch")
+    add_pipeline_arguments(parser)
 
     args = parser.parse_args()
 
     if args.delete_last:
-        script_dir = os.path.dirname(os.path.realpath(__file__))
-        db_path = os.path.join(script_dir, "tracked_files.db")
-        highlight_manager = HighlightManager(db_path)
+        highlight_manager = HighlightManager(DB_PATH)
         highlight_manager.delete_last_n_highlights(args.pdf_path, args.delete_last)
     else:
-        main(args.pdf_path, args.language, args.batch_size, args.delete_history)
+        main(
+            args.pdf_path, args.language, args.batch_size, args.delete_history,
+            rebuild_deck=args.rebuild_deck, **pipeline_options(args),
+        )
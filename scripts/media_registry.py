@@ -0,0 +1,88 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+
+class MediaRegistry:
+    """Media files to package into an Anki deck.
+
+    Files are deduplicated by content, so the same image or PDF is packaged once
+    however many notes reference it. Files created through `staging_path` are
+    owned by the registry and removed by `cleanup`.
+    """
+
+    def __init__(self):
+        self._staging_dir = None
+        self._by_name = {}  # media name -> path on disk
+        self._by_digest = {}  # content digest -> media name
+        self._digest_by_path = {}
+        self._sizes = {}  # media name -> bytes
+
+    def staging_path(self, name):
+        """Path for a new file named `name` that the registry owns and will delete"""
+        if self._staging_dir is None:
+            self._staging_dir = tempfile.mkdtemp(prefix="autoflashcards_media_")
+        return os.path.join(self._staging_dir, name)
+
+    def add(self, path, name=None):
+        """Register a file and return the media name it is packaged under.
+
+        genanki stores media under their base name, so a file whose base name
+        differs from `name` is copied into the staging directory first.
+        """
+        name = name or os.path.basename(path)
+        if self._by_name.get(name) == path:
+            return name
+
+        digest = self._digest_by_path.get(path)
+        if digest is None:
+            digest = self._file_digest(path)
+            self._digest_by_path[path] = digest
+        if digest in self._by_digest:
+            if self._is_owned(path) and self._by_name.get(self._by_digest[digest]) != path:
+                os.remove(path)
+            return self._by_digest[digest]
+
+        if os.path.basename(path) != name:
+            staged = self.staging_path(name)
+            shutil.copyfile(path, staged)
+            if self._is_owned(path):
+                os.remove(path)
+            path = staged
+
+        self._by_name[name] = path
+        self._by_digest[digest] = name
+        self._sizes[name] = os.path.getsize(path)
+        return name
+
+    def paths(self):
+        return list(self._by_name.values())
+
+    def items(self):
+        return list(self._by_name.items())
+
+    @property
+    def total_bytes(self):
+        return sum(self._sizes.values())
+
+    def cleanup(self):
+        """Delete every file the registry owns and forget all registered media"""
+        if self._staging_dir is not None:
+            shutil.rmtree(self._staging_dir, ignore_errors=True)
+            self._staging_dir = None
+        self._by_name.clear()
+        self._by_digest.clear()
+        self._digest_by_path.clear()
+        self._sizes.clear()
+
+    def _is_owned(self, path):
+        return self._staging_dir is not None and os.path.dirname(path) == self._staging_dir
+
+    @staticmethod
+    def _file_digest(path):
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
@@ -1,66 +1,226 @@
 import os
-import sqlite3
-import time
 from inotify_simple import INotify, flags
+from storage import get_storage
+from inode_index import InodeIndex
+from pdf_identity import PDFIdentity
+from anki_connect import AnkiConnectClient, AnkiConnectError
+from anki_update import relink_notes, source_link
 
 DATABASE_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'tracked_files.db')
-TABLE_NAME = 'tracked_files'
+
+# Events watched on each directory that holds a tracked file
+DIRECTORY_EVENTS = flags.MOVED_FROM | flags.MOVED_TO | flags.DELETE | flags.MOVE_SELF | flags.DELETE_SELF
 
 def get_files_to_monitor():
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    cursor.execute(f"SELECT inode, file_path, alias FROM {TABLE_NAME}")
-    files = cursor.fetchall()
-    conn.close()
-    return files
+    return get_storage(DATABASE_PATH).tracked_files()
 
 def update_file_path(inode, new_path):
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    cursor.execute(f"UPDATE {TABLE_NAME} SET file_path = ? WHERE inode = ?", (new_path, inode))
-    conn.commit()
-    conn.close()
-
-def find_new_path(inode, directory):
-    for root, _, files in os.walk(directory):
-        for file in files:
-            path = os.path.join(root, file)
-            if os.stat(path).st_ino == inode:
-                return path
-    return None
+    get_storage(DATABASE_PATH).update_file_path(inode, new_path)
+
+class FileMonitor:
+    """Follows tracked files as they are renamed or moved.
+
+    Watches the directories that hold tracked files and pairs the MOVED_FROM and
+    MOVED_TO events of a rename by their cookie, so most moves resolve with dict
+    lookups. Files that leave the watched directories (or whose directory moves)
+    are found through the persistent inode index instead of walking the tree.
+    """
+
+    def __init__(self, storage, root="/home/", coalesce_ms=200, inotify=None, on_moves=None):
+        self.storage = storage
+        # Called with [(inode, old_path, new_path), ...] after each burst of moves
+        self.on_moves = on_moves
+        self.coalesce_ms = coalesce_ms
+        self.inotify = inotify or INotify()
+        self.index = InodeIndex(storage, root)
+
+        self.tracked = {}  # inode -> path
+        self.by_path = {}  # path -> inode
+        self.dir_watches = {}  # wd -> directory
+        self.watched_dirs = {}  # directory -> wd
+
+        moves = {}
+        stale = []
+        for inode, file_path, alias in storage.tracked_files():
+            self.tracked[inode] = file_path
+            self.by_path[file_path] = inode
+            if self._inode_at(file_path) != inode:
+                stale.append(inode)
+        # Files moved while the monitor was not running
+        if stale:
+            self._resolve_lost(stale, moves)
+            self._record(moves)
+        for file_path in self.tracked.values():
+            self._watch_dir(os.path.dirname(file_path))
+
+    @staticmethod
+    def _inode_at(path):
+        try:
+            return os.lstat(path).st_ino
+        except OSError:
+            return None
+
+    def _watch_dir(self, directory):
+        if directory in self.watched_dirs:
+            return
+        try:
+            wd = self.inotify.add_watch(directory, DIRECTORY_EVENTS)
+        except OSError as e:
+            print(f"Cannot watch {directory}: {e}")
+            return
+        self.dir_watches[wd] = directory
+        self.watched_dirs[directory] = wd
+
+    def _unwatch_dir(self, directory):
+        wd = self.watched_dirs.pop(directory, None)
+        if wd is None:
+            return
+        self.dir_watches.pop(wd, None)
+        try:
+            self.inotify.rm_watch(wd)
+        except OSError:
+            pass  # already removed by the kernel
+
+    def _release_dir(self, directory):
+        """Stop watching `directory` if no tracked file is left in it"""
+        if not any(os.path.dirname(path) == directory for path in self.tracked.values()):
+            self._unwatch_dir(directory)
+
+    def _move(self, inode, new_path):
+        old_path = self.tracked[inode]
+        if self.by_path.get(old_path) == inode:
+            del self.by_path[old_path]
+        self.tracked[inode] = new_path
+        self.by_path[new_path] = inode
+        self._watch_dir(os.path.dirname(new_path))
+        if os.path.dirname(old_path) != os.path.dirname(new_path):
+            self._release_dir(os.path.dirname(old_path))
+
+    def _forget(self, inode):
+        old_path = self.tracked.pop(inode)
+        if self.by_path.get(old_path) == inode:
+            del self.by_path[old_path]
+        self._release_dir(os.path.dirname(old_path))
+        print(f"File {old_path} deleted or moved out of root directory")
+
+    def _resolve_lost(self, inodes, moves):
+        """Find tracked files whose location the events did not tell us"""
+        found = self.index.resolve(inodes)
+        for inode in inodes:
+            if inode not in self.tracked:
+                continue
+            if inode in found:
+                self._move(inode, found[inode])
+                moves[inode] = found[inode]
+            else:
+                moves.pop(inode, None)
+                self._forget(inode)
+
+    def _record(self, moves):
+        if not moves:
+            return
+        self.storage.update_file_paths(moves.items())
+        self.index.record(moves.items())
+
+    def read_events(self, timeout=None):
+        """Block for events, then keep reading until none arrive for `coalesce_ms`"""
+        events = list(self.inotify.read(timeout=timeout))
+        while events:
+            more = self.inotify.read(timeout=self.coalesce_ms)
+            if not more:
+                break
+            events.extend(more)
+        return events
+
+    def handle_events(self, events):
+        """Apply a burst of events and return {inode: new_path} for the files that moved"""
+        old_paths = dict(self.tracked)
+        moves = {}
+        moved_from = {}  # cookie -> inode
+        lost = set()
+
+        for event in events:
+            if event.mask & flags.Q_OVERFLOW:
+                # Events were dropped; every tracked path is suspect
+                lost.update(inode for inode, path in self.tracked.items() if self._inode_at(path) != inode)
+                continue
+            directory = self.dir_watches.get(event.wd)
+            if directory is None:
+                continue
+
+            if event.mask & (flags.MOVE_SELF | flags.DELETE_SELF):
+                # The directory itself moved or went away, so every path under it is stale
+                lost.update(
+                    inode for inode, path in self.tracked.items()
+                    if os.path.dirname(path) == directory
+                )
+                self._unwatch_dir(directory)
+                continue
+
+            path = os.path.join(directory, event.name)
+            if event.mask & flags.MOVED_FROM:
+                inode = self.by_path.get(path)
+                if inode is not None:
+                    moved_from[event.cookie] = inode
+            elif event.mask & flags.MOVED_TO:
+                replaced = self.by_path.get(path)
+                inode = moved_from.pop(event.cookie, None)
+                if replaced is not None and replaced != inode:
+                    lost.add(replaced)
+                if inode is not None:
+                    self._move(inode, path)
+                    moves[inode] = path
+                    lost.discard(inode)
+            elif event.mask & flags.DELETE:
+                inode = self.by_path.get(path)
+                if inode is not None:
+                    lost.add(inode)
+
+        # A MOVED_FROM without its MOVED_TO left the watched directories
+        lost.update(moved_from.values())
+        if lost:
+            self._resolve_lost(lost, moves)
+
+        moves = {inode: path for inode, path in moves.items() if path != old_paths.get(inode)}
+        self._record(moves)
+        for inode, new_path in moves.items():
+            print(f"File {old_paths[inode]} renamed/moved to {new_path}")
+        if moves and self.on_moves is not None:
+            self.on_moves([(inode, old_paths[inode], new_path) for inode, new_path in moves.items()])
+        return moves
+
+    def poll(self, timeout=None):
+        return self.handle_events(self.read_events(timeout))
+
+    def run(self):
+        while True:
+            self.poll()
+
+def anki_relinker(storage, client):
+    """on_moves callback that points the Anki notes of moved PDFs at their new paths"""
+    identity = PDFIdentity(storage)
+
+    def relink(moves):
+        import requests  # already loaded by the AnkiConnect client; kept out of monitor startup
+        links = {}
+        for inode, old_path, new_path in moves:
+            pdf_id = identity.pdf_id(new_path)
+            for highlight in storage.highlights_for_pdf(pdf_id):
+                links[highlight[0]] = source_link(new_path, highlight[2])
+        if not links:
+            return
+        try:
+            updated = relink_notes(client, links)
+            print(f"Updated source links of {updated} Anki note(s)")
+        except (requests.RequestException, AnkiConnectError) as e:
+            print(f"Could not update Anki notes: {e}")
+
+    return relink
 
 def monitor_files(root="/home/"):
-    inotify = INotify()
-    watches = {}
-    inode_to_watch = {}
-
-    def add_watch(file_path, inode):
-        wd = inotify.add_watch(file_path, flags.MOVE_SELF | flags.DELETE_SELF)
-        watches[wd] = (inode, file_path)
-        inode_to_watch[inode] = wd
-
-    files = get_files_to_monitor()
-
-    for inode, file_path, alias in files:
-        add_watch(file_path, inode)
-
-    while True:
-        for event in inotify.read():
-            wd = event.wd
-            inode, old_path = watches.pop(wd, (None, None))
-            if inode is not None:
-                inotify.rm_watch(wd)
-                new_path = find_new_path(inode, root)
-                if new_path:
-                    update_file_path(inode, new_path)
-                    add_watch(new_path, inode)
-                    print(f"File {old_path} renamed/moved to {new_path}")
-                    # Add logic to update Anki notes here
-                else:
-                    print(f"File {old_path} deleted or moved out of root directory")
-                    inode_to_watch.pop(inode, None)
-
-        time.sleep(1)
+    storage = get_storage(DATABASE_PATH)
+    with AnkiConnectClient() as client:
+        FileMonitor(storage, root, on_moves=anki_relinker(storage, client)).run()
 
 if __name__ == '__main__':
     dir_path = os.path.dirname(os.path.realpath(__file__))
@@ -1,48 +1,291 @@
 import fitz  # PyMuPDF
 import hashlib
+import multiprocessing
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from extraction_index import annotation_digest
+from pdf_identity import LEGACY_ID_PAGES, legacy_pdf_id
+from records import Highlight
+from word_map import WordMap, quad_rects
+from profiler import get_profiler
+
+# Parallel scans split the document into about this many shards per worker, so
+# workers that finish early pick up more pages
+SHARDS_PER_WORKER = 4
+MIN_SHARD_PAGES = 25
 
 class PDFHandler:
-    def __init__(self, pdf_path):
+    # Below this many pages, starting worker processes costs more than it saves
+    parallel_scan_min_pages = 500
+
+    def __init__(self, pdf_path, page_cache_size=16, index=None, scan_workers=1, pdf_id=None, identity=None):
         self.pdf_path = pdf_path
-        self.doc = fitz.open(pdf_path)
-        self.pdf_id = self._generate_pdf_id()
+        # Worker processes used to scan large documents for highlights
+        self.scan_workers = scan_workers
+        # Optional ExtractionIndex; when this file version was seen before, the
+        # document is not even opened unless page text is requested
+        self.index = index
+        self._doc = None
+        # Contexts read page text from worker threads while the scan goes on;
+        # PyMuPDF documents must not be used from several threads at once
+        self._lock = threading.RLock()
+
+        # LRU cache of extracted page text, shared by ID generation and context building
+        self.page_cache_size = page_cache_size
+        self._page_text_cache = OrderedDict()
+        self._page_blocks_cache = OrderedDict()
+        self.page_cache_hits = 0
+        self.page_cache_misses = 0
+
+        with get_profiler().span("pdf_id", pdf_path=pdf_path):
+            self.pdf_id = index.lookup_pdf_id(pdf_path) if index is not None else None
+            self.unchanged = self.pdf_id is not None
+            if self.pdf_id is None:
+                # Optional PDFIdentity, which fingerprints the file instead of reading its text
+                if pdf_id is None and identity is not None:
+                    pdf_id = identity.pdf_id(pdf_path, doc=self.doc)
+                self.pdf_id = pdf_id or self._generate_pdf_id()
+
+    @property
+    def doc(self):
+        with self._lock:
+            if self._doc is None:
+                with get_profiler().span("pdf_open", pdf_path=self.pdf_path):
+                    self._doc = fitz.open(self.pdf_path)
+            return self._doc
+
+    def close(self):
+        with self._lock:
+            if self._doc is not None:
+                self._doc.close()
+                self._doc = None
 
     def _generate_pdf_id(self):
         # Generate a unique ID for the PDF based on the content of the first few pages
-        content = ""
-        for page_num in range(min(5, len(self.doc))):  # Use the first 5 pages for ID generation
-            page = self.doc.load_page(page_num)
-            content += page.get_text()
+        content = self.get_text_by_pages(0, min(LEGACY_ID_PAGES, len(self.doc)) - 1)
 
-        return hashlib.md5(content.encode('utf-8')).hexdigest()
+        return legacy_pdf_id(content)
 
     def extract_highlights(self):
+        return list(self.iter_highlights())
+
+    def iter_highlights(self):
+        """Yield highlights page by page, in page order, as the document is scanned.
+
+        With an index, only pages whose annotations changed since the last run are
+        re-scanned, and the index is updated once the whole document has been scanned.
+        """
+        stored = self.index.get_pages(self.pdf_id) if self.index is not None else {}
+        if self.unchanged:
+            for page_num in sorted(stored):
+                for record in stored[page_num][1]:
+                    yield self._highlight_from_record(record)
+            return
+
+        previous = stored
+        if self.index is not None:
+            previous = {**self.index.get_legacy_pages(self.pdf_id, exclude=stored), **stored}
+
+        changed = {}
+        annotated_pages = set()
+        for page_num, digest, records, is_changed in self._iter_scanned_pages(previous):
+            annotated_pages.add(page_num)
+            if is_changed:
+                changed[page_num] = (digest, records)
+            for record in records:
+                yield self._highlight_from_record(record)
+
+        if self.index is not None:
+            removed = [page_num for page_num in stored if page_num not in annotated_pages]
+            self.index.update(self.pdf_path, self.pdf_id, changed, removed)
+
+    def _iter_scanned_pages(self, stored):
+        page_count = len(self.doc)
+        if self.scan_workers > 1 and page_count >= self.parallel_scan_min_pages:
+            yield from self._scan_parallel(page_count, stored)
+        else:
+            yield from self._scan_pages(range(page_count), stored)
+
+    def _scan_pages(self, page_nums, stored):
+        """Yield (page_num, digest, records, changed) for every annotated page in page_nums.
+
+        `stored` maps page_num to the (digest, records) of the previous scan; a None
+        digest holds known records of a page that was never indexed.
+        """
+        profiler = get_profiler()
+        for page_num in page_nums:
+            # Results are yielded outside the lock, so context threads can read page
+            # text while the consumer holds this generator suspended
+            with self._lock, profiler.span("annotation_scan", page=page_num) as span:
+                scanned = self._scan_page(page_num, stored.get(page_num))
+                if scanned is not None:
+                    span["highlights"] = len(scanned[1])
+            if scanned is not None:
+                yield (page_num,) + scanned
+
+    def _scan_page(self, page_num, previous):
+        """(digest, records, changed) of an annotated page, or None when it has no highlights"""
+        page = self.doc.load_page(page_num)
+        annots = self._highlight_annots(page)
+        if not annots:
+            return None
+
+        digest = annotation_digest(self._annotation_key(annot) for annot in annots)
+        if previous is not None and previous[0] == digest:
+            return digest, previous[1], False
+
+        # Annotations that were already on the page keep their stored
+        # records (and highlight IDs); only the new ones are extracted
+        known = {
+            self._rect_key(record["rect"]): record
+            for record in (previous[1] if previous is not None else [])
+        }
+        new_annots = [
+            annot for annot in annots
+            if self._rect_key(annot.rect) not in known
+        ]
+        extracted = {
+            self._rect_key(highlight.rect): self._highlight_to_record(highlight)
+            for highlight in self._extract_page_highlights(page, new_annots)
+        }
+        records = [
+            known.get(self._rect_key(annot.rect)) or extracted[self._rect_key(annot.rect)]
+            for annot in annots
+        ]
+        return digest, records, True
+
+    def _scan_parallel(self, page_count, stored):
+        """Scan page shards in worker processes, yielding their pages in page order"""
+        shard_size = max(-(-page_count // (self.scan_workers * SHARDS_PER_WORKER)), MIN_SHARD_PAGES)
+        # spawn rather than fork: the pipeline runs LLM threads while a book is scanned
+        executor = ProcessPoolExecutor(
+            max_workers=self.scan_workers, mp_context=multiprocessing.get_context("spawn")
+        )
+        profiler = get_profiler()
+        try:
+            futures = []
+            for start in range(0, page_count, shard_size):
+                end = min(start + shard_size, page_count)
+                future = executor.submit(
+                    _scan_shard, self.pdf_path, self.pdf_id, start, end,
+                    {page_num: stored[page_num] for page_num in range(start, end) if page_num in stored},
+                )
+                if profiler.enabled:
+                    # Workers have their own (disabled) profiler; time each shard from here
+                    submitted = time.perf_counter()
+                    future.add_done_callback(
+                        lambda f, submitted=submitted, start=start, end=end: profiler.record(
+                            "annotation_scan", submitted, time.perf_counter() - submitted,
+                            pages=end - start, shard=f"{start}-{end}",
+                        )
+                    )
+                futures.append(future)
+            for future in futures:
+                yield from future.result()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _highlight_annots(self, page):
+        return [annot for annot in page.annots() if annot.type[0] == 8]  # Highlight
+
+    def _annotation_key(self, annot):
+        rect = annot.rect
+        return f"{annot.type[0]}:{rect.x0:.4f}_{rect.y0:.4f}_{rect.x1:.4f}_{rect.y1:.4f}:{annot.vertices}"
+
+    @staticmethod
+    def _rect_key(rect):
+        return tuple(round(v, 4) for v in rect)
+
+    def _extract_page_highlights(self, page, annots):
+        # One word extraction per page; each highlight reads the words under its
+        # quads, so multi-line highlights don't pick up the rest of their bounding rect
+        word_map = WordMap.from_page(page) if annots else None
         highlights = []
-        for page_num in range(len(self.doc)):
-            page = self.doc.load_page(page_num)
-            for annot in page.annots():
-                if annot.type[0] == 8:  # Highlight
-                    rect = annot.rect
-                    highlighted_text = page.get_textbox(rect).strip()
-                    highlight_id = self._generate_highlight_id(page_num, rect, highlighted_text)
-                    highlight_info = {
-                        "highlight_id": highlight_id,
-                        "text": highlighted_text,
-                        "page": page_num + 1,  # Page numbers usually start from 1
-                        "pdf_id": self.pdf_id,
-                        "rect": rect,  # Store the rectangle coordinates
-                    }
-                    highlights.append(highlight_info)
+        for annot in annots:
+            rect = annot.rect
+            highlighted_text = word_map.text_in(quad_rects(annot)).strip()
+            highlight_id = self._generate_highlight_id(page.number, rect, highlighted_text)
+            highlights.append(Highlight(
+                highlight_id=highlight_id,
+                text=highlighted_text,
+                page=page.number + 1,  # Page numbers usually start from 1
+                pdf_id=self.pdf_id,
+                rect=(rect.x0, rect.y0, rect.x1, rect.y1),
+            ))
         return highlights
 
+    def _highlight_to_record(self, highlight):
+        return {
+            "highlight_id": highlight.highlight_id,
+            "text": highlight.text,
+            "page": highlight.page,
+            "rect": list(highlight.rect),
+        }
+
+    def _highlight_from_record(self, record):
+        return Highlight(
+            highlight_id=record["highlight_id"],
+            text=record["text"],
+            page=record["page"],
+            pdf_id=self.pdf_id,
+            rect=tuple(record["rect"]),
+        )
+
     def _generate_highlight_id(self, page_num, rect, highlighted_text):
         # Normalize the rectangle coordinates to avoid floating point inconsistencies
         rect_str = f"{rect.x0:.4f}_{rect.y0:.4f}_{rect.x1:.4f}_{rect.y1:.4f}"
         unique_string = f"{self.pdf_id}_{page_num}_{rect_str}_{highlighted_text}"
         return hashlib.md5(unique_string.encode('utf-8')).hexdigest()
 
+    def get_page_text(self, page_num):
+        with self._lock:
+            text = self._page_text_cache.get(page_num)
+            if text is not None:
+                self._page_text_cache.move_to_end(page_num)
+                self.page_cache_hits += 1
+                return text
+
+            self.page_cache_misses += 1
+            text = self.doc.load_page(page_num).get_text()
+            if self.page_cache_size > 0:
+                self._page_text_cache[page_num] = text
+                if len(self._page_text_cache) > self.page_cache_size:
+                    self._page_text_cache.popitem(last=False)
+            return text
+
+    def get_page_blocks(self, page_num):
+        """Text blocks of a page as (x0, y0, x1, y1, text) tuples, in PyMuPDF's reading order"""
+        with self._lock:
+            blocks = self._page_blocks_cache.get(page_num)
+            if blocks is not None:
+                self._page_blocks_cache.move_to_end(page_num)
+                return blocks
+
+            blocks = [
+                block[:5]
+                for block in self.doc.load_page(page_num).get_text("blocks")
+                if block[6] == 0  # text, not image
+            ]
+            if self.page_cache_size > 0:
+                self._page_blocks_cache[page_num] = blocks
+                if len(self._page_blocks_cache) > self.page_cache_size:
+                    self._page_blocks_cache.popitem(last=False)
+            return blocks
+
+    def get_blocks_text(self, block_refs):
+        """Join the text of (page_num, block_index) refs"""
+        return "".join(self.get_page_blocks(page_num)[index][4] for page_num, index in block_refs)
+
     def get_text_by_pages(self, start_page, end_page):
-        text = ""
-        for page_num in range(start_page, end_page + 1):
-            text += self.doc.load_page(page_num).get_text()
-        return text
+        return "".join(self.get_page_text(page_num) for page_num in range(start_page, end_page + 1))
+
+
+def _scan_shard(pdf_path, pdf_id, start, end, stored):
+    """Scan pages [start, end) in a worker process with its own document"""
+    pdf_handler = PDFHandler(pdf_path, page_cache_size=0, pdf_id=pdf_id)
+    try:
+        return list(pdf_handler._scan_pages(range(start, end), stored))
+    finally:
+        pdf_handler.close()
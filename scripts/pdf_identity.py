@@ -0,0 +1,145 @@
+import hashlib
+import os
+import re
+from extraction_index import FILE_INDEX_TABLE, file_signature
+
+PDF_FINGERPRINTS_TABLE = "pdf_fingerprints"
+LEGACY_PDF_IDS_TABLE = "legacy_pdf_ids"
+
+# Bytes hashed from the start of files without a trailer /ID. Incremental saves,
+# which is how highlights are usually added, only append to the file.
+SAMPLE_BYTES = 64 * 1024
+# Pages whose text made up the original pdf_id
+LEGACY_ID_PAGES = 5
+
+_FIRST_ID = re.compile(r"\[\s*(<[0-9A-Fa-f\s]*>|\((?:[^()\\]|\\.)*\))")
+
+
+def legacy_pdf_id(text):
+    """The original pdf_id: MD5 of the text of the first five pages"""
+    return hashlib.md5(text.encode('utf-8')).hexdigest()
+
+
+def trailer_fingerprint(doc):
+    """Fingerprint from the permanent half of the trailer /ID and the metadata, or None.
+
+    The first /ID string is set when a PDF is created and kept by later saves,
+    including the ones that add annotations.
+    """
+    kind, value = doc.xref_get_key(-1, "ID")
+    match = _FIRST_ID.match(value) if kind == "array" else None
+    if match is None or not match.group(1).strip("<>()0 "):
+        return None
+    metadata = doc.metadata or {}
+    parts = [match.group(1)] + [metadata.get(key) or "" for key in ("title", "author", "creationDate")]
+    return "id:" + hashlib.md5("\x00".join(parts).encode('utf-8')).hexdigest()
+
+
+def sampled_fingerprint(pdf_path):
+    """Fingerprint from the first bytes of the file, or None when it cannot be read"""
+    try:
+        with open(pdf_path, "rb") as f:
+            sample = f.read(SAMPLE_BYTES)
+    except OSError:
+        return None
+    if not sample:
+        return None
+    return "bytes:" + hashlib.md5(sample).hexdigest()
+
+
+def text_fingerprint(doc):
+    text = "".join(doc.load_page(page_num).get_text() for page_num in range(min(LEGACY_ID_PAGES, len(doc))))
+    return "text:" + legacy_pdf_id(text)
+
+
+class PDFIdentity:
+    """Resolves the pdf_id of a file without reading its text.
+
+    The fingerprint comes from the trailer /ID and metadata, else a hash of the
+    first bytes, else the text of the first pages. Each fingerprint maps to a
+    pdf_id, and the pdf_id of each file version is memoized by (inode, size, mtime)
+    in the ExtractionIndex's file_index table, as a version not scanned yet, so
+    repeat lookups are one stat and one query.
+
+    A fingerprint not seen before first takes the pdf_id of an earlier version of
+    the same file, so saving highlights never changes it. PDFs known from before
+    fingerprints keep their text-hash pdf_id (which their highlight IDs are
+    derived from): a new fingerprint is checked against those legacy ids once
+    and then mapped to the one it matches.
+    """
+
+    def __init__(self, storage):
+        # Tables are created by the storage migrations
+        self.storage = storage
+        self.fingerprints_computed = 0
+
+    def pdf_id(self, pdf_path, doc=None):
+        signature = file_signature(pdf_path)
+        rows = self.storage.query(
+            f"SELECT pdf_id FROM {FILE_INDEX_TABLE} WHERE inode = ? AND size = ? AND mtime_ns = ?",
+            signature,
+        )
+        if rows:
+            return rows[0][0]
+
+        opened = doc is None
+        if opened:
+            import fitz  # PyMuPDF, only needed for file versions not seen before
+            doc = fitz.open(pdf_path)
+        try:
+            fingerprint = self.fingerprint(pdf_path, doc)
+            rows = self.storage.query(
+                f"SELECT pdf_id FROM {PDF_FINGERPRINTS_TABLE} WHERE fingerprint = ?", (fingerprint,)
+            )
+            if rows:
+                pdf_id = rows[0][0]
+            else:
+                pdf_id = (
+                    self._previous_version_pdf_id(pdf_path, signature[0])
+                    or self._legacy_pdf_id(doc)
+                    or hashlib.md5(fingerprint.encode('utf-8')).hexdigest()
+                )
+        finally:
+            if opened:
+                doc.close()
+
+        inode, size, mtime_ns = signature
+        with self.storage.transaction() as conn:
+            conn.execute(
+                f"INSERT OR IGNORE INTO {PDF_FINGERPRINTS_TABLE} (fingerprint, pdf_id) VALUES (?, ?)",
+                (fingerprint, pdf_id),
+            )
+            # Older versions of the same file are no longer reachable
+            conn.execute(f"DELETE FROM {FILE_INDEX_TABLE} WHERE inode = ?", (inode,))
+            # Marked scanned by ExtractionIndex.update once its highlights are extracted
+            conn.execute(
+                f"INSERT INTO {FILE_INDEX_TABLE} (inode, size, mtime_ns, file_path, pdf_id, scanned) "
+                "VALUES (?, ?, ?, ?, ?, 0)",
+                (inode, size, mtime_ns, os.path.abspath(pdf_path), pdf_id),
+            )
+        return pdf_id
+
+    def fingerprint(self, pdf_path, doc):
+        self.fingerprints_computed += 1
+        return trailer_fingerprint(doc) or sampled_fingerprint(pdf_path) or text_fingerprint(doc)
+
+    def _previous_version_pdf_id(self, pdf_path, inode):
+        """The pdf_id of an earlier version of this file, found by inode or path, or None.
+
+        Saving a highlight can change the fingerprint: it may add a trailer /ID
+        to a file without one, or rewrite the bytes sampled from a small file.
+        """
+        rows = self.storage.query(
+            f"SELECT pdf_id FROM {FILE_INDEX_TABLE} WHERE inode = ? OR file_path = ? "
+            "ORDER BY inode = ? DESC LIMIT 1",
+            (inode, os.path.abspath(pdf_path), inode),
+        )
+        return rows[0][0] if rows else None
+
+    def _legacy_pdf_id(self, doc):
+        """The text-hash pdf_id of this document if the database has data recorded under it"""
+        if not self.storage.query(f"SELECT 1 FROM {LEGACY_PDF_IDS_TABLE} LIMIT 1"):
+            return None
+        pdf_id = text_fingerprint(doc)[len("text:"):]
+        rows = self.storage.query(f"SELECT 1 FROM {LEGACY_PDF_IDS_TABLE} WHERE pdf_id = ?", (pdf_id,))
+        return pdf_id if rows else None
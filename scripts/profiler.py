@@ -0,0 +1,151 @@
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Stages in pipeline order, for the summary table
+STAGES = [
+    "pdf_open", "pdf_id", "annotation_scan", "context_build", "image_render",
+    "llm_call", "parse", "db", "packaging",
+]
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a sorted list"""
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(q / 100 * len(values)) - 1)]
+
+
+class _NullSpan:
+    """Span of a disabled profiler: accepts and drops its arguments"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def __setitem__(self, key, value):
+        pass
+
+    def update(self, *args, **kwargs):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class NullProfiler:
+    """The default: every call is a no-op, so instrumented code costs a method call"""
+    enabled = False
+
+    def span(self, stage, **args):
+        return _NULL_SPAN
+
+    def record(self, stage, start, duration, **args):
+        pass
+
+
+class Profiler:
+    """Records wall time and counters of each pipeline stage.
+
+    `with profiler.span("llm_call", highlight_ids=...) as span:` times a block;
+    values set on `span` while it runs (e.g. response tokens) are kept with it.
+    Events can be summarized into a p50/p95 table or written as a Chrome trace
+    (chrome://tracing, Perfetto) that keeps the highlight ids of each event.
+    """
+    enabled = True
+
+    def __init__(self):
+        self.events = []  # (stage, start, duration, thread_id, args)
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, stage, **args):
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            self.record(stage, start, time.perf_counter() - start, **args)
+
+    def record(self, stage, start, duration, **args):
+        """Add an event that started at perf_counter() time `start`"""
+        with self._lock:
+            self.events.append((stage, start - self._origin, duration, threading.get_ident(), args))
+
+    def summary(self):
+        """{stage: {"count", "total", "p50", "p95", "max", <summed numeric args>}}, times in seconds"""
+        by_stage = {}
+        for stage, _, duration, _, args in self.events:
+            entry = by_stage.setdefault(stage, {"durations": [], "totals": {}})
+            entry["durations"].append(duration)
+            for key, value in args.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool) and key != "page":
+                    entry["totals"][key] = entry["totals"].get(key, 0) + value
+
+        summary = {}
+        for stage in sorted(by_stage, key=lambda s: (STAGES.index(s) if s in STAGES else len(STAGES), s)):
+            durations = sorted(by_stage[stage]["durations"])
+            summary[stage] = {
+                "count": len(durations),
+                "total": sum(durations),
+                "p50": percentile(durations, 50),
+                "p95": percentile(durations, 95),
+                "max": durations[-1],
+                **by_stage[stage]["totals"],
+            }
+        return summary
+
+    def print_table(self):
+        header = f"{'Stage':<16} {'Count':>7} {'Total s':>9} {'p50 ms':>9} {'p95 ms':>9} {'Max ms':>9}  Counters"
+        print()
+        print(header)
+        print("-" * len(header))
+        for stage, entry in self.summary().items():
+            counters = ", ".join(
+                f"{key}={value:g}" for key, value in entry.items()
+                if key not in ("count", "total", "p50", "p95", "max")
+            )
+            print(f"{stage:<16} {entry['count']:>7} {entry['total']:>9.2f} {entry['p50'] * 1000:>9.1f} "
+                  f"{entry['p95'] * 1000:>9.1f} {entry['max'] * 1000:>9.1f}  {counters}")
+
+    def write_trace(self, path):
+        """Write the events in Chrome trace event format"""
+        pid = os.getpid()
+        trace = {
+            "traceEvents": [
+                {
+                    "name": stage,
+                    "cat": "pipeline",
+                    "ph": "X",
+                    "ts": round(start * 1e6, 1),
+                    "dur": round(duration * 1e6, 1),
+                    "pid": pid,
+                    "tid": thread_id,
+                    "args": args,
+                }
+                for stage, start, duration, thread_id, args in self.events
+            ],
+            "displayTimeUnit": "ms",
+        }
+        with open(path, "w") as f:
+            json.dump(trace, f, default=str)
+
+
+_current = NullProfiler()
+
+
+def get_profiler():
+    """The process-wide profiler; a NullProfiler unless profiling was enabled"""
+    return _current
+
+
+def enable_profiling():
+    global _current
+    if not _current.enabled:
+        _current = Profiler()
+    return _current
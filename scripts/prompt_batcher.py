@@ -0,0 +1,98 @@
+from typing import Callable, Dict, List
+from records import Context
+
+# Rough size of the instructions that wrap every prompt, in tokens
+PROMPT_OVERHEAD_TOKENS = 450
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token) used for prompt budgeting"""
+    return len(text) // 4 + 1
+
+
+class PromptBatch:
+    """A group of highlights from one PDF that share a single prompt"""
+
+    def __init__(self, contexts: List[Context], start_page: int, end_page: int, context_text: str):
+        self.contexts = contexts
+        self.start_page = start_page
+        self.end_page = end_page
+        self.context = context_text
+
+    def tags(self) -> Dict[str, Context]:
+        return {f"H{i + 1}": context for i, context in enumerate(self.contexts)}
+
+
+def build_prompt_batches(
+    contexts: List[Context],
+    page_text: Callable[[int], str],
+    max_tokens: int,
+    max_highlights: int = 10,
+) -> List[PromptBatch]:
+    """Pack contexts with overlapping page windows into prompts that fit in `max_tokens`.
+
+    Every page (or, for contexts trimmed to text blocks, every block) of the merged
+    window is included once, so highlights that share text also share their context
+    tokens. A context that does not fit on its own still gets a batch of its own.
+    """
+    segment_tokens = {}
+    segment_text = {}
+
+    def segments(context):
+        """Keys of the text a context covers: (page, block index), or (page, -1) for a whole page"""
+        if context.blocks is not None:
+            keys = context.blocks
+            for key in keys:
+                if key not in segment_text:
+                    segment_text[key] = context.pages.get_blocks_text([key])
+        else:
+            keys = [(page_num, -1) for page_num in range(context.start_page, context.end_page + 1)]
+            for key in keys:
+                if key not in segment_text:
+                    segment_text[key] = page_text(key[0])
+        for key in keys:
+            if key not in segment_tokens:
+                segment_tokens[key] = estimate_tokens(segment_text[key])
+        return keys
+
+    def window_tokens(keys):
+        return sum(segment_tokens[key] for key in keys)
+
+    ordered = sorted(contexts, key=lambda c: (c.pdf_id, c.start_page, c.end_page))
+
+    groups = []
+    current, keys, end, highlight_tokens = [], set(), None, 0
+    for context in ordered:
+        context_keys = segments(context)
+        if current:
+            overlaps = (
+                context.pdf_id == current[0].pdf_id
+                and context.start_page <= end + 1
+            )
+            new_keys = keys.union(context_keys)
+            new_tokens = (
+                PROMPT_OVERHEAD_TOKENS
+                + window_tokens(new_keys)
+                + highlight_tokens
+                + estimate_tokens(context.text)
+            )
+            if overlaps and len(current) < max_highlights and new_tokens <= max_tokens:
+                current.append(context)
+                keys = new_keys
+                end = max(end, context.end_page)
+                highlight_tokens += estimate_tokens(context.text)
+                continue
+            groups.append((current, keys))
+
+        current = [context]
+        keys, end = set(context_keys), context.end_page
+        highlight_tokens = estimate_tokens(context.text)
+
+    if current:
+        groups.append((current, keys))
+
+    batches = []
+    for group, keys in groups:
+        keys = sorted(keys)
+        batches.append(PromptBatch(group, keys[0][0], keys[-1][0], "".join(segment_text[key] for key in keys)))
+    return batches
@@ -0,0 +1,39 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """Thread-safe token bucket used to pace requests to an LLM provider."""
+
+    def __init__(self, rate: float, capacity: float = None):
+        # rate is expressed in tokens per second; a falsy rate disables limiting
+        self.rate = rate
+        # capacity bounds the burst size; the default of one token paces requests evenly
+        self.capacity = capacity if capacity is not None else 1.0
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def per_minute(cls, requests_per_minute: float, capacity: float = None):
+        if not requests_per_minute:
+            return cls(0, capacity)
+        return cls(requests_per_minute / 60.0, capacity)
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        """Block until `tokens` are available and return the time spent waiting"""
+        if not self.rate:
+            return 0.0
+
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return waited
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
@@ -0,0 +1,108 @@
+from dataclasses import dataclass
+from typing import Optional, Protocol, Tuple
+
+# (x0, y0, x1, y1) in PDF points
+RectTuple = Tuple[float, float, float, float]
+
+
+def rect_str(rect: RectTuple) -> str:
+    """Text form stored in the highlights table, the same as str(fitz.Rect)"""
+    return "Rect" + str(tuple(float(v) for v in rect))
+
+
+def parse_rect(text: str) -> RectTuple:
+    """Inverse of rect_str"""
+    return tuple(float(v) for v in text[text.index("(") + 1:text.rindex(")")].split(","))
+
+
+# (page_num, block_index) of a text block, both 0-based
+BlockRef = Tuple[int, int]
+
+
+class PageTextStore(Protocol):
+    """Shared source of page text, e.g. a PDFHandler and its page cache"""
+
+    def get_text_by_pages(self, start_page: int, end_page: int) -> str:
+        ...
+
+    def get_blocks_text(self, block_refs: Tuple[BlockRef, ...]) -> str:
+        ...
+
+
+@dataclass(slots=True)
+class Highlight:
+    highlight_id: str
+    text: str
+    page: int  # 1-based
+    pdf_id: str
+    rect: RectTuple
+
+
+@dataclass(slots=True)
+class Context:
+    """A highlight and the text around it.
+
+    Holds a page range, or the text blocks picked within it, into the shared
+    page-text store rather than its own copy of the text; `context` joins the
+    text when a prompt is built.
+    """
+    highlight: Highlight
+    start_page: int  # 0-based, inclusive
+    end_page: int
+    pages: PageTextStore
+    pdf_path: str
+    # Set when the context was trimmed to a token budget
+    blocks: Optional[Tuple[BlockRef, ...]] = None
+    tokens_saved: int = 0
+
+    @property
+    def context(self) -> str:
+        if self.blocks is not None:
+            return self.pages.get_blocks_text(self.blocks)
+        return self.pages.get_text_by_pages(self.start_page, self.end_page)
+
+    @property
+    def highlight_id(self) -> str:
+        return self.highlight.highlight_id
+
+    @property
+    def text(self) -> str:
+        return self.highlight.text
+
+    @property
+    def page(self) -> int:
+        return self.highlight.page
+
+    @property
+    def pdf_id(self) -> str:
+        return self.highlight.pdf_id
+
+    @property
+    def rect(self) -> RectTuple:
+        return self.highlight.rect
+
+
+@dataclass(slots=True)
+class Flashcard:
+    """A question/answer pair referencing the highlight it was generated from"""
+    question: str
+    answer: str
+    highlight: Highlight
+    pdf_path: str = ""
+    context_image: str = ""
+
+    @property
+    def highlight_id(self) -> str:
+        return self.highlight.highlight_id
+
+    @property
+    def page(self) -> int:
+        return self.highlight.page
+
+    @property
+    def pdf_id(self) -> str:
+        return self.highlight.pdf_id
+
+    @property
+    def rect(self) -> RectTuple:
+        return self.highlight.rect
@@ -0,0 +1,115 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+class ResponseCache:
+    """Content-addressed on-disk cache of LLM responses.
+
+    Entries are keyed by a hash of (provider, model, language, prompt) and stored one
+    file per entry. A hit refreshes the file's mtime, so evicting the oldest mtimes
+    first gives LRU order once the cache grows past `max_bytes`. Entries older than
+    `ttl` seconds are treated as misses and removed.
+    """
+
+    def __init__(self, cache_dir, max_bytes=200 * 1024 * 1024, ttl=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._sizes = {
+            entry.path: entry.stat().st_size
+            for entry in os.scandir(cache_dir)
+            if entry.is_file() and entry.name.endswith(".json")
+        }
+        self.total_bytes = sum(self._sizes.values())
+
+    @staticmethod
+    def make_key(provider, model, language, prompt):
+        payload = json.dumps([provider, model, language, prompt], ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        if self.ttl is not None and time.time() - entry["created"] > self.ttl:
+            with self._lock:
+                self.misses += 1
+                self._remove(path)
+            return None
+
+        with self._lock:
+            self.hits += 1
+        try:
+            os.utime(path)  # mark as recently used
+        except OSError:
+            pass
+        return entry["response"]
+
+    def put(self, key, response):
+        data = json.dumps({"created": time.time(), "response": response}, ensure_ascii=False).encode('utf-8')
+        path = self._path(key)
+
+        # Write to a temp file first so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self.total_bytes += len(data) - self._sizes.get(path, 0)
+            self._sizes[path] = len(data)
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+
+    def discard(self, key):
+        """Remove an entry, e.g. a response that turned out to be unusable"""
+        with self._lock:
+            self._remove(self._path(key))
+
+    def _evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes"""
+        def last_used(path):
+            try:
+                return os.stat(path).st_mtime
+            except OSError:
+                return 0
+
+        for path in sorted(self._sizes, key=last_used):
+            if self.total_bytes <= self.max_bytes:
+                break
+            self._remove(path)
+            self.evictions += 1
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        self.total_bytes -= self._sizes.pop(path, 0)
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._sizes),
+            "bytes": self.total_bytes,
+        }
@@ -0,0 +1,231 @@
+import logging
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+# How a failed provider call is handled
+RETRYABLE = "retryable"  # transient: network errors, timeouts, 5xx, overloaded
+RATE_LIMITED = "rate_limited"  # 429: wait for the provider's retry-after, then retry
+FATAL = "fatal"  # retrying cannot help: bad request, refused content, bad key or model
+
+RETRYABLE_STATUS = {408, 409, 425, 500, 502, 503, 504, 529}
+# Errors that mean every later request will fail too, e.g. an invalid API key or model
+PROVIDER_DEAD_STATUS = {401, 403, 404}
+
+# Exception class names of the provider SDKs, for errors that carry no status code
+ERROR_NAMES = {
+    "RateLimitError": RATE_LIMITED,
+    "ResourceExhausted": RATE_LIMITED,
+    "TooManyRequests": RATE_LIMITED,
+    "APIConnectionError": RETRYABLE,
+    "APITimeoutError": RETRYABLE,
+    "InternalServerError": RETRYABLE,
+    "ServiceUnavailable": RETRYABLE,
+    "DeadlineExceeded": RETRYABLE,
+    "AuthenticationError": FATAL,
+    "PermissionDeniedError": FATAL,
+    "PermissionDenied": FATAL,
+    "Unauthenticated": FATAL,
+    "NotFoundError": FATAL,
+    "NotFound": FATAL,
+    "BadRequestError": FATAL,
+    "InvalidArgument": FATAL,
+    "UnprocessableEntityError": FATAL,
+}
+
+
+class ProviderUnavailableError(Exception):
+    """The circuit breaker is open: the provider keeps failing, so calls are not attempted"""
+
+
+def status_code(error):
+    """HTTP status of a provider SDK error, or None"""
+    for attr in ("status_code", "status", "code"):
+        value = getattr(error, attr, None)
+        if isinstance(value, int) and 100 <= value < 600:
+            return value
+    response = getattr(error, "response", None)
+    value = getattr(response, "status_code", None)
+    return value if isinstance(value, int) else None
+
+
+def retry_after(error):
+    """Seconds the provider asked us to wait, from the retry-after headers, or None"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        value = headers.get("retry-after-ms")
+        if value is not None:
+            return float(value) / 1000
+        value = headers.get("retry-after")
+        if value is None:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def classify_error(error):
+    """RETRYABLE, RATE_LIMITED or FATAL for an exception raised by a provider"""
+    status = status_code(error)
+    if status == 429:
+        return RATE_LIMITED
+    if status in RETRYABLE_STATUS:
+        return RETRYABLE
+    if status is not None and 400 <= status < 500:
+        return FATAL
+    for cls in type(error).__mro__:
+        if cls.__name__ in ERROR_NAMES:
+            return ERROR_NAMES[cls.__name__]
+    if status is not None and status >= 500:
+        return RETRYABLE
+    if isinstance(error, OSError):  # connection resets, timeouts, requests' network errors
+        return RETRYABLE
+    return FATAL
+
+
+def is_provider_dead(error):
+    """Whether the error means no later request can succeed either"""
+    if status_code(error) in PROVIDER_DEAD_STATUS:
+        return True
+    names = {cls.__name__ for cls in type(error).__mro__}
+    return bool(names & {"AuthenticationError", "PermissionDeniedError", "PermissionDenied", "Unauthenticated", "NotFoundError"})
+
+
+class CircuitBreaker:
+    """Shared by every in-flight request to one provider.
+
+    Opens after `failure_threshold` requests in a row have failed with provider
+    errors (each after its own retries), or at once on an error such as an
+    invalid API key. Errors about a request itself, such as a 400, only fail
+    that request and do not count. While it is open, calls fail immediately with
+    ProviderUnavailableError instead of waiting out their retries. After
+    `cooldown` seconds one trial call is let through; a breaker opened by a
+    dead-provider error stays open.
+    """
+
+    def __init__(self, failure_threshold=5, cooldown=60.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.reason = None
+        self._opened_at = None
+        self._permanent = False
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self._opened_at is not None
+
+    def before_call(self):
+        """Raise ProviderUnavailableError unless a call may go ahead"""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            cooled = time.monotonic() - self._opened_at >= self.cooldown
+            if self._permanent or not cooled or self._trial_running:
+                raise ProviderUnavailableError(f"LLM provider unavailable: {self.reason}")
+            self._trial_running = True  # half-open: this call decides
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_request_error(self):
+        """The provider refused one request, e.g. with a 400: it is up, so a half-open trial closes the breaker"""
+        with self._lock:
+            if self._trial_running:
+                self.failures = 0
+                self._opened_at = None
+                self._trial_running = False
+
+    def record_failure(self, error, permanent=False):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if permanent or self.failures >= self.failure_threshold or self._opened_at is not None:
+                if self._opened_at is None or permanent:
+                    logging.error(f"Circuit breaker opened after {self.failures} failure(s): {error}")
+                self._opened_at = time.monotonic()
+                self._permanent = self._permanent or permanent
+                self.reason = f"{type(error).__name__}: {error}"
+
+
+class RetryPolicy:
+    """Calls the provider, retrying only the errors that retrying can fix.
+
+    Transient errors back off exponentially with jitter. Rate-limit errors wait
+    for the provider's retry-after (or the backoff when there is none), and the
+    pause is shared, so other in-flight requests hold off too. Fatal errors are
+    raised at once. Time spent in backoff is added to `stats["retry_seconds"]`.
+    """
+
+    def __init__(self, max_attempts=6, base_delay=1.0, max_delay=30.0,
+                 breaker=None, sleep=time.sleep):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker or CircuitBreaker()
+        self.sleep = sleep
+        self._resume_at = 0.0
+        self._lock = threading.Lock()
+
+    def backoff(self, attempt):
+        """Delay before retry number `attempt` (1-based): exponential with full jitter"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def call(self, fn, count=None):
+        """Return fn(), retrying per the policy. `count(key, n)` receives the retry stats."""
+        attempt = 0
+        while True:
+            self._wait_for_pause(count)
+            self.breaker.before_call()
+            try:
+                result = fn()
+            except Exception as e:
+                attempt += 1
+                kind = classify_error(e)
+                if kind == FATAL and not is_provider_dead(e):
+                    # About this request only, e.g. a bad request or refused content
+                    self.breaker.record_request_error()
+                    logging.error(f"Error generating text ({kind}, attempt {attempt}): {e}")
+                    raise
+                # A failed half-open trial reopens the breaker without further retries
+                if kind == FATAL or attempt >= self.max_attempts or self.breaker.is_open:
+                    self.breaker.record_failure(e, permanent=is_provider_dead(e))
+                    logging.error(f"Error generating text ({kind}, attempt {attempt}): {e}")
+                    if self.breaker.is_open:
+                        raise ProviderUnavailableError(f"LLM provider unavailable: {self.breaker.reason}") from e
+                    raise
+                delay = self.backoff(attempt)
+                if kind == RATE_LIMITED:
+                    delay = min(retry_after(e) or delay, self.max_delay * 4)
+                    with self._lock:
+                        self._resume_at = max(self._resume_at, time.monotonic() + delay)
+                logging.warning(f"Error generating text ({kind}, attempt {attempt}), retrying in {delay:.1f}s: {e}")
+                if count is not None:
+                    count("retries", 1)
+                if kind != RATE_LIMITED:
+                    self._sleep(delay, count)
+                continue
+            self.breaker.record_success()
+            return result
+
+    def _wait_for_pause(self, count):
+        """Hold off while a rate-limit pause asked for by the provider is in effect"""
+        with self._lock:
+            delay = self._resume_at - time.monotonic()
+        if delay > 0:
+            self._sleep(delay, count)
+
+    def _sleep(self, delay, count):
+        self.sleep(delay)
+        if count is not None:
+            count("retry_seconds", delay)
@@ -0,0 +1,259 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), "tracked_files.db")
+
+# SQLite's default limit on host parameters per statement is 999
+MAX_QUERY_PARAMS = 900
+
+# Schema migrations, applied in order. PRAGMA user_version records how many have run,
+# so every statement here must also be safe on databases created by the old
+# database_utils.py script (hence IF NOT EXISTS on the first two tables).
+MIGRATIONS = [
+    [
+        """
+        CREATE TABLE IF NOT EXISTS tracked_files (
+            inode INTEGER PRIMARY KEY,
+            file_path TEXT NOT NULL,
+            alias TEXT
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS highlights (
+            highlight_id TEXT PRIMARY KEY,
+            pdf_id TEXT NOT NULL,
+            page INTEGER NOT NULL,
+            rect TEXT NOT NULL,
+            text TEXT NOT NULL
+        );
+        """,
+    ],
+    [
+        """
+        CREATE TABLE IF NOT EXISTS file_index (
+            inode INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            file_path TEXT NOT NULL,
+            pdf_id TEXT NOT NULL,
+            PRIMARY KEY (inode, size, mtime_ns)
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS page_annotations (
+            pdf_id TEXT NOT NULL,
+            page INTEGER NOT NULL,
+            digest TEXT NOT NULL,
+            highlights TEXT NOT NULL,
+            PRIMARY KEY (pdf_id, page)
+        );
+        """,
+    ],
+    [
+        "CREATE INDEX IF NOT EXISTS idx_highlights_pdf_id ON highlights (pdf_id);",
+    ],
+    [
+        """
+        CREATE TABLE IF NOT EXISTS inode_paths (
+            inode INTEGER PRIMARY KEY,
+            file_path TEXT NOT NULL
+        );
+        """,
+    ],
+    [
+        # file_index also memoizes the pdf_id of file versions that were not
+        # scanned for highlights yet; see pdf_identity.py
+        "ALTER TABLE file_index ADD COLUMN scanned INTEGER NOT NULL DEFAULT 1;",
+        """
+        CREATE TABLE IF NOT EXISTS pdf_fingerprints (
+            fingerprint TEXT PRIMARY KEY,
+            pdf_id TEXT NOT NULL
+        );
+        """,
+        # pdf_ids recorded before fingerprints, which were hashes of the first pages' text
+        """
+        CREATE TABLE IF NOT EXISTS legacy_pdf_ids (
+            pdf_id TEXT PRIMARY KEY
+        );
+        """,
+        """
+        INSERT OR IGNORE INTO legacy_pdf_ids (pdf_id)
+        SELECT pdf_id FROM highlights UNION SELECT pdf_id FROM page_annotations;
+        """,
+    ],
+    [
+        # One row per highlight sent to the LLM; see job_queue.py
+        """
+        CREATE TABLE IF NOT EXISTS highlight_jobs (
+            highlight_id TEXT PRIMARY KEY,
+            pdf_id TEXT NOT NULL,
+            page INTEGER NOT NULL,
+            rect TEXT NOT NULL,
+            text TEXT NOT NULL,
+            state TEXT NOT NULL,
+            owner TEXT,
+            lease_expires REAL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            updated_at REAL NOT NULL
+        );
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_highlight_jobs_owner ON highlight_jobs (owner, state);",
+        # Generated cards, kept so decks can be written (again) without the LLM
+        """
+        CREATE TABLE IF NOT EXISTS flashcards (
+            highlight_id TEXT NOT NULL,
+            card_index INTEGER NOT NULL,
+            question TEXT NOT NULL,
+            answer TEXT NOT NULL,
+            context_image TEXT NOT NULL DEFAULT '',
+            pdf_path TEXT NOT NULL,
+            exported INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (highlight_id, card_index)
+        );
+        """,
+    ],
+]
+
+
+class Storage:
+    """Shared access to tracked_files.db.
+
+    Holds one long-lived connection in WAL mode that every module (and every
+    thread) goes through, so lookups and inserts can be batched into a single
+    query or transaction instead of opening a connection per statement.
+    """
+
+    def __init__(self, db_path=DEFAULT_DB_PATH):
+        self.db_path = os.path.abspath(db_path)
+        self._lock = threading.RLock()
+        # Autocommit mode; writes are grouped explicitly with transaction()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA busy_timeout=5000")
+        self.migrate()
+
+    def migrate(self):
+        """Apply pending schema migrations and return the resulting schema version"""
+        with self.transaction() as conn:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            for statements in MIGRATIONS[version:]:
+                for statement in statements:
+                    conn.execute(statement)
+            # PRAGMA does not accept bound parameters
+            conn.execute(f"PRAGMA user_version = {len(MIGRATIONS)}")
+        return len(MIGRATIONS)
+
+    @contextmanager
+    def transaction(self):
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            else:
+                self.conn.execute("COMMIT")
+
+    def query(self, sql, params=()):
+        with self._lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+        _instances.pop(self.db_path, None)
+
+    # Highlights
+
+    def existing_ids(self, highlight_ids):
+        """Return the subset of `highlight_ids` already recorded, using one query per 900 ids"""
+        highlight_ids = list(highlight_ids)
+        found = set()
+        for i in range(0, len(highlight_ids), MAX_QUERY_PARAMS):
+            chunk = highlight_ids[i:i + MAX_QUERY_PARAMS]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.query(
+                f"SELECT highlight_id FROM highlights WHERE highlight_id IN ({placeholders})",
+                chunk,
+            )
+            found.update(row[0] for row in rows)
+        return found
+
+    def highlight_exists(self, highlight_id):
+        return bool(self.existing_ids([highlight_id]))
+
+    def insert_highlights(self, rows):
+        """Insert (highlight_id, pdf_id, page, rect, text) rows in a single transaction"""
+        with self.transaction() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO highlights (highlight_id, pdf_id, page, rect, text) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    def highlights_for_pdf(self, pdf_id):
+        return self.query(
+            "SELECT highlight_id, pdf_id, page, rect, text FROM highlights WHERE pdf_id = ? ORDER BY page",
+            (pdf_id,),
+        )
+
+    def count_highlights(self, pdf_id):
+        return self.query("SELECT COUNT(*) FROM highlights WHERE pdf_id = ?", (pdf_id,))[0][0]
+
+    def delete_highlights(self, pdf_id):
+        """Forget every highlight of a PDF, with its job and cards, so the next run regenerates them"""
+        with self.transaction() as conn:
+            conn.execute(
+                "DELETE FROM flashcards WHERE highlight_id IN (SELECT highlight_id FROM highlight_jobs WHERE pdf_id = ?)",
+                (pdf_id,),
+            )
+            conn.execute("DELETE FROM highlight_jobs WHERE pdf_id = ?", (pdf_id,))
+            return conn.execute("DELETE FROM highlights WHERE pdf_id = ?", (pdf_id,)).rowcount
+
+    def delete_last_highlights(self, pdf_id, n):
+        with self.transaction() as conn:
+            highlight_ids = [row[0] for row in conn.execute("""
+                SELECT highlight_id
+                FROM highlights
+                WHERE pdf_id = ?
+                ORDER BY ROWID DESC
+                LIMIT ?
+            """, (pdf_id, n))]
+            params = [(highlight_id,) for highlight_id in highlight_ids]
+            conn.executemany("DELETE FROM flashcards WHERE highlight_id = ?", params)
+            conn.executemany("DELETE FROM highlight_jobs WHERE highlight_id = ?", params)
+            conn.executemany("DELETE FROM highlights WHERE highlight_id = ?", params)
+            return len(highlight_ids)
+
+    # Tracked files
+
+    def tracked_files(self):
+        return self.query("SELECT inode, file_path, alias FROM tracked_files")
+
+    def update_file_path(self, inode, new_path):
+        self.update_file_paths([(inode, new_path)])
+
+    def update_file_paths(self, moves):
+        """Record new paths for (inode, new_path) pairs in a single transaction"""
+        with self.transaction() as conn:
+            conn.executemany(
+                "UPDATE tracked_files SET file_path = ? WHERE inode = ?",
+                [(new_path, inode) for inode, new_path in moves],
+            )
+
+
+_instances = {}
+_instances_lock = threading.Lock()
+
+
+def get_storage(db_path=DEFAULT_DB_PATH):
+    """Return the process-wide Storage for `db_path`, opening it on first use"""
+    db_path = os.path.abspath(db_path)
+    with _instances_lock:
+        if db_path not in _instances:
+            _instances[db_path] = Storage(db_path)
+        return _instances[db_path]
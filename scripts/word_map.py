@@ -0,0 +1,76 @@
+from bisect import bisect_left, bisect_right
+
+
+def quad_rects(annot):
+    """Rects (x0, y0, x1, y1) of an annotation's quads, one per highlighted line.
+
+    Highlight vertices come in groups of four points; annotations without them
+    fall back to the bounding rect.
+    """
+    vertices = annot.vertices or []
+    rects = []
+    for i in range(0, len(vertices) - 3, 4):
+        xs = [point[0] for point in vertices[i:i + 4]]
+        ys = [point[1] for point in vertices[i:i + 4]]
+        rects.append((min(xs), min(ys), max(xs), max(ys)))
+    if not rects:
+        rect = annot.rect
+        rects.append((rect.x0, rect.y0, rect.x1, rect.y1))
+    return rects
+
+
+class WordMap:
+    """Spatial index over the words of one page, built from a single get_text("words") pass.
+
+    Lines are kept sorted by their vertical centre and the words of each line by
+    their horizontal centre, so the words under a quad are found with two binary
+    searches instead of re-parsing the page for every highlight.
+    """
+
+    def __init__(self, words):
+        # words: PyMuPDF tuples (x0, y0, x1, y1, text, block_no, line_no, word_no),
+        # in reading order; the position in that order is kept to rebuild the text
+        lines = {}
+        for order, word in enumerate(words):
+            lines.setdefault((word[5], word[6]), []).append((order, word))
+
+        self.lines = []  # (y_centre, key, [x_centre], [(order, word)])
+        for key, line_words in lines.items():
+            line_words.sort(key=lambda item: (item[1][0] + item[1][2]) / 2)
+            y_centre = sum((word[1] + word[3]) / 2 for _, word in line_words) / len(line_words)
+            x_centres = [(word[0] + word[2]) / 2 for _, word in line_words]
+            self.lines.append((y_centre, key, x_centres, line_words))
+        self.lines.sort(key=lambda line: line[0])
+        self.y_centres = [line[0] for line in self.lines]
+
+    @classmethod
+    def from_page(cls, page):
+        return cls(page.get_text("words"))
+
+    def words_in(self, rect):
+        """(order, word) of the words whose centre lies inside rect"""
+        x0, y0, x1, y1 = rect
+        found = []
+        for line in self.lines[bisect_left(self.y_centres, y0):bisect_right(self.y_centres, y1)]:
+            _, _, x_centres, line_words = line
+            found.extend(line_words[bisect_left(x_centres, x0):bisect_right(x_centres, x1)])
+        return found
+
+    def text_in(self, rects):
+        """Text under a highlight's quads, in reading order, one line of text per source line"""
+        selected = {}
+        for rect in rects:
+            for order, word in self.words_in(rect):
+                selected[order] = word
+
+        lines, current, current_line = [], [], None
+        for order in sorted(selected):
+            word = selected[order]
+            if current and (word[5], word[6]) != current_line:
+                lines.append(" ".join(current))
+                current = []
+            current.append(word[4])
+            current_line = (word[5], word[6])
+        if current:
+            lines.append(" ".join(current))
+        return "\n".join(lines)
@@ -0,0 +1,272 @@
+import unittest
+import sys
+import os
+import json
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Scripts import each other as top-level modules, so put the scripts directory on sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "scripts")))
+
+from anki_connect import AnkiConnectClient, AnkiConnectError, highlight_tag
+from anki_update import relink_notes, update_anki_source_links
+from anki_connect_output import AnkiConnectOutputHandler
+from flashcard_output_to_anki_handler import MODEL_NAME
+from main import Pipeline
+from test_flashcard_generator import FakeProvider
+from test_flashcard_output import make_flashcards
+from test_pdf_handler import make_highlighted_pdf
+
+
+class StubAnki:
+    """In-memory collection behind a minimal AnkiConnect HTTP endpoint"""
+
+    def __init__(self):
+        self.notes = {}  # note id -> {"noteId", "tags", "fields"}
+        self.models = {}
+        self.decks = set()
+        self.media = {}
+        self.actions = []
+        # Predicate on a note's params; matching notes are rejected with a null id
+        self.reject = lambda note: False
+        self.fail_add_notes = False
+        self.requests = 0
+        self.connections = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def add_note(self, note_id, tags, fields):
+        self.notes[note_id] = {"noteId": note_id, "tags": tags, "fields": {k: {"value": v, "order": i} for i, (k, v) in enumerate(fields.items())}}
+
+    def field(self, note_id, name):
+        return self.notes[note_id]["fields"][name]["value"]
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def run(self, action, params):
+        self.actions.append(action)
+        if action == "multi":
+            return [self.respond(a["action"], a.get("params", {})) for a in params["actions"]]
+        if action == "findNotes":
+            tags = {term.strip('"')[len("tag:"):].lower() for term in params["query"].split(" OR ")}
+            return [nid for nid, note in self.notes.items() if tags & {t.lower() for t in note["tags"]}]
+        if action == "notesInfo":
+            return [self.notes[nid] for nid in params["notes"] if nid in self.notes]
+        if action == "updateNoteFields":
+            note = self.notes.get(params["note"]["id"])
+            if note is None:
+                raise KeyError("Note was not found")
+            for name, value in params["note"]["fields"].items():
+                note["fields"][name]["value"] = value
+            return None
+        if action == "modelNames":
+            return list(self.models)
+        if action == "createModel":
+            self.models[params["modelName"]] = params["inOrderFields"]
+            return None
+        if action == "createDeck":
+            self.decks.add(params["deck"])
+            return 1
+        if action == "getMediaFilesNames":
+            return [name for name in self.media if name == params["pattern"]]
+        if action == "storeMediaFile":
+            self.media[params["filename"]] = params["data"]
+            return params["filename"]
+        if action == "addNotes":
+            if self.fail_add_notes:
+                raise RuntimeError("collection is not available")
+            ids = []
+            for note in params["notes"]:
+                if self.reject(note):
+                    ids.append(None)
+                    continue
+                note_id = len(self.notes) + 1
+                self.add_note(note_id, note["tags"], note["fields"])
+                ids.append(note_id)
+            return ids
+        raise ValueError(f"unsupported action {action}")
+
+    def respond(self, action, params):
+        try:
+            return {"result": self.run(action, params), "error": None}
+        except Exception as e:
+            return {"result": None, "error": str(e)}
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive
+
+            def setup(self):
+                super().setup()
+                stub.connections += 1
+
+            def do_POST(self):
+                stub.requests += 1
+                request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                body = json.dumps(stub.respond(request["action"], request.get("params", {}))).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+class TestAnkiConnect(unittest.TestCase):
+
+    def setUp(self):
+        self.anki = StubAnki()
+        self.client = AnkiConnectClient(self.anki.url)
+
+    def tearDown(self):
+        self.client.close()
+        self.anki.close()
+
+    def test_relinks_thousands_of_notes_in_a_few_round_trips(self):
+        highlights = []
+        for i in range(5000):
+            highlight_id = f"{i:032x}"
+            highlights.append((highlight_id, "pdf", i % 300 + 1, "rect", "text"))
+            self.anki.add_note(i + 1, [highlight_tag(highlight_id), "other"], {"Front": "q", "SourceLink": "old"})
+
+        updated = update_anki_source_links(highlights, "/books/moved.pdf", client=self.client)
+
+        self.assertEqual(updated, 5000)
+        self.assertIn("/books/moved.pdf", self.anki.field(1, "SourceLink"))
+        self.assertIn("(Page 1)", self.anki.field(1, "SourceLink"))
+        self.assertLessEqual(self.anki.requests, 4)
+        self.assertEqual(self.anki.connections, 1)
+
+    def test_skips_notes_without_the_field_and_reports_failed_updates(self):
+        self.anki.add_note(1, [highlight_tag("a")], {"Front": "q", "SourceLink": "old"})
+        self.anki.add_note(2, [highlight_tag("b")], {"Front": "q"})
+        self.anki.add_note(3, [highlight_tag("ab")], {"Front": "q", "SourceLink": "old"})
+
+        self.assertEqual(relink_notes(self.client, {"a": "new a", "b": "new b"}), 1)
+        self.assertEqual(self.anki.field(1, "SourceLink"), "new a")
+        self.assertEqual(self.anki.field(3, "SourceLink"), "old")
+
+        self.assertEqual(self.client.update_note_fields([(1, {"SourceLink": "x"}), (99, {"SourceLink": "y"})]), 1)
+
+    def test_errors_raise(self):
+        with self.assertRaises(AnkiConnectError):
+            self.client.invoke("unknownAction")
+
+
+class TestAnkiConnectOutputHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.anki = StubAnki()
+        self.client = AnkiConnectClient(self.anki.url)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.pdf_path = os.path.join(self.tmp_dir.name, "book.pdf")
+        make_highlighted_pdf(self.pdf_path, pages=2, highlights_per_page=1)
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp_dir.name)
+        os.makedirs("pdf_images")
+        with open(os.path.join("pdf_images", "context_1.jpg"), "wb") as f:
+            f.write(b"jpeg")
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp_dir.cleanup()
+        self.client.close()
+        self.anki.close()
+
+    def push(self, highlight_ids):
+        flashcards = make_flashcards(highlight_ids)
+        for flashcard in flashcards:
+            flashcard.context_image = "context_1.jpg"
+        with AnkiConnectOutputHandler(self.client) as handler:
+            handler.add_flashcards(flashcards, self.pdf_path)
+            return handler.write_deck("book.pdf")
+
+    def test_adds_only_new_notes_and_missing_media(self):
+        self.assertEqual(self.push(["h1", "h2"]), 4)
+        self.assertEqual(self.anki.decks, {"book.pdf"})
+        self.assertEqual(self.anki.models[MODEL_NAME], ["Front", "Back", "Image", "SourceLink"])
+        self.assertEqual(sorted(self.anki.media), ["_source_01234567.pdf", "context_1.jpg"])
+        self.assertEqual(self.anki.notes[1]["tags"], [highlight_tag("h1")])
+
+        self.anki.actions.clear()
+        self.assertEqual(self.push(["h2", "h3"]), 2)
+        self.assertEqual(len(self.anki.notes), 6)
+        self.assertNotIn("storeMediaFile", self.anki.actions)
+        self.assertNotIn("createModel", self.anki.actions)
+
+    def test_pushed_notes_can_be_relinked(self):
+        self.push(["h1"])
+        self.assertIn(self.pdf_path, self.anki.field(1, "SourceLink"))
+
+        self.assertEqual(relink_notes(self.client, {"h1": "moved"}), 2)
+        self.assertEqual(self.anki.field(1, "SourceLink"), "moved")
+
+    def test_nothing_is_sent_when_every_highlight_is_present(self):
+        self.push(["h1"])
+        self.anki.actions.clear()
+
+        self.assertEqual(self.push(["h1"]), 0)
+        self.assertNotIn("addNotes", self.anki.actions)
+
+
+class TestPipelineExport(unittest.TestCase):
+
+    def setUp(self):
+        self.anki = StubAnki()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.pdf_path = os.path.join(self.tmp_dir.name, "book.pdf")
+        make_highlighted_pdf(self.pdf_path, pages=2, highlights_per_page=2)
+        cwd = os.getcwd()
+        os.chdir(self.tmp_dir.name)
+        self.addCleanup(os.chdir, cwd)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+        self.anki.close()
+
+    def run_pipeline(self):
+        pipeline = Pipeline(
+            "English", concurrency=1, requests_per_minute=0, use_cache=False, image_workers=1,
+            output="anki-connect", anki_connect_url=self.anki.url,
+            llm_provider=FakeProvider(latency=0), db_path=os.path.join(self.tmp_dir.name, "tracked_files.db"),
+        )
+        try:
+            pipeline.process_pdf(self.pdf_path)
+            return pipeline.job_queue.cards(pipeline.identity.pdf_id(self.pdf_path), unexported_only=True)
+        finally:
+            pipeline.close()
+
+    def test_rejected_notes_stay_unexported(self):
+        self.anki.reject = lambda note: "line 1" in note["fields"]["Back"]
+        unexported = self.run_pipeline()
+        self.assertEqual(len(self.anki.notes), 2)
+        self.assertEqual(len(unexported), 2)
+        self.assertTrue(all("line 1" in card.answer for card in unexported))
+
+        # The next run writes them once Anki accepts them
+        self.anki.reject = lambda note: False
+        self.assertEqual(self.run_pipeline(), [])
+        self.assertEqual(len(self.anki.notes), 4)
+
+    def test_failed_requests_leave_the_book_unexported(self):
+        self.anki.fail_add_notes = True
+        self.assertEqual(len(self.run_pipeline()), 4)
+
+        self.anki.fail_add_notes = False
+        self.assertEqual(self.run_pipeline(), [])
+        self.assertEqual(len(self.anki.notes), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+import sys
+import os
+import tempfile
+
+# The benchmarks import the scripts themselves; put both directories on sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "scripts")))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "benchmarks")))
+
+from pdf_handler import PDFHandler
+from synthetic_pdf import make_book
+from fake_provider import FakeLLMProvider, FakeRateLimitError
+from retry_policy import RATE_LIMITED, classify_error, retry_after
+from bench_pipeline import regressions
+
+
+class TestSyntheticBook(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.pdf_path = os.path.join(self.tmp_dir.name, "book.pdf")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_fractional_density(self):
+        self.assertEqual(make_book(self.pdf_path, pages=40, highlights_per_page=0.25), 10)
+        pdf_handler = PDFHandler(self.pdf_path)
+        self.addCleanup(pdf_handler.close)
+        self.assertEqual(len(pdf_handler.extract_highlights()), 10)
+
+    def test_multiline_highlights_span_two_lines(self):
+        make_book(self.pdf_path, pages=2, highlights_per_page=3, multiline_ratio=1.0)
+        pdf_handler = PDFHandler(self.pdf_path)
+        self.addCleanup(pdf_handler.close)
+        highlights = pdf_handler.extract_highlights()
+
+        self.assertEqual(len(highlights), 6)
+        for highlight in highlights:
+            first, second = highlight.text.split("\n")
+            # The end of one line and the start of the next, without the rest of either
+            self.assertTrue(first.endswith("incididunt."))
+            self.assertTrue(second.startswith("p"))
+            self.assertFalse(first.startswith("p"))
+
+
+class TestFakeProvider(unittest.TestCase):
+
+    def test_failures_are_deterministic_and_retryable(self):
+        prompts = [f"Making special emphasis around the highlight I made: h{i}\n" for i in range(200)]
+
+        def failing(provider):
+            failed = []
+            for prompt in prompts:
+                try:
+                    provider.generate_text(prompt)
+                except FakeRateLimitError as e:
+                    failed.append(prompt)
+                    self.assertEqual(classify_error(e), RATE_LIMITED)
+                    self.assertEqual(retry_after(e), 0.05)
+                    # Each prompt fails once, then answers
+                    self.assertIn("A: h", provider.generate_text(prompt))
+            return failed
+
+        failed = failing(FakeLLMProvider(latency=0, failure_rate=0.1))
+        self.assertEqual(failing(FakeLLMProvider(latency=0, failure_rate=0.1)), failed)
+        self.assertTrue(5 < len(failed) < 40)
+
+
+class TestRegressions(unittest.TestCase):
+
+    def test_threshold_and_noise_floor(self):
+        baseline = {"end_to_end.seconds": 10.0, "parse.seconds": 0.01, "llm_call.peak_mb": 10.0}
+        current = {"end_to_end.seconds": 13.0, "parse.seconds": 0.03, "llm_call.peak_mb": 11.0}
+        self.assertEqual(regressions(current, baseline, 0.25), [("end_to_end.seconds", 10.0, 13.0)])
+        self.assertEqual(regressions(current, baseline, 0.5), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
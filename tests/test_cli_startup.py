@@ -0,0 +1,36 @@
+import unittest
+import sys
+import os
+import subprocess
+
+SCRIPTS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "scripts"))
+# Scripts import each other as top-level modules, so put the scripts directory on sys.path
+sys.path.append(SCRIPTS_DIR)
+
+from main import get_llm_provider
+
+# Dependencies that only generation, rendering or Anki output need
+HEAVY_MODULES = ["fitz", "anthropic", "tenacity", "PIL", "genanki", "requests", "google.generativeai", "langchain_openai"]
+
+
+def loaded_heavy_modules(module):
+    """Heavy modules present after importing `module` in a fresh interpreter"""
+    code = f"import sys, {module}; print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    result = subprocess.run([sys.executable, "-c", code], cwd=SCRIPTS_DIR, capture_output=True, text=True, check=True)
+    return result.stdout.split()
+
+
+class TestCLIStartup(unittest.TestCase):
+
+    def test_entry_points_do_not_import_heavy_dependencies(self):
+        for module in ["main", "highlight_manager", "monitor_files", "library"]:
+            with self.subTest(module=module):
+                self.assertEqual(loaded_heavy_modules(module), [])
+
+    def test_unknown_provider_is_rejected_before_importing_anything(self):
+        with self.assertRaises(ValueError):
+            get_llm_provider("unknown", "key")
+
+
+if __name__ == "__main__":
+    unittest.main()
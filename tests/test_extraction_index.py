@@ -0,0 +1,96 @@
+import unittest
+import sys
+import os
+import tempfile
+
+import fitz
+
+# Scripts import each other as top-level modules, so put the scripts directory on sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "scripts")))
+
+from pdf_handler import PDFHandler
+from highlight_context_extractor import HighlightContextExtractor
+from extraction_index import ExtractionIndex
+from storage import Storage
+from test_pdf_handler import make_highlighted_pdf
+
+
+class CountingPDFHandler(PDFHandler):
+    scanned_pages = None
+
+    def _extract_page_highlights(self, page, annots):
+        self.scanned_pages = (self.scanned_pages or []) + [page.number]
+        return super()._extract_page_highlights(page, annots)
+
+
+class TestExtractionIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.pdf_path = os.path.join(self.tmp_dir.name, "book.pdf")
+        self.storage = Storage(os.path.join(self.tmp_dir.name, "tracked_files.db"))
+        self.index = ExtractionIndex(self.storage)
+        make_highlighted_pdf(self.pdf_path, pages=6, highlights_per_page=2)
+
+    def tearDown(self):
+        self.storage.close()
+        self.tmp_dir.cleanup()
+
+    def test_unchanged_file_is_not_reopened(self):
+        first = PDFHandler(self.pdf_path, index=self.index).extract_highlights()
+
+        pdf_handler = PDFHandler(self.pdf_path, index=self.index)
+        second = pdf_handler.extract_highlights()
+
+        self.assertTrue(pdf_handler.unchanged)
+        # Nor when building the contexts of no new highlights
+        self.assertEqual(list(HighlightContextExtractor(pdf_handler).iter_contexts(iter([]))), [])
+        self.assertIsNone(pdf_handler._doc)
+        self.assertEqual([h.highlight_id for h in first], [h.highlight_id for h in second])
+        self.assertEqual(first[0].rect, second[0].rect)
+
+    def test_only_changed_pages_are_rescanned(self):
+        first = PDFHandler(self.pdf_path, index=self.index).extract_highlights()
+
+        doc = fitz.open(self.pdf_path)
+        # Pages 0-4 feed the pdf_id, so add new text past them
+        page = doc.load_page(5)
+        page.insert_text(fitz.Point(72, 400), "A new highlighted sentence")
+        page.add_highlight_annot(page.search_for("A new highlighted sentence"))
+        doc.saveIncr()
+        doc.close()
+
+        pdf_handler = CountingPDFHandler(self.pdf_path, index=self.index)
+        second = pdf_handler.extract_highlights()
+
+        self.assertEqual(pdf_handler.scanned_pages, [5])
+        self.assertEqual(len(second), len(first) + 1)
+        self.assertIn("A new highlighted sentence", [h.text for h in second])
+        # Highlights already on the rescanned page keep their IDs
+        self.assertEqual(
+            {h.highlight_id for h in first} - {h.highlight_id for h in second}, set()
+        )
+
+
+    def test_highlights_recorded_before_the_index_keep_their_ids(self):
+        doc = fitz.open()
+        page = doc.new_page()
+        page.insert_text(fitz.Point(72, 100), "Unmarked start of the line, marked end")
+        page.insert_text(fitz.Point(72, 120), "continues here but stops before this")
+        rect = page.add_highlight_annot([page.search_for("marked end")[0], page.search_for("continues here")[0]]).rect
+        # The text and ID an older version stored, read from the whole annotation rect
+        legacy_text = page.get_textbox(rect).strip()
+        doc.save(self.pdf_path)
+        doc.close()
+
+        pdf_handler = PDFHandler(self.pdf_path, index=self.index)
+        legacy_id = pdf_handler._generate_highlight_id(0, rect, legacy_text)
+        self.storage.insert_highlights([(legacy_id, pdf_handler.pdf_id, 1, str(rect), legacy_text)])
+
+        self.assertEqual([h.highlight_id for h in pdf_handler.extract_highlights()], [legacy_id])
+        # Stored in the index from then on
+        self.assertEqual([h.highlight_id for h in PDFHandler(self.pdf_path, index=self.index).extract_highlights()], [legacy_id])
+
+
+if __name__ == "__main__":
+    unittest.main()
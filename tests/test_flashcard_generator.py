@@ -0,0 +1,215 @@
+import unittest
+import sys
+import os
+import tempfile
+import threading
+import time
+
+# Scripts import each other as top-level modules, so put the scripts directory on sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "scripts")))
+
+from flashcard_generator import FlashcardGenerator, LLMProvider
+from records import Context, Highlight
+from storage import Storage
+from response_cache import ResponseCache
+
+
+class FakeProvider(LLMProvider):
+    """Offline provider that answers after a fixed latency and records concurrency"""
+
+    def __init__(self, api_key: str = "", latency: float = 0.05):
+        self.latency = latency
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate_text(self, prompt: str) -> str:
+        with self._lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.latency)
+            highlight = prompt.split("the highlight I made: ")[1].split("\n")[0]
+            return f"Q: What about {highlight}?\nA: {highlight}"
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+class TaggedFakeProvider(FakeProvider):
+    """Answers batched prompts with one tagged section per highlight"""
+
+    def generate_text(self, prompt: str) -> str:
+        with self._lock:
+            self.calls += 1
+        sections = []
+        for line in prompt.split("\n"):
+            if line.startswith("[H"):
+                tag, highlight = line[1:].split("] ", 1)
+                sections.append(f"### {tag}\nQ: What about {highlight}?\nA: {highlight}")
+        return "\n\n".join(sections)
+
+
+class FakePages:
+    def get_text_by_pages(self, start_page, end_page):
+        return f"context {start_page}-{end_page}"
+
+
+def make_contexts(n, pages_per_context=1):
+    pages = FakePages()
+    return [
+        Context(
+            highlight=Highlight(
+                highlight_id=f"id{i}",
+                text=f"highlight {i}",
+                page=i // pages_per_context + 1,
+                pdf_id="pdf",
+                rect=(0.0, 0.0, 1.0, 1.0),
+            ),
+            start_page=max(i // pages_per_context - 1, 0),
+            end_page=i // pages_per_context + 1,
+            pages=pages,
+            pdf_path="book.pdf",
+        )
+        for i in range(n)
+    ]
+
+
+class TestFlashcardGenerator(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.storage = Storage(os.path.join(self.tmp_dir.name, "tracked_files.db"))
+
+    def tearDown(self):
+        self.storage.close()
+        self.tmp_dir.cleanup()
+
+    def make_generator(self, provider, **kwargs):
+        return FlashcardGenerator(
+            provider,
+            requests_per_minute=0,
+            storage=self.storage,
+            **kwargs,
+        )
+
+    def test_concurrent_generation_preserves_order(self):
+        provider = FakeProvider(latency=0.05)
+        generator = self.make_generator(provider, max_concurrency=8)
+        contexts = make_contexts(16)
+
+        results = generator.generate_flashcards(contexts, "English")
+
+        self.assertEqual(len(results), len(contexts))
+        for context, flashcards in zip(contexts, results):
+            self.assertEqual(flashcards[0].answer, context.text)
+        self.assertLessEqual(provider.max_in_flight, 8)
+        # Requests overlapped, rather than running one after another
+        self.assertGreater(provider.max_in_flight, 1)
+        for context in contexts:
+            self.assertTrue(generator.highlight_exists(context.highlight_id))
+
+    def test_in_flight_requests_are_bounded(self):
+        provider = FakeProvider(latency=0.02)
+        generator = self.make_generator(provider, max_concurrency=3)
+        generator.generate_flashcards(make_contexts(12), "English")
+        self.assertLessEqual(provider.max_in_flight, 3)
+
+    def test_rate_limit_paces_requests(self):
+        provider = FakeProvider(latency=0)
+        generator = FlashcardGenerator(
+            provider,
+            max_concurrency=4,
+            requests_per_minute=600,  # one request every 0.1s after the initial burst
+            storage=self.storage,
+        )
+        start = time.monotonic()
+        generator.generate_flashcards(make_contexts(4), "English")
+        self.assertGreaterEqual(time.monotonic() - start, 0.25)
+
+    def test_batched_prompts_route_cards_to_highlights(self):
+        provider = TaggedFakeProvider()
+        generator = self.make_generator(provider, max_concurrency=2)
+        # Five highlights per page across four pages, with overlapping +-1 page windows
+        contexts = make_contexts(20, pages_per_context=5)
+
+        results = generator.generate_flashcards(
+            contexts,
+            "English",
+            max_prompt_tokens=2000,
+            page_text=lambda page_num: "x" * 400,
+        )
+
+        self.assertLess(provider.calls, len(contexts) / 4)
+        self.assertEqual(len(results), len(contexts))
+        for context, flashcards in zip(contexts, results):
+            self.assertEqual(len(flashcards), 1)
+            self.assertEqual(flashcards[0].highlight_id, context.highlight_id)
+            self.assertEqual(flashcards[0].answer, context.text)
+            self.assertEqual(flashcards[0].page, context.page)
+
+    def test_cached_responses_skip_the_provider(self):
+        cache = ResponseCache(os.path.join(self.tmp_dir.name, "llm_cache"))
+        provider = FakeProvider(latency=0)
+        contexts = make_contexts(5)
+
+        first = self.make_generator(provider, response_cache=cache).generate_flashcards(contexts, "English")
+        self.storage.delete_highlights("pdf")
+        second = self.make_generator(provider, response_cache=cache).generate_flashcards(contexts, "English")
+
+        self.assertEqual(provider.calls, 5)
+        self.assertEqual(cache.stats()["hits"], 5)
+        self.assertEqual(
+            [[card.question for card in cards] for cards in first],
+            [[card.question for card in cards] for cards in second],
+        )
+
+        self.make_generator(provider, response_cache=cache).generate_flashcards(contexts, "Spanish")
+        self.assertEqual(provider.calls, 10)
+
+    def test_unusable_responses_are_not_cached(self):
+        cache = ResponseCache(os.path.join(self.tmp_dir.name, "llm_cache"))
+        contexts = make_contexts(1)
+        provider = FakeProvider(latency=0)
+        provider.generate_text = lambda prompt: "Sorry, I can't help with that."
+        generator = self.make_generator(provider, response_cache=cache)
+        self.assertEqual(generator.generate_flashcards(contexts, "English"), [[]])
+        self.assertEqual(cache.stats()["entries"], 0)
+
+        # An unusable entry that is already cached is dropped on its next hit
+        prompt = generator._create_prompt(contexts[0], "English")
+        cache.put(ResponseCache.make_key("FakeProvider", provider.model_name, "English", prompt), "")
+        self.assertEqual(generator.generate_flashcards(contexts, "English"), [[]])
+        self.assertEqual(cache.stats()["entries"], 0)
+
+        provider = FakeProvider(latency=0)
+        self.make_generator(provider, response_cache=cache).generate_flashcards(contexts, "English")
+        self.assertEqual(provider.calls, 1)
+        self.assertEqual(cache.stats()["entries"], 1)
+
+    def test_streaming_pulls_contexts_lazily(self):
+        provider = FakeProvider(latency=0.01)
+        generator = self.make_generator(provider, max_concurrency=2)
+        pulled = []
+
+        def contexts():
+            for context in make_contexts(1000):
+                pulled.append(context.highlight_id)
+                yield context
+
+        stream = generator.iter_flashcards(contexts(), "English", window=4)
+        results = [next(stream) for _ in range(3)]
+        stream.close()
+
+        self.assertEqual([context.highlight_id for context, _ in results], ["id0", "id1", "id2"])
+        self.assertEqual(results[2][1][0].answer, "highlight 2")
+        # Only the in-flight window was read ahead of the consumer
+        self.assertLessEqual(len(pulled), 3 + 4)
+        self.assertLessEqual(provider.calls, len(pulled))
+        self.assertTrue(generator.highlight_exists("id2"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,140 @@
+import unittest
+import sys
+import os
+import tempfile
+
+# Scripts import each other as top-level modules, so put the scripts directory on sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "scripts")))
+
+from flashcard_output_to_anki_handler import FlashcardOutputHandler
+from anki_update import SOURCE_LINK_FIELD
+from media_registry import MediaRegistry
+from records import Flashcard, Highlight
+from test_pdf_handler import make_highlighted_pdf
+
+
+def make_flashcards(highlight_ids, cards_per_highlight=2):
+    return [
+        Flashcard(
+            question=f"Question {n} about {highlight_id}?",
+            answer=f"Answer {n}",
+            highlight=Highlight(highlight_id, f"text of {highlight_id}", 1, "0123456789abcdef", (0.0, 0.0, 1.0, 1.0)),
+        )
+        for highlight_id in highlight_ids
+        for n in range(cards_per_highlight)
+    ]
+
+
+class CountingOutputHandler(FlashcardOutputHandler):
+    compressions = 0
+
+    def _compress_pdf(self, input_pdf_path, compressed_path):
+        self.compressions += 1
+        return super()._compress_pdf(input_pdf_path, compressed_path)
+
+
+class TestFlashcardOutputHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.pdf_path = os.path.join(self.tmp_dir.name, "book.pdf")
+        make_highlighted_pdf(self.pdf_path, pages=2, highlights_per_page=1)
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp_dir.name)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmp_dir.cleanup()
+
+    def test_source_pdf_is_compressed_once_per_run(self):
+        handler = CountingOutputHandler()
+        for batch in range(5):
+            handler.add_flashcards(make_flashcards([f"h{batch}"]), self.pdf_path)
+        output_file = handler.write_deck("book")
+        handler.close()
+
+        self.assertEqual(handler.compressions, 1)
+        self.assertEqual(len(handler.notes), 10)
+        self.assertTrue(os.path.exists(output_file))
+
+    def test_note_guids_are_stable_across_runs(self):
+        first = FlashcardOutputHandler()
+        first.add_flashcards(make_flashcards(["h1", "h2"]), self.pdf_path)
+        second = FlashcardOutputHandler()
+        second.add_flashcards(make_flashcards(["h2"]), self.pdf_path)
+
+        first.close()
+        second.close()
+
+        guids = {note.fields[0]: note.guid for note in first.notes}
+        for note in second.notes:
+            self.assertEqual(note.guid, guids[note.fields[0]])
+        self.assertEqual(len(set(guids.values())), 4)
+
+    def test_notes_link_to_their_source_page(self):
+        handler = FlashcardOutputHandler()
+        handler.add_flashcards(make_flashcards(["h1"]), self.pdf_path)
+        handler.close()
+
+        field_names = [field["name"] for field in handler.model.fields]
+        self.assertIn(SOURCE_LINK_FIELD, field_names)
+        for note in handler.notes:
+            self.assertEqual(len(note.fields), len(field_names))
+            link = note.fields[field_names.index(SOURCE_LINK_FIELD)]
+            self.assertIn(self.pdf_path, link)
+            self.assertIn("(Page 1)", link)
+
+    def test_media_is_deduplicated_and_temp_files_removed(self):
+        os.makedirs("pdf_images")
+        for name in ["context_a.jpg", "context_b.jpg"]:
+            with open(os.path.join("pdf_images", name), "wb") as f:
+                f.write(b"same image bytes")
+
+        handler = FlashcardOutputHandler()
+        flashcards = make_flashcards(["h1", "h2", "h3"])
+        for n, flashcard in enumerate(flashcards):
+            flashcard.context_image = "context_a.jpg" if n % 2 else "context_b.jpg"
+        handler.add_flashcards(flashcards, self.pdf_path)
+        handler.add_flashcards(make_flashcards(["h4"]), self.pdf_path)
+
+        # One source PDF and one image, whatever the number of notes and batches
+        self.assertEqual(len(handler.media_files), 2)
+        self.assertEqual(
+            handler.media.total_bytes,
+            sum(os.path.getsize(path) for path, _ in handler.media_files),
+        )
+        staged = [path for path, name in handler.media_files if name.startswith("_source_")]
+        self.assertEqual(os.path.basename(staged[0]), "_source_01234567.pdf")
+        # Notes refer to the one image that is packaged
+        packaged = {name for _, name in handler.media_files}
+        image_field = [field["name"] for field in handler.model.fields].index("Image")
+        images = {note.fields[image_field] for note in handler.notes if note.fields[image_field]}
+        self.assertEqual(len(images), 1)
+        self.assertLessEqual(images, packaged)
+
+        handler.write_deck("book")
+        handler.close()
+        self.assertFalse(os.path.exists(staged[0]))
+        self.assertTrue(os.path.exists(os.path.join("pdf_images", "context_a.jpg")))
+
+
+class TestMediaRegistry(unittest.TestCase):
+
+    def test_owned_duplicates_are_removed_immediately(self):
+        registry = MediaRegistry()
+        paths = []
+        for name in ["one.pdf", "two.pdf"]:
+            path = registry.staging_path(name)
+            with open(path, "wb") as f:
+                f.write(b"identical")
+            paths.append(path)
+
+        self.assertEqual(registry.add(paths[0]), "one.pdf")
+        self.assertEqual(registry.add(paths[1]), "one.pdf")
+        self.assertFalse(os.path.exists(paths[1]))
+        registry.cleanup()
+        self.assertFalse(os.path.exists(paths[0]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+import sys
+import os
+import tempfile
+
+# Scripts import each other as top-level modules, so put the scripts directory on sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "scripts")))
+
+from pdf_handler import PDFHandler
+from highlight_context_extractor import HighlightContextExtractor
+from prompt_batcher import estimate_tokens
+from test_pdf_handler import make_highlighted_pdf
+
+
+class TestHighlightContextExtractor(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.pdf_path = os.path.join(self.tmp_dir.name, "book.pdf")
+        make_highlighted_pdf(self.pdf_path, pages=10, highlights_per_page=3)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_each_page_is_decoded_once_when_building_contexts(self):
+        pdf_handler = PDFHandler(self.pdf_path)
+        highlights = pdf_handler.extract_highlights()
+        self.assertEqual(len(highlights), 30)
+
+        contexts = HighlightContextExtractor(pdf_handler).get_contexts(highlights)
+        # Contexts reference their pages; the text is read when prompts are built
+        for context in contexts:
+            context.context
+
+        self.assertEqual(pdf_handler.page_cache_misses, 10)
+        self.assertEqual([c.highlight_id for c in contexts], [h.highlight_id for h in highlights])
+        self.assertEqual(contexts[4].context, pdf_handler.get_text_by_pages(0, 2))
+
+    def test_contexts_keep_the_nearest_blocks_within_budget(self):
+        pdf_handler = PDFHandler(self.pdf_path)
+        highlights = pdf_handler.extract_highlights()
+        full = HighlightContextExtractor(pdf_handler).get_contexts(highlights)
+        trimmed = HighlightContextExtractor(pdf_handler, token_budget=12).get_contexts(highlights)
+
+        for before, after in zip(full, trimmed):
+            self.assertIsNotNone(after.blocks)
+            self.assertIn(after.text.strip(), after.context)
+            self.assertLessEqual(estimate_tokens(after.context), 12 + len(after.blocks))
+            self.assertGreater(after.tokens_saved, 0)
+            self.assertLess(len(after.context), len(before.context))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+import sys
+import os
+import tempfile
+
+# Scripts import each other as top-level modules, so put the scripts directory on sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "scripts")))
+
+from pdf_handler import PDFHandler
+from highlight_context_extractor import HighlightContextExtractor
+from image_handler import ContextImagePipeline, PDFImageHandler
+from records import Flashcard
+from test_pdf_handler import make_highlighted_pdf
+
+
+class TestContextImagePipeline(unittest.TestCase):
+
+    def test_renders_each_page_once_and_attaches_images(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            pdf_path = os.path.join(tmp_dir, "book.pdf")
+            make_highlighted_pdf(pdf_path, pages=8, highlights_per_page=2)
+            pdf_handler = PDFHandler(pdf_path)
+            contexts = HighlightContextExtractor(pdf_handler).get_contexts(pdf_handler.extract_highlights())
+
+            output_dir = os.path.join(tmp_dir, "pdf_images")
+            with ContextImagePipeline(output_dir=output_dir, max_workers=2) as pipeline:
+                pipeline.submit(contexts)
+                self.assertEqual(len(pipeline._futures), 8)
+                flashcards = [Flashcard("q", "a", c.highlight) for c in contexts]
+                pipeline.attach(flashcards)
+
+            self.assertEqual(len(os.listdir(output_dir)), 8)
+            for flashcard in flashcards:
+                self.assertTrue(os.path.exists(os.path.join(output_dir, flashcard.context_image)))
+
+
+class TestPDFImageHandler(unittest.TestCase):
+
+    def test_keeps_only_recent_documents_open(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            pdf_paths = []
+            for i in range(3):
+                pdf_paths.append(os.path.join(tmp_dir, f"book{i}.pdf"))
+                make_highlighted_pdf(pdf_paths[-1], pages=1, highlights_per_page=1)
+
+            handler = PDFImageHandler(output_dir=os.path.join(tmp_dir, "pdf_images"), max_open_docs=2)
+            docs = [handler._open(pdf_path) for pdf_path in pdf_paths]
+            handler.create_context_image(pdf_paths[0], 1, "book0")
+
+            self.assertEqual(list(handler._docs), [pdf_paths[2], pdf_paths[0]])
+            self.assertTrue(docs[0].is_closed)
+            self.assertTrue(docs[1].is_closed)
+            self.assertFalse(docs[2].is_closed)
+            handler.close()
+            self.assertTrue(docs[2].is_closed)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,246 @@
+import unittest
+import unittest.mock
+import sys
+import os
+import socket
+import sqlite3
+import subprocess
+import tempfile
+import zipfile
+
+# Scripts import each other as top-level modules, so put the scripts directory on sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "scripts")))
+
+from storage import Storage
+from job_queue import CLAIMED, DONE, FAILED, PENDING, JobQueue
+from records import Flashcard, Highlight
+from main import Pipeline
+from test_flashcard_generator import FakeProvider
+from test_retry_policy import AuthenticationError
+from test_pdf_handler import make_highlighted_pdf
+
+
+def make_highlights(n, pdf_id="pdf"):
+    return [Highlight(f"id{i}", f"highlight {i}", i // 2 + 1, pdf_id, (1.0, 2.0, 3.5, 4.0)) for i in range(n)]
+
+
+def cards_for(highlight, n=2):
+    return [Flashcard(f"q{i}", f"a{i}", highlight, "book.pdf", f"img{i}.jpg") for i in range(n)]
+
+
+class TestJobQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.storage = Storage(os.path.join(self.tmp_dir.name, "tracked_files.db"))
+
+    def tearDown(self):
+        self.storage.close()
+        self.tmp_dir.cleanup()
+
+    def test_workers_claim_disjoint_highlights(self):
+        highlights = make_highlights(10)
+        first = JobQueue(self.storage, owner="a")
+        second = JobQueue(self.storage, owner="b")
+
+        self.assertEqual(first.claim(highlights[:4]), highlights[:4])
+        self.assertEqual(second.claim(highlights), highlights[4:])
+        self.assertEqual(first.claim(highlights), [])
+        self.assertEqual(first.counts("pdf"), {CLAIMED: 10})
+
+    def test_cards_are_stored_with_the_job(self):
+        highlights = make_highlights(3)
+        queue = JobQueue(self.storage, owner="a")
+        queue.claim(highlights)
+        queue.complete(highlights[0], cards_for(highlights[0]))
+        queue.complete(highlights[1], [])
+
+        self.assertEqual(queue.counts("pdf"), {DONE: 1, FAILED: 1, CLAIMED: 1})
+        self.assertTrue(self.storage.highlight_exists("id0"))
+        self.assertFalse(self.storage.highlight_exists("id1"))
+        self.assertEqual(queue.cards("pdf"), cards_for(highlights[0]))
+
+        queue.mark_exported(queue.cards("pdf"))
+        self.assertEqual(queue.cards("pdf", unexported_only=True), [])
+        self.assertEqual(len(queue.cards("pdf")), 2)
+
+    def test_done_jobs_are_not_claimed_again(self):
+        highlights = make_highlights(2)
+        queue = JobQueue(self.storage, owner="a")
+        queue.claim(highlights)
+        queue.complete(highlights[0], cards_for(highlights[0]))
+        self.assertEqual(queue.release([h.highlight_id for h in highlights]), 1)
+
+        self.assertEqual(JobQueue(self.storage, owner="b").claim(highlights), highlights[1:])
+
+    def test_failed_jobs_are_retried_by_later_runs(self):
+        highlights = make_highlights(1)
+        queue = JobQueue(self.storage, owner="a")
+        queue.claim(highlights)
+        queue.fail(highlights[0], "no flashcards generated")
+
+        self.assertEqual(queue.claim(highlights), [])
+        later = JobQueue(self.storage, owner="b")
+        later.started_at += 1
+        self.assertEqual(later.claim(highlights), highlights)
+
+    def test_expired_leases_are_taken_over(self):
+        highlights = make_highlights(3)
+        JobQueue(self.storage, owner="crashed-host:1", lease_seconds=-1).claim(highlights)
+        self.assertEqual(JobQueue(self.storage, owner="b").claim(highlights), highlights)
+
+    def test_release_is_scoped_to_the_given_claims(self):
+        book_a, book_b = make_highlights(3, "a"), make_highlights(3, "b")
+        for highlight in book_b:
+            highlight.highlight_id += "b"
+        queue = JobQueue(self.storage, owner="a")
+        queue.claim(book_a + book_b)
+
+        # Finishing book A leaves the claims book B is still working on alone
+        queue.release([h.highlight_id for h in book_a])
+        self.assertEqual(queue.counts("a"), {PENDING: 3})
+        self.assertEqual(queue.counts("b"), {CLAIMED: 3})
+
+    def test_lost_claims_do_not_overwrite_the_new_owner(self):
+        highlights = make_highlights(1)
+        stale = JobQueue(self.storage, owner="stale", lease_seconds=-1)
+        stale.claim(highlights)
+        current = JobQueue(self.storage, owner="current")
+        current.claim(highlights)
+        current.complete(highlights[0], cards_for(highlights[0], n=1))
+
+        self.assertFalse(stale.complete(highlights[0], cards_for(highlights[0], n=3)))
+        self.assertFalse(stale.fail(highlights[0], "late"))
+        self.assertEqual(len(current.cards("pdf")), 1)
+        self.assertEqual(current.counts("pdf"), {DONE: 1})
+
+    def test_workers_on_other_hosts_are_refused(self):
+        highlights = make_highlights(2)
+        JobQueue(self.storage, owner="other-host:1").claim(highlights[:1])
+
+        with self.assertRaises(RuntimeError):
+            JobQueue(self.storage).claim(highlights)
+
+    def test_claims_of_dead_local_workers_are_released(self):
+        process = subprocess.Popen([sys.executable, "-c", "pass"])
+        process.wait()
+        highlights = make_highlights(3)
+        JobQueue(self.storage, owner=f"{socket.gethostname()}:{process.pid}").claim(highlights)
+        JobQueue(self.storage, owner=f"{socket.gethostname()}:{os.getppid()}").claim(highlights[:1])
+
+        # The live worker keeps its claim
+        self.assertEqual(JobQueue(self.storage, owner="b").claim(highlights), highlights[1:])
+
+    def test_deleting_history_clears_jobs_and_cards(self):
+        highlights = make_highlights(2)
+        queue = JobQueue(self.storage, owner="a")
+        queue.claim(highlights)
+        for highlight in highlights:
+            queue.complete(highlight, cards_for(highlight))
+
+        self.assertEqual(self.storage.delete_last_highlights("pdf", 1), 1)
+        self.assertEqual(queue.counts("pdf"), {DONE: 1})
+        self.assertEqual(self.storage.delete_highlights("pdf"), 1)
+        self.assertEqual(queue.counts("pdf"), {})
+        self.assertEqual(queue.cards("pdf"), [])
+        self.assertEqual(queue.claim(highlights), highlights)
+
+
+def deck_note_count(apkg_path):
+    with zipfile.ZipFile(apkg_path) as apkg, tempfile.TemporaryDirectory() as tmp_dir:
+        collection = apkg.extract("collection.anki2", tmp_dir)
+        conn = sqlite3.connect(collection)
+        try:
+            return conn.execute("SELECT COUNT(*) FROM notes").fetchone()[0]
+        finally:
+            conn.close()
+
+
+class DyingProvider(FakeProvider):
+    """Answers `answers` prompts, then fails as if its API key had been revoked"""
+
+    def __init__(self, answers):
+        super().__init__(latency=0)
+        self.answers = answers
+
+    def generate_text(self, prompt: str) -> str:
+        with self._lock:
+            self.calls += 1
+            if self.calls > self.answers:
+                raise AuthenticationError(401)
+        return "Q: q?\nA: a"
+
+
+class TestResume(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.pdf_path = os.path.join(self.tmp_dir.name, "book.pdf")
+        make_highlighted_pdf(self.pdf_path, pages=4, highlights_per_page=2)
+        self.db_path = os.path.join(self.tmp_dir.name, "tracked_files.db")
+        # Context images and decks are written to the working directory
+        cwd = os.getcwd()
+        os.chdir(self.tmp_dir.name)
+        self.addCleanup(os.chdir, cwd)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def run_pipeline(self, provider, **kwargs):
+        pipeline = Pipeline(
+            "English", concurrency=1, requests_per_minute=0, use_cache=False, image_workers=1,
+            llm_provider=provider, db_path=self.db_path, **kwargs,
+        )
+        try:
+            return pipeline.process_pdf(self.pdf_path), pipeline
+        finally:
+            pipeline.close()
+
+    def test_interrupted_runs_resume_without_redoing_work(self):
+        summary, pipeline = self.run_pipeline(DyingProvider(answers=3))
+        self.assertIn("error", summary)
+        self.assertEqual(summary["cards"], 3)
+        self.assertEqual(pipeline.job_queue.counts(pipeline.identity.pdf_id(self.pdf_path)), {DONE: 3, PENDING: 5})
+
+        # The next run crashes while writing its deck, after its cards were stored
+        provider = FakeProvider(latency=0)
+        with unittest.mock.patch(
+            "flashcard_output_to_anki_handler.FlashcardOutputHandler.write_deck", side_effect=OSError("disk full")
+        ):
+            with self.assertRaises(OSError):
+                self.run_pipeline(provider)
+        self.assertEqual(provider.calls, 5)
+
+        # Resumed: no LLM calls, and the deck gets the cards the crashed run stored
+        provider = FakeProvider(latency=0)
+        summary, _ = self.run_pipeline(provider)
+        self.assertEqual(provider.calls, 0)
+        self.assertEqual(summary["cards"], 0)
+        self.assertTrue(os.path.exists("book.pdf.apkg"))
+
+        summary, _ = self.run_pipeline(provider)
+        self.assertEqual(provider.calls, 0)
+
+    def test_each_deck_holds_the_whole_book(self):
+        self.run_pipeline(DyingProvider(answers=3))
+        self.assertEqual(deck_note_count("book.pdf.apkg"), 3)
+
+        # A later run, e.g. another worker, overwrites the deck with every stored card
+        self.run_pipeline(FakeProvider(latency=0))
+        self.assertEqual(deck_note_count("book.pdf.apkg"), 8)
+        self.assertEqual([f for f in os.listdir() if f.endswith(".partial")], [])
+
+    def test_deck_rebuilds_from_stored_cards(self):
+        self.run_pipeline(FakeProvider(latency=0))
+        os.remove("book.pdf.apkg")
+
+        pipeline = Pipeline("English", use_cache=False, db_path=self.db_path)
+        try:
+            self.assertEqual(pipeline.rebuild_deck(self.pdf_path), 8)
+        finally:
+            pipeline.close()
+        self.assertTrue(os.path.exists("book.pdf.apkg"))
+
+
+if __name__ == "__main__":
+    unittest.main()
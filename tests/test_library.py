@@ -0,0 +1,83 @@
+import unittest
+import sys
+import os
+import tempfile
+import threading
+import time
+
+# Scripts import each other as top-level modules, so put the scripts directory on sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "scripts")))
+
+from library import discover_pdfs, process_library
+
+
+class StubPipeline:
+    """Records which books were processed and how many ran at once"""
+
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+        self.processed = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def process_pdf(self, pdf_path):
+        with self.lock:
+            self.processed.append(pdf_path)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(0.02)
+        with self.lock:
+            self.in_flight -= 1
+        if pdf_path in self.fail:
+            raise RuntimeError("broken pdf")
+        return {"pdf_path": pdf_path, "new_highlights": 1, "cards": 2, "api_calls": 1, "cache_hits": 0, "seconds": 0.02}
+
+
+class TestLibrary(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        root = self.tmp_dir.name
+        os.makedirs(os.path.join(root, "shelf", "nested"))
+        for rel_path in ["a.pdf", "shelf/b.PDF", "shelf/nested/c.pdf", "shelf/notes.txt"]:
+            with open(os.path.join(root, rel_path), "w") as f:
+                f.write("x")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_discovers_pdfs_in_directories_and_globs_once(self):
+        root = os.path.realpath(self.tmp_dir.name)
+        found = discover_pdfs([
+            os.path.join(root, "shelf"),
+            os.path.join(root, "*.pdf"),
+            os.path.join(root, "shelf", "nested", "c.pdf"),
+        ])
+        self.assertEqual(found, [
+            os.path.join(root, "shelf", "b.PDF"),
+            os.path.join(root, "shelf", "nested", "c.pdf"),
+            os.path.join(root, "a.pdf"),
+        ])
+
+    def test_failed_book_does_not_stop_the_run(self):
+        pipeline = StubPipeline(fail={"b.pdf"})
+        summaries = process_library(pipeline, ["a.pdf", "b.pdf", "c.pdf", "d.pdf"], books_in_parallel=2)
+
+        self.assertEqual([s["pdf_path"] for s in summaries], ["a.pdf", "b.pdf", "c.pdf", "d.pdf"])
+        self.assertEqual(summaries[1]["error"], "broken pdf")
+        self.assertEqual(sum(s.get("cards", 0) for s in summaries), 6)
+        self.assertLessEqual(pipeline.max_in_flight, 2)
+
+    def test_books_sharing_a_file_name_are_refused(self):
+        pipeline = StubPipeline()
+        summaries = process_library(pipeline, ["a/notes.pdf", "b/notes.pdf", "c.pdf"])
+
+        self.assertEqual(pipeline.processed, ["c.pdf"])
+        self.assertIn("notes.pdf", summaries[0]["error"])
+        self.assertIn("notes.pdf", summaries[1]["error"])
+        self.assertEqual(summaries[2]["cards"], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import unittest
+import sys
+import os
+import tempfile
+
+# Scripts import each other as top-level modules, so put the scripts directory on sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "scripts")))
+
+from storage import Storage
+from monitor_files import FileMonitor
+
+
+class TestFileMonitor(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmp_dir.name, "library")
+        for directory in ["a", "b", "elsewhere/deep"]:
+            os.makedirs(os.path.join(self.root, directory))
+        self.storage = Storage(os.path.join(self.tmp_dir.name, "tracked_files.db"))
+
+    def tearDown(self):
+        self.storage.close()
+        self.tmp_dir.cleanup()
+
+    def track(self, rel_path):
+        path = os.path.join(self.root, rel_path)
+        with open(path, "w") as f:
+            f.write(rel_path)
+        inode = os.stat(path).st_ino
+        with self.storage.transaction() as conn:
+            conn.execute("INSERT INTO tracked_files (inode, file_path) VALUES (?, ?)", (inode, path))
+        return inode
+
+    def stored_path(self, inode):
+        return self.storage.query("SELECT file_path FROM tracked_files WHERE inode = ?", (inode,))[0][0]
+
+    def make_monitor(self):
+        monitor = FileMonitor(self.storage, self.root, coalesce_ms=50)
+        self.addCleanup(monitor.inotify.close)
+        return monitor
+
+    def test_renames_between_watched_directories_follow_cookies(self):
+        first = self.track("a/one.pdf")
+        second = self.track("a/two.pdf")
+        self.track("b/three.pdf")
+        monitor = self.make_monitor()
+
+        os.rename(os.path.join(self.root, "a/one.pdf"), os.path.join(self.root, "a/renamed.pdf"))
+        os.rename(os.path.join(self.root, "a/two.pdf"), os.path.join(self.root, "b/two.pdf"))
+        moves = monitor.poll(timeout=1000)
+
+        self.assertEqual(moves, {
+            first: os.path.join(self.root, "a/renamed.pdf"),
+            second: os.path.join(self.root, "b/two.pdf"),
+        })
+        self.assertEqual(self.stored_path(second), os.path.join(self.root, "b/two.pdf"))
+        self.assertEqual(monitor.index.scans, 0)
+
+    def test_move_out_of_watched_directories_uses_one_index_scan(self):
+        first = self.track("a/one.pdf")
+        second = self.track("a/two.pdf")
+        monitor = self.make_monitor()
+
+        for name in ["one.pdf", "two.pdf"]:
+            os.rename(os.path.join(self.root, "a", name), os.path.join(self.root, "elsewhere/deep", name))
+        moves = monitor.poll(timeout=1000)
+
+        self.assertEqual(moves, {
+            first: os.path.join(self.root, "elsewhere/deep/one.pdf"),
+            second: os.path.join(self.root, "elsewhere/deep/two.pdf"),
+        })
+        self.assertEqual(monitor.index.scans, 1)
+
+        # The new directory is watched now, so the next rename needs no scan
+        os.rename(os.path.join(self.root, "elsewhere/deep/one.pdf"), os.path.join(self.root, "elsewhere/deep/uno.pdf"))
+        self.assertEqual(monitor.poll(timeout=1000), {first: os.path.join(self.root, "elsewhere/deep/uno.pdf")})
+        self.assertEqual(monitor.index.scans, 1)
+
+    def test_moves_while_stopped_resolve_from_persistent_index(self):
+        inode = self.track("a/one.pdf")
+        self.make_monitor().index.rebuild()
+
+        # Moved while no monitor was running, so the stored index is stale
+        os.rename(os.path.join(self.root, "a/one.pdf"), os.path.join(self.root, "b/one.pdf"))
+        monitor = self.make_monitor()
+
+        self.assertEqual(monitor.tracked[inode], os.path.join(self.root, "b/one.pdf"))
+        self.assertEqual(self.stored_path(inode), os.path.join(self.root, "b/one.pdf"))
+        self.assertEqual(monitor.index.scans, 1)
+
+        # A later restart finds it straight from the stored index
+        self.assertEqual(self.make_monitor().index.lookup(inode), os.path.join(self.root, "b/one.pdf"))
+
+    def test_deleted_file_is_dropped(self):
+        inode = self.track("a/one.pdf")
+        monitor = self.make_monitor()
+
+        os.remove(os.path.join(self.root, "a/one.pdf"))
+        self.assertEqual(monitor.poll(timeout=1000), {})
+        self.assertNotIn(inode, monitor.tracked)
+
+
+if __name__ == '__main__':
+    unittest.main()
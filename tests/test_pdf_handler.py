@@ -1,25 +1,48 @@
 import unittest
 import sys
 import os
+import tempfile
+
+import fitz
 
 # Add the parent directory (AutoFlashcards) to the sys.path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+# Scripts import each other as top-level modules
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "scripts")))
 
 from scripts.pdf_handler import PDFHandler
+from extraction_index import ExtractionIndex
+from storage import Storage
+
+
+def make_highlighted_pdf(path, pages=10, highlights_per_page=3):
+    """Write a small PDF with a few highlighted lines on every page"""
+    doc = fitz.open()
+    for page_num in range(pages):
+        page = doc.new_page()
+        for line in range(highlights_per_page):
+            point = fitz.Point(72, 72 + 40 * line)
+            page.insert_text(point, f"Page {page_num} line {line} text")
+            quads = page.search_for(f"Page {page_num} line {line} text")
+            page.add_highlight_annot(quads)
+    doc.save(path)
+    doc.close()
 
 
 class TestPDFHandler(unittest.TestCase):
 
     def setUp(self):
-        self.pdf_handler = PDFHandler("../sample_01.pdf")
+        self.pdf_handler = PDFHandler(os.path.join(os.path.dirname(__file__), "sample_01.pdf"))
+        self.addCleanup(self.pdf_handler.close)
 
     def test_extract_highlights(self):
         highlights = self.pdf_handler.extract_highlights()
         print(f"Test Extract Highlights: {highlights}")  # Print statement for debugging
         self.assertIsInstance(highlights, list)
+        self.assertGreater(len(highlights), 0)
         for highlight in highlights:
-            self.assertIn("text", highlight)
-            self.assertIn("page", highlight)
+            self.assertTrue(highlight.text)
+            self.assertGreater(highlight.page, 0)
 
     def test_get_text_by_pages(self):
         text = self.pdf_handler.get_text_by_pages(0, 2)
@@ -28,5 +51,63 @@ class TestPDFHandler(unittest.TestCase):
         self.assertGreater(len(text), 0)
 
 
+class TestPageTextCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.pdf_path = os.path.join(self.tmp_dir.name, "book.pdf")
+        make_highlighted_pdf(self.pdf_path, pages=10, highlights_per_page=3)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_cache_is_bounded(self):
+        pdf_handler = PDFHandler(self.pdf_path, page_cache_size=2)
+        pdf_handler.get_text_by_pages(0, 9)
+        self.assertEqual(len(pdf_handler._page_text_cache), 2)
+
+
+class TestParallelScan(unittest.TestCase):
+
+    def test_parallel_scan_matches_serial_scan(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            pdf_path = os.path.join(tmp_dir, "book.pdf")
+            make_highlighted_pdf(pdf_path, pages=60, highlights_per_page=2)
+            storage = Storage(os.path.join(tmp_dir, "tracked_files.db"))
+            try:
+                serial = PDFHandler(pdf_path).extract_highlights()
+
+                pdf_handler = PDFHandler(pdf_path, index=ExtractionIndex(storage), scan_workers=2)
+                pdf_handler.parallel_scan_min_pages = 0
+                parallel = pdf_handler.extract_highlights()
+
+                self.assertEqual(parallel, serial)
+                # The index is filled as by a serial scan
+                self.assertEqual(len(ExtractionIndex(storage).get_pages(pdf_handler.pdf_id)), 60)
+            finally:
+                storage.close()
+
+
+class TestHighlightText(unittest.TestCase):
+
+    def test_multi_line_highlight_reads_only_its_quads(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            pdf_path = os.path.join(tmp_dir, "book.pdf")
+            doc = fitz.open()
+            page = doc.new_page()
+            page.insert_text(fitz.Point(72, 100), "Unmarked start of the line, marked end")
+            page.insert_text(fitz.Point(72, 120), "continues here but stops before this")
+            end = page.search_for("marked end")[0]
+            start = page.search_for("continues here")[0]
+            page.add_highlight_annot([end, start])
+            doc.save(pdf_path)
+            doc.close()
+
+            highlights = PDFHandler(pdf_path).extract_highlights()
+
+            self.assertEqual(len(highlights), 1)
+            self.assertEqual(highlights[0].text, "marked end\ncontinues here")
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,113 @@
+import unittest
+import unittest.mock
+import sys
+import os
+import sqlite3
+import tempfile
+
+import fitz
+
+# Scripts import each other as top-level modules, so put the scripts directory on sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "scripts")))
+
+from storage import Storage
+from extraction_index import ExtractionIndex
+from pdf_handler import PDFHandler
+from pdf_identity import PDFIdentity
+from highlight_manager import HighlightManager
+from test_pdf_handler import make_highlighted_pdf
+
+
+class TestPDFIdentity(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, "tracked_files.db")
+        self.pdf_path = os.path.join(self.tmp_dir.name, "book.pdf")
+        make_highlighted_pdf(self.pdf_path, pages=6, highlights_per_page=1)
+        self.storage = Storage(self.db_path)
+
+    def tearDown(self):
+        self.storage.close()
+        self.tmp_dir.cleanup()
+
+    def test_lookups_are_memoized_by_file_version(self):
+        identity = PDFIdentity(self.storage)
+        pdf_id = identity.pdf_id(self.pdf_path)
+        self.assertEqual(identity.pdf_id(self.pdf_path), pdf_id)
+        self.assertEqual(identity.fingerprints_computed, 1)
+
+    def test_pdf_id_survives_adding_highlights(self):
+        identity = PDFIdentity(self.storage)
+        pdf_id = identity.pdf_id(self.pdf_path)
+
+        doc = fitz.open(self.pdf_path)
+        page = doc.load_page(0)
+        page.add_highlight_annot(page.search_for("Page 0 line 0 text"))
+        doc.saveIncr()
+        doc.close()
+
+        self.assertEqual(identity.pdf_id(self.pdf_path), pdf_id)
+        self.assertEqual(identity.fingerprints_computed, 2)
+
+    def test_pdf_id_survives_the_first_highlight_of_a_pdf_without_id(self):
+        doc = fitz.open()
+        for page_num in range(3):
+            doc.new_page().insert_text(fitz.Point(72, 72), f"Page {page_num} text")
+        doc.save(self.pdf_path, no_new_id=True)
+        doc.close()
+        identity = PDFIdentity(self.storage)
+        pdf_id = identity.pdf_id(self.pdf_path)
+
+        doc = fitz.open(self.pdf_path)
+        page = doc.load_page(0)
+        page.add_highlight_annot(page.search_for("Page 0 text"))
+        doc.saveIncr()
+        doc.close()
+
+        self.assertEqual(identity.pdf_id(self.pdf_path), pdf_id)
+        self.assertEqual(identity.fingerprints_computed, 2)
+
+    def test_existing_pdf_ids_are_kept(self):
+        legacy_id = PDFHandler(self.pdf_path).pdf_id
+        self.storage.insert_highlights([("h1", legacy_id, 1, "Rect(0.0, 0.0, 1.0, 1.0)", "text")])
+        self.storage.close()
+
+        # Reopen as a database from before fingerprints
+        conn = sqlite3.connect(self.db_path)
+        for table in ["pdf_fingerprints", "legacy_pdf_ids"]:
+            conn.execute(f"DROP TABLE {table}")
+        conn.execute("ALTER TABLE file_index DROP COLUMN scanned")
+        conn.execute("PRAGMA user_version = 4")
+        conn.close()
+        self.storage = Storage(self.db_path)
+
+        self.assertEqual(PDFIdentity(self.storage).pdf_id(self.pdf_path), legacy_id)
+        manager = HighlightManager(self.db_path)
+        self.addCleanup(manager.storage.close)
+        self.assertEqual(manager.get_highlight_count(self.pdf_path), 1)
+
+    def test_identified_files_are_still_scanned(self):
+        index = ExtractionIndex(self.storage)
+        identity = PDFIdentity(self.storage)
+        pdf_id = identity.pdf_id(self.pdf_path)
+        self.assertIsNone(index.lookup_pdf_id(self.pdf_path))
+
+        pdf_handler = PDFHandler(self.pdf_path, index=index, identity=identity)
+        self.assertFalse(pdf_handler.unchanged)
+        self.assertEqual(len(pdf_handler.extract_highlights()), 6)
+        self.assertEqual(index.lookup_pdf_id(self.pdf_path), pdf_id)
+        self.assertEqual(self.storage.query("SELECT COUNT(*) FROM file_index")[0][0], 1)
+
+    def test_new_pdfs_do_not_need_their_text(self):
+        other_path = os.path.join(self.tmp_dir.name, "other.pdf")
+        make_highlighted_pdf(other_path, pages=6, highlights_per_page=1)
+        identity = PDFIdentity(self.storage)
+
+        with unittest.mock.patch("pdf_identity.text_fingerprint") as text_fingerprint:
+            self.assertNotEqual(identity.pdf_id(self.pdf_path), identity.pdf_id(other_path))
+        text_fingerprint.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+import unittest
+import sys
+import os
+import json
+import tempfile
+import time
+
+# Scripts import each other as top-level modules, so put the scripts directory on sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "scripts")))
+
+import profiler
+from profiler import NullProfiler, Profiler, percentile
+from flashcard_generator import FlashcardGenerator
+from highlight_context_extractor import HighlightContextExtractor
+from pdf_handler import PDFHandler
+from retry_policy import RetryPolicy
+from storage import Storage
+from test_retry_policy import APIStatusError, FailingProvider
+from test_pdf_handler import make_highlighted_pdf
+
+
+class TestProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.profiler = profiler.enable_profiling()
+        self.addCleanup(setattr, profiler, "_current", NullProfiler())
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_percentiles(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 95), 95)
+        self.assertEqual(percentile([3], 95), 3)
+        self.assertEqual(percentile([], 50), 0.0)
+
+    def test_summary_aggregates_stages(self):
+        for i in range(20):
+            with self.profiler.span("llm_call", highlight_ids=[f"id{i}"], prompt_tokens=100) as span:
+                span["response_tokens"] = 10
+        self.profiler.record("parse", time.perf_counter(), 0.5)
+
+        summary = self.profiler.summary()
+        self.assertEqual(list(summary), ["llm_call", "parse"])  # pipeline order
+        self.assertEqual(summary["llm_call"]["count"], 20)
+        self.assertEqual(summary["llm_call"]["prompt_tokens"], 2000)
+        self.assertEqual(summary["llm_call"]["response_tokens"], 200)
+        self.assertLessEqual(summary["llm_call"]["p50"], summary["llm_call"]["p95"])
+        self.assertEqual(summary["parse"]["p95"], 0.5)
+
+    def test_trace_is_chrome_trace_json(self):
+        with self.profiler.span("context_build", highlight_id="abc"):
+            pass
+        path = os.path.join(self.tmp_dir.name, "trace.json")
+        self.profiler.write_trace(path)
+
+        with open(path) as f:
+            events = json.load(f)["traceEvents"]
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0]["name"], "context_build")
+        self.assertEqual(events[0]["ph"], "X")
+        self.assertEqual(events[0]["args"], {"highlight_id": "abc"})
+        self.assertGreaterEqual(events[0]["dur"], 0)
+
+    def test_pipeline_stages_are_recorded(self):
+        pdf_path = os.path.join(self.tmp_dir.name, "book.pdf")
+        make_highlighted_pdf(pdf_path, pages=3, highlights_per_page=2)
+        storage = Storage(os.path.join(self.tmp_dir.name, "tracked_files.db"))
+        self.addCleanup(storage.close)
+
+        pdf_handler = PDFHandler(pdf_path)
+        self.addCleanup(pdf_handler.close)
+        highlights = list(pdf_handler.iter_highlights())
+        contexts = HighlightContextExtractor(pdf_handler, token_budget=100).get_contexts(highlights)
+
+        provider = FailingProvider([APIStatusError(503)])
+        generator = FlashcardGenerator(
+            provider, requests_per_minute=0, storage=storage, retry_policy=RetryPolicy(sleep=lambda delay: None)
+        )
+        generator.generate_flashcards(contexts[:1], "English")
+
+        summary = self.profiler.summary()
+        for stage in ["pdf_open", "pdf_id", "annotation_scan", "context_build", "llm_call", "parse", "db"]:
+            self.assertIn(stage, summary)
+        self.assertEqual(summary["annotation_scan"]["highlights"], 6)
+        self.assertEqual(summary["context_build"]["count"], 6)
+        self.assertEqual(summary["llm_call"]["retries"], 1)
+        self.assertGreater(summary["llm_call"]["prompt_tokens"], 0)
+        llm_events = [args for stage, _, _, _, args in self.profiler.events if stage == "llm_call"]
+        self.assertEqual(llm_events[0]["highlight_ids"], [contexts[0].highlight_id])
+
+
+class TestNullProfiler(unittest.TestCase):
+
+    def test_disabled_profiler_is_cheap(self):
+        def seconds_per_span(profiler_, n=20000):
+            start = time.perf_counter()
+            for i in range(n):
+                with profiler_.span("context_build", highlight_id="abc") as span:
+                    span["tokens_saved"] = i
+            return (time.perf_counter() - start) / n
+
+        # Relative to a recording profiler, so the check holds on slow machines too
+        self.assertLess(seconds_per_span(NullProfiler()), seconds_per_span(Profiler()))
+        self.assertFalse(profiler.get_profiler().enabled)
+
+
+if __name__ == "__main__":
+    unittest.main()
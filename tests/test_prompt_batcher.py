@@ -0,0 +1,24 @@
+import unittest
+import sys
+import os
+
+# Scripts import each other as top-level modules, so put the scripts directory on sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "scripts")))
+
+from prompt_batcher import PROMPT_OVERHEAD_TOKENS, build_prompt_batches, estimate_tokens
+from test_flashcard_generator import make_contexts
+
+
+class TestPromptBatcher(unittest.TestCase):
+
+    def test_prompt_batches_respect_token_budget(self):
+        contexts = make_contexts(20, pages_per_context=5)
+        batches = build_prompt_batches(contexts, lambda page_num: "x" * 4000, max_tokens=4000)
+        for batch in batches:
+            self.assertLessEqual(estimate_tokens(batch.context) + PROMPT_OVERHEAD_TOKENS, 4000)
+        self.assertGreater(len(batches), 1)
+        self.assertEqual(sum(len(batch.contexts) for batch in batches), len(contexts))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+import sys
+import os
+import tempfile
+import time
+
+# Scripts import each other as top-level modules, so put the scripts directory on sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "scripts")))
+
+from response_cache import ResponseCache
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_evicts_least_recently_used_entries(self):
+        cache = ResponseCache(self.tmp_dir.name)
+        for i, key in enumerate(["a", "b", "c"]):
+            cache.put(key, "x" * 100)
+            os.utime(cache._path(key), (i, i))
+        # Room for three and a half entries
+        cache.max_bytes = cache.total_bytes * 7 // 6
+        self.assertIsNotNone(cache.get("a"))  # refreshes "a"
+
+        cache.put("d", "x" * 100)
+
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("a"))
+        self.assertEqual(cache.stats()["evictions"], 1)
+        self.assertLessEqual(cache.total_bytes, cache.max_bytes)
+
+    def test_expired_entries_are_misses(self):
+        cache = ResponseCache(self.tmp_dir.name, ttl=0)
+        cache.put("a", "response")
+        time.sleep(0.01)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["entries"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+import unittest
+import sys
+import os
+import tempfile
+
+# Scripts import each other as top-level modules, so put the scripts directory on sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "scripts")))
+
+from flashcard_generator import FlashcardGenerator
+from storage import Storage
+from retry_policy import (
+    FATAL, RATE_LIMITED, RETRYABLE, CircuitBreaker, ProviderUnavailableError, RetryPolicy, classify_error,
+)
+from test_flashcard_generator import FakeProvider, make_contexts
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class APIStatusError(Exception):
+    """Shaped like the provider SDKs' HTTP errors"""
+
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = FakeResponse(status_code, headers)
+
+
+class AuthenticationError(APIStatusError):
+    pass
+
+
+class FailingProvider(FakeProvider):
+    """Raises the given errors in turn, then answers"""
+
+    def __init__(self, errors):
+        super().__init__(latency=0)
+        self.errors = list(errors)
+
+    def generate_text(self, prompt: str) -> str:
+        with self._lock:
+            self.calls += 1
+            error = self.errors.pop(0) if self.errors else None
+        if error is not None:
+            raise error
+        return "Q: q?\nA: a"
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.storage = Storage(os.path.join(self.tmp_dir.name, "tracked_files.db"))
+        self.sleeps = []
+
+    def tearDown(self):
+        self.storage.close()
+        self.tmp_dir.cleanup()
+
+    def make_generator(self, provider, **policy_options):
+        policy = RetryPolicy(sleep=self.sleeps.append, **policy_options)
+        return FlashcardGenerator(provider, requests_per_minute=0, storage=self.storage, retry_policy=policy)
+
+    def test_errors_are_classified(self):
+        self.assertEqual(classify_error(APIStatusError(429)), RATE_LIMITED)
+        self.assertEqual(classify_error(APIStatusError(529)), RETRYABLE)
+        self.assertEqual(classify_error(APIStatusError(400)), FATAL)
+        self.assertEqual(classify_error(AuthenticationError(401)), FATAL)
+        self.assertEqual(classify_error(ConnectionResetError()), RETRYABLE)
+        self.assertEqual(classify_error(ValueError("bad model output")), FATAL)
+
+    def test_transient_errors_are_retried_and_timed(self):
+        provider = FailingProvider([APIStatusError(503), APIStatusError(429, {"retry-after": "7"})])
+        stats = {}
+        results = self.make_generator(provider).generate_flashcards(make_contexts(1), "English", stats=stats)
+
+        self.assertEqual(results[0][0].answer, "a")
+        self.assertEqual(provider.calls, 3)
+        self.assertEqual(stats["retries"], 2)
+        # The rate limit's retry-after is honored
+        self.assertAlmostEqual(self.sleeps[-1], 7, places=1)
+        self.assertAlmostEqual(stats["retry_seconds"], sum(self.sleeps))
+
+    def test_fatal_errors_are_not_retried(self):
+        provider = FailingProvider([APIStatusError(400)])
+        results = self.make_generator(provider).generate_flashcards(make_contexts(2), "English")
+
+        self.assertEqual(provider.calls, 2)
+        self.assertEqual(results[0], [])
+        self.assertEqual(results[1][0].answer, "a")
+        self.assertEqual(self.sleeps, [])
+
+    def test_dead_provider_stops_the_run(self):
+        provider = FailingProvider([AuthenticationError(401)] * 100)
+        generator = self.make_generator(provider)
+
+        with self.assertRaises(ProviderUnavailableError):
+            generator.generate_flashcards(make_contexts(50), "English")
+        self.assertEqual(provider.calls, 1)
+        self.assertEqual(self.sleeps, [])
+
+    def test_breaker_opens_after_consecutive_failures(self):
+        breaker = CircuitBreaker(failure_threshold=2, cooldown=0)
+        policy = RetryPolicy(max_attempts=1, breaker=breaker, sleep=self.sleeps.append)
+
+        def fail():
+            raise APIStatusError(503)
+
+        with self.assertRaises(APIStatusError):
+            policy.call(fail)
+        with self.assertRaises(ProviderUnavailableError):
+            policy.call(fail)
+        # Half-open after the cooldown: a successful trial closes it again
+        self.assertEqual(policy.call(lambda: "ok"), "ok")
+        self.assertFalse(breaker.is_open)
+
+    def test_bad_requests_do_not_open_the_breaker(self):
+        provider = FailingProvider([APIStatusError(400)] * 10)
+        generator = self.make_generator(provider)
+        generator.retry_policy.breaker.failure_threshold = 2
+
+        results = generator.generate_flashcards(make_contexts(12), "English")
+        self.assertEqual(sum(len(cards) for cards in results), 2)
+        self.assertFalse(generator.retry_policy.breaker.is_open)
+
+
+if __name__ == "__main__":
+    unittest.main()
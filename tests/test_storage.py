@@ -0,0 +1,73 @@
+import unittest
+import sys
+import os
+import sqlite3
+import tempfile
+import threading
+
+# Scripts import each other as top-level modules, so put the scripts directory on sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "scripts")))
+
+from storage import MIGRATIONS, Storage
+
+
+class TestStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, "tracked_files.db")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_migrates_database_created_by_old_script(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("CREATE TABLE tracked_files (inode INTEGER PRIMARY KEY, file_path TEXT NOT NULL, alias TEXT)")
+        conn.execute(
+            "CREATE TABLE highlights (highlight_id TEXT PRIMARY KEY, pdf_id TEXT NOT NULL, "
+            "page INTEGER NOT NULL, rect TEXT NOT NULL, text TEXT NOT NULL)"
+        )
+        conn.execute("INSERT INTO highlights VALUES ('h1', 'pdf', 1, 'Rect(0, 0, 1, 1)', 'text')")
+        conn.commit()
+        conn.close()
+
+        storage = Storage(self.db_path)
+        self.assertEqual(storage.query("PRAGMA user_version")[0][0], len(MIGRATIONS))
+        self.assertEqual(storage.query("PRAGMA journal_mode")[0][0], "wal")
+        self.assertTrue(storage.highlight_exists("h1"))
+        self.assertEqual(storage.query("SELECT COUNT(*) FROM file_index")[0][0], 0)
+        storage.close()
+
+    def test_bulk_insert_and_lookup(self):
+        storage = Storage(self.db_path)
+        rows = [(f"h{i}", "pdf", i, "(0, 0, 1, 1)", f"text {i}") for i in range(2000)]
+        storage.insert_highlights(rows)
+
+        # Spans several IN (...) chunks
+        ids = [f"h{i}" for i in range(0, 4000, 2)]
+        self.assertEqual(storage.existing_ids(ids), {f"h{i}" for i in range(0, 2000, 2)})
+        self.assertEqual(storage.count_highlights("pdf"), 2000)
+        self.assertEqual(storage.delete_last_highlights("pdf", 5), 5)
+        self.assertFalse(storage.highlight_exists("h1999"))
+        storage.close()
+
+    def test_connection_is_shared_across_threads(self):
+        storage = Storage(self.db_path)
+
+        def insert(start):
+            storage.insert_highlights([
+                (f"h{i}", "pdf", i, "(0, 0, 1, 1)", "text") for i in range(start, start + 100)
+            ])
+
+        threads = [threading.Thread(target=insert, args=(n * 100,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(storage.count_highlights("pdf"), 800)
+        storage.close()
+
+
+if __name__ == "__main__":
+    unittest.main()